@@ -42,6 +42,7 @@ from hypothesis import given
 from hypothesis.strategies import integers
 from typing import Tuple
 from tm_trees import TMTree, FileSystemTree
+from tm_diff import ADDED, REMOVED, RESIZED, diff_trees, build_diff_tree
 
 
 # This should be the path to the "workshop" folder in the sample data.
@@ -129,6 +130,684 @@ def test_example_data_rectangles() -> None:
         assert expected_rects[i] == actual_rects[i]
 
 
+def test_diff_trees(tmp_path) -> None:
+    """Test that added, removed and resized files are reported between two
+    scans, and that unchanged folders are skipped.
+    """
+    _write_files(str(tmp_path / 'old'), {'a.txt': 10, 'same/b.txt': 5,
+                                         'gone/c.txt': 7})
+    _write_files(str(tmp_path / 'new'), {'a.txt': 25, 'same/b.txt': 5,
+                                         'new.txt': 3})
+    old = FileSystemTree(str(tmp_path / 'old'))
+    new = FileSystemTree(str(tmp_path / 'new'))
+
+    changes = {entry.names: (entry.kind, entry.delta)
+               for entry in diff_trees(old, new)}
+    assert changes == {('a.txt',): (RESIZED, 15),
+                       ('gone',): (REMOVED, -7),
+                       ('new.txt',): (ADDED, 3)}
+
+    diff_tree = build_diff_tree(old, new)
+    assert diff_tree.data_size == 25
+    assert len(diff_tree.get_rectangles()) == 3
+
+    from tm_bench import SyntheticTree
+    old = SyntheticTree('r', [SyntheticTree('x', [], 5),
+                              SyntheticTree('x', [], 7)])
+    new = SyntheticTree('r', [SyntheticTree('x', [], 5),
+                              SyntheticTree('x', [], 9),
+                              SyntheticTree('x', [], 1)])
+    entries = [(entry.names, entry.kind, entry.delta)
+               for entry in diff_trees(old, new)]
+    assert sorted(entries) == [(('x',), ADDED, 1), (('x',), RESIZED, 2)]
+    assert len(build_diff_tree(old, new).get_rectangles()) == 2
+
+
+def test_hash_tracks_changes(tmp_path) -> None:
+    """Test that the hash of a tree changes when a file inside it is resized
+    or moved, and matches a fresh scan of identical data.
+    """
+    _write_files(str(tmp_path / 'one'), {'a/x.txt': 10, 'b/y.txt': 20})
+    _write_files(str(tmp_path / 'two'), {'a/x.txt': 10, 'b/y.txt': 20})
+    tree = FileSystemTree(str(tmp_path / 'one'))
+    same = FileSystemTree(str(tmp_path / 'two'))
+    by_name = {t.get_name(): t.get_hash() for t in tree.get_subtrees()}
+    assert by_name == {t.get_name(): t.get_hash()
+                       for t in same.get_subtrees()}
+
+    original = tree.get_hash()
+    folder_a, folder_b = sorted(tree.get_subtrees(),
+                                key=lambda t: t.get_name())
+    leaf = folder_a._subtrees[0]
+    leaf.change_size(0.5)
+    assert tree.get_hash() != original
+    assert folder_b.get_hash() == _copy_tree(folder_b).get_hash()
+
+    leaf.move(folder_b)
+    assert leaf._parent_tree is folder_b
+    assert folder_b.get_hash() == _copy_tree(folder_b).get_hash()
+    assert tree.get_hash() == _copy_tree(tree).get_hash()
+
+
+def test_disk_usage_mode(tmp_path) -> None:
+    """Test that disk usage mode counts hard links once and does not follow
+    symbolic links back up the tree.
+    """
+    _write_files(str(tmp_path), {'d/a.txt': 5000})
+    os.link(str(tmp_path / 'd' / 'a.txt'), str(tmp_path / 'd' / 'b.txt'))
+    os.symlink('..', str(tmp_path / 'd' / 'loop'))
+
+    tree = FileSystemTree(str(tmp_path), disk_usage=True,
+                          one_file_system=True)
+    sizes = sorted(t.data_size for t in tree._subtrees[0]._subtrees)
+    assert sizes[:2] == [0, 0]
+    assert sizes[2] >= 5000
+    assert tree.data_size == sizes[2]
+
+
+def test_parallel_scan_matches_serial(tmp_path) -> None:
+    """Test that scanning with several processes builds the same tree as
+    scanning with one, even when folders are handed between processes.
+    """
+    import tm_trees
+    files = {'{}/{}/f{}.txt'.format(i, j, k): i + j + k
+             for i in range(3) for j in range(4) for k in range(5)}
+    _write_files(str(tmp_path), files)
+
+    old_budget = tm_trees._SHARD_BUDGET
+    tm_trees._SHARD_BUDGET = 3
+    try:
+        parallel = FileSystemTree(str(tmp_path), workers=2)
+    finally:
+        tm_trees._SHARD_BUDGET = old_budget
+    serial = FileSystemTree(str(tmp_path))
+    assert parallel.data_size == serial.data_size == sum(files.values())
+    assert parallel.get_hash() == serial.get_hash()
+
+    # A folder that vanishes before the process it was handed to scans it
+    # is left empty, as it is in a scan by one process, and is not counted
+    # as a file
+    import shutil
+    top = tm_trees._scan_records(str(tmp_path), False, None, 0, True)
+    gone = os.path.basename(top.deferred[0])
+    shutil.rmtree(top.deferred[0])
+    results = {folder: tm_trees._scan_deferred(folder, False, None, None,
+                                               True)
+               for folder in top.deferred}
+    columns = tm_trees.FileColumns()
+    tree = tm_trees._build_records(top, results, set(), columns)
+    vanished = next(t for t in tree._subtrees if t._name == gone)
+    assert vanished._subtrees == []
+    assert len(columns) == len(files) - 20
+    assert tree.data_size == vanished.data_size + sum(
+        size for path, size in files.items() if path.split('/')[0] != gone)
+
+
+def test_profiler_counts_phases(tmp_path) -> None:
+    """Test that the profiler records layout phases only while enabled.
+    """
+    from tm_profile import Profiler, PROFILER
+    _write_files(str(tmp_path), {'a.txt': 10, 'b/c.txt': 20})
+    tree = FileSystemTree(str(tmp_path))
+
+    PROFILER.next_frame()
+    tree.update_rectangles((0, 0, 100, 100))
+    PROFILER.next_frame()
+    assert PROFILER.summary() == {}
+
+    PROFILER.enable()
+    try:
+        tree.update_rectangles((0, 0, 100, 100))
+        tree.get_tree_at_position((50, 50))
+        PROFILER.next_frame()
+    finally:
+        PROFILER.disable()
+    summary = PROFILER.summary()
+    assert summary['update_rectangles'][1] == 1
+    assert summary['nodes laid out'][2] == 4
+    assert summary['get_tree_at_position'][1] == 1
+    assert summary['nodes visited'][2] == 4
+
+    small = Profiler(capacity=2)
+    small.enable()
+    for _ in range(5):
+        small.count('things', 1)
+    assert small.summary(0)['things'] == (0.0, 2, 2)
+
+
+def test_layout_matches_reference() -> None:
+    """Test that the sizes and rectangles of generated trees of several shapes
+    match those of the reference implementation in tm_bench.
+    """
+    from tm_bench import ExpansionModel, check_tree, deep_tree, skewed_tree, \
+        wide_tree
+    for tree in [wide_tree(500, fanout=7), deep_tree(300, depth=20),
+                 skewed_tree(500, seed=3)]:
+        assert check_tree(tree) == []
+        model = ExpansionModel()
+        tree._subtrees[0].collapse()
+        model.collapse(tree._subtrees[0])
+        assert check_tree(tree, (10, 20, 300, 200), model) == []
+
+
+def test_zoom_caches_layouts() -> None:
+    """Test that zooming out restores the previous layout without laying it
+    out again, unless the tree changed in the meantime.
+    """
+    from tm_bench import wide_tree
+    from tm_zoom import ZoomView
+    tree = wide_tree(200, fanout=5)
+    view = ZoomView(tree, (0, 0, 400, 300))
+    view.layout()
+    expected = tree.get_rectangles()
+
+    folder = tree._subtrees[1]
+    view.zoom_in(folder._subtrees[0]._subtrees[0])
+    assert view.focus() is folder._subtrees[0]
+    assert view.focus().rect == (0, 0, 400, 300)
+    assert view.get_breadcrumbs() == '0/2/11'
+
+    view.zoom_out(2)
+    assert view.focus() is tree
+    assert tree.get_rectangles() == expected
+
+    view.zoom_in(folder)
+    folder._subtrees[0]._subtrees[0].change_size(5.0)
+    tree.update_data_sizes()
+    view.zoom_out()
+    assert tree.get_rectangles() != expected
+
+
+def test_zoom_matches_update_rectangles() -> None:
+    """Test that the visualiser shows the rectangles that update_rectangles
+    computes, for the whole tree and for a subtree zoomed into.
+    """
+    from tm_bench import wide_tree
+    from tm_zoom import ZoomView
+    tree = wide_tree(300, fanout=5)
+    tree.update_rectangles((0, 0, 800, 570))
+    expected = tree.get_rectangles()
+    view = ZoomView(tree, (0, 0, 800, 570))
+    view.layout()
+    assert tree.get_rectangles() == expected
+
+    view.zoom_in(tree._subtrees[2]._subtrees[0])
+    shown = view.focus().get_rectangles()
+    view.focus().update_rectangles((0, 0, 800, 570))
+    assert view.focus().get_rectangles() == shown
+
+
+def test_normalized_layout_rescales() -> None:
+    """Test that a normalized layout tiles the whole rectangle it is applied
+    to, at any size, and keeps each tree inside its parent.
+    """
+    from tm_bench import skewed_tree
+    from tm_trees import NormalizedLayout
+    tree = skewed_tree(300, seed=5)
+    layout = NormalizedLayout(tree, 4 / 3)
+    for rect in [(0, 0, 400, 300), (10, 20, 1234, 567)]:
+        layout.apply(rect)
+        assert tree.rect == rect
+        area = sum(r[2] * r[3] for r, _ in tree.get_rectangles())
+        assert area == rect[2] * rect[3]
+        for subtree in tree._subtrees:
+            x, y, width, height = subtree.rect
+            assert rect[0] <= x and x + width <= rect[0] + rect[2]
+            assert rect[1] <= y and y + height <= rect[1] + rect[3]
+
+
+def test_transaction_undo_redo() -> None:
+    """Test that a batch of edits leaves the tree consistent, and that undoing
+    and redoing it restores the tree exactly.
+    """
+    from tm_bench import check_tree, skewed_tree
+    from tm_trees import EditJournal
+    tree = skewed_tree(400, seed=2)
+    tree.update_rectangles((0, 0, 300, 200))
+    before = (tree.get_hash(), tree.data_size, tree.get_rectangles())
+    leaves = [t for t in _all_trees(tree) if t._subtrees == []]
+    folders = [t for t in _all_trees(tree) if t._subtrees != []]
+
+    journal = EditJournal(tree)
+    with tree.transaction(journal) as edits:
+        for i in range(50):
+            edits.change_size(leaves[i], 0.5)
+            edits.move(leaves[i + 50], folders[i % len(folders)])
+            edits.change_size(leaves[i + 50], -0.5)
+    assert check_tree(tree, (0, 0, 300, 200)) == []
+    after = (tree.get_hash(), tree.data_size, tree.get_rectangles())
+    assert after != before
+
+    journal.undo()
+    assert (tree.get_hash(), tree.data_size, tree.get_rectangles()) == before
+    journal.redo()
+    assert (tree.get_hash(), tree.data_size, tree.get_rectangles()) == after
+    assert check_tree(tree, (0, 0, 300, 200)) == []
+
+
+def test_move_from_flat_folder() -> None:
+    """Test that moving files out of a large folder and undoing the moves
+    keeps the order, sizes and hashes of its subtrees.
+    """
+    import pytest
+    from tm_bench import SyntheticTree
+    from tm_trees import EditJournal
+    flat = SyntheticTree('flat', [SyntheticTree(str(i), [], i + 1)
+                                  for i in range(500)])
+    other = SyntheticTree('other', [SyntheticTree('x', [], 1)])
+    tree = SyntheticTree('root', [flat, other])
+    order = list(flat._subtrees)
+    before = (tree.get_hash(), flat.data_size, other.data_size)
+
+    journal = EditJournal(tree)
+    with tree.transaction(journal, False) as edits:
+        for leaf in order[::7]:
+            edits.move(leaf, other)
+    assert flat._subtrees == [t for t in order if t not in order[::7]]
+    assert other._subtrees[-1] is order[::7][-1]
+    journal.undo(False)
+    assert flat._subtrees == order
+    assert flat._subtrees[3] is order[3]
+    assert (tree.get_hash(), flat.data_size, other.data_size) == before
+
+    assert flat._subtrees[-1] is flat._subtrees[len(order) - 1] is order[-1]
+    for index in [-1, 0]:
+        with pytest.raises(IndexError):
+            SyntheticTree('x', [], 1)._subtrees[index]
+
+    leaf = order[10]
+    leaf.move(other)
+    assert flat.data_size == before[1] - leaf.data_size
+    assert other.data_size == before[2] + leaf.data_size
+    assert leaf not in flat._subtrees and leaf._parent_tree is other
+    assert tree.get_hash() == _copy_tree(tree).get_hash()
+
+
+def test_move_empties_folder_like_transaction() -> None:
+    """Test that moving the last subtree out of a folder leaves the same
+    sizes and hashes whether it is moved on its own or in a transaction, and
+    that undoing the transaction restores the tree.
+    """
+    from tm_bench import SyntheticTree
+    from tm_trees import EditJournal
+
+    def build() -> SyntheticTree:
+        return SyntheticTree('root', [
+            SyntheticTree('a', [SyntheticTree('x', [], 5)]),
+            SyntheticTree('b', [SyntheticTree('y', [], 3)])])
+
+    moved = build()
+    moved._subtrees[0]._subtrees[0].move(moved._subtrees[1])
+    moved.update_data_sizes()
+    batched = build()
+    before = [(t.data_size, t.get_hash()) for t in _all_trees(batched)]
+    journal = EditJournal(batched)
+    with batched.transaction(journal) as edits:
+        edits.move(batched._subtrees[0]._subtrees[0], batched._subtrees[1])
+
+    assert [t.data_size for t in _all_trees(batched)] == \
+        [t.data_size for t in _all_trees(moved)]
+    assert [t.get_hash() for t in _all_trees(batched)] == \
+        [t.get_hash() for t in _all_trees(moved)]
+    assert batched.data_size == 13 and batched._subtrees[0].data_size == 5
+    journal.undo()
+    assert [(t.data_size, t.get_hash()) for t in _all_trees(batched)] == \
+        before
+
+
+def test_expansion_generations() -> None:
+    """Test that collapsing a tree hides everything within it, that expanding
+    it again leaves its subtrees collapsed, that expand_all lays the tree
+    out once, and that neither lays it out when told not to.
+    """
+    from tm_bench import ExpansionModel, check_tree, wide_tree
+    from tm_profile import PROFILER
+    tree = wide_tree(200, fanout=5)
+    tree.update_rectangles((0, 0, 400, 300))
+    model = ExpansionModel()
+
+    tree._subtrees[0]._subtrees[0].collapse_all()
+    model.collapse_all(tree)
+    assert tree.get_rectangles() == [((0, 0, 400, 300), tree._colour)]
+    tree.expand()
+    model.expand(tree)
+    assert len(tree.get_rectangles()) == 5
+    assert not tree._subtrees[0]._is_expanded()
+    assert check_tree(tree, (0, 0, 400, 300), model) == []
+
+    PROFILER.next_frame()
+    PROFILER.enable()
+    try:
+        tree._subtrees[2].expand_all()
+        PROFILER.next_frame()
+    finally:
+        PROFILER.disable()
+    model.expand_all(tree._subtrees[2])
+    assert PROFILER.summary()['update_rectangles'][1] == 1
+    assert tree._subtrees[2]._subtrees[0]._is_expanded()
+    expanded = [t for t in _all_trees(tree._subtrees[2]) if not t._subtrees]
+    assert len(tree.get_rectangles()) == 4 + len(expanded)
+    assert check_tree(tree, (0, 0, 400, 300), model) == []
+
+    PROFILER.enable()
+    try:
+        tree._subtrees[3].expand(False)
+        tree._subtrees[4].expand_all(False)
+        PROFILER.next_frame()
+    finally:
+        PROFILER.disable()
+    assert 'update_rectangles' not in PROFILER.summary()
+    assert tree._subtrees[3]._is_expanded()
+    model.expand(tree._subtrees[3])
+    model.expand_all(tree._subtrees[4])
+    assert check_tree(tree, (0, 0, 400, 300), model) == []
+
+
+def test_expand_after_collapse() -> None:
+    """Test that expanding the trees below a collapsed tree one level at a
+    time leaves every tree further down collapsed, as they were.
+    """
+    from tm_bench import ExpansionModel, check_tree, deep_tree
+    tree = deep_tree(300, seed=1)
+    tree.update_rectangles((0, 0, 400, 300))
+    model = ExpansionModel()
+    parent = next(t for t in _all_trees(tree)
+                  if t._parent_tree is not None and
+                  any(s._subtrees and any(g._subtrees for g in s._subtrees)
+                      for s in t._subtrees))
+    child = next(s for s in parent._subtrees
+                 if any(g._subtrees for g in s._subtrees))
+    grandchild = next(g for g in child._subtrees if g._subtrees)
+
+    child.collapse()
+    model.collapse(child)
+    shown = len(tree.get_rectangles())
+    parent.expand()
+    model.expand(parent)
+    child.expand()
+    model.expand(child)
+    assert not grandchild._is_expanded()
+    assert len(tree.get_rectangles()) == \
+        shown - 1 + len(parent._subtrees) - 1 + len(child._subtrees)
+    assert check_tree(tree, (0, 0, 400, 300), model) == []
+
+    grandchild.expand()
+    model.expand(grandchild)
+    assert grandchild._is_expanded()
+    assert check_tree(tree, (0, 0, 400, 300), model) == []
+    tree.collapse_all()
+    model.collapse_all(tree)
+    tree.expand()
+    model.expand(tree)
+    assert check_tree(tree, (0, 0, 400, 300), model) == []
+
+
+def test_tile_server(tmp_path) -> None:
+    """Test that the tile server serves PNG tiles, hit-tests and searches,
+    and that its cache evicts tiles once over its budget.
+    """
+    import json
+    import threading
+    from urllib.request import urlopen
+    from tm_tiles import TileCache, make_server
+    _write_files(str(tmp_path), {'a.txt': 30, 'b/c.txt': 10, 'b/d.txt': 60})
+    server = make_server(FileSystemTree(str(tmp_path)), port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = 'http://{}:{}'.format(*server.server_address[:2])
+    try:
+        with urlopen(url + '/tiles/1/1/0.png') as response:
+            tile = response.read()
+        assert tile[:8] == b'\x89PNG\r\n\x1a\n'
+        assert tile[16:24] == b'\x00\x00\x01\x00\x00\x00\x01\x00'
+
+        with urlopen(url + '/search?q=.TXT') as response:
+            found = json.loads(response.read())
+        assert sorted(entry['name'] for entry in found) == \
+            ['a.txt', 'c.txt', 'd.txt']
+        largest = max(found, key=lambda entry: entry['size'])
+        x = (largest['bounds'][0] + largest['bounds'][2]) / 2
+        y = (largest['bounds'][1] + largest['bounds'][3]) / 2
+        with urlopen(url + '/hit?x={}&y={}'.format(x, y)) as response:
+            assert json.loads(response.read()) == largest
+    finally:
+        server.shutdown()
+        server.server_close()
+        server.tiles.close()
+
+    cache = TileCache(max_bytes=10)
+    cache.put((0, 0, 0), b'12345')
+    cache.put((1, 0, 0), b'1234')
+    assert cache.get((0, 0, 0)) == b'12345'
+    cache.put((1, 1, 0), b'123')
+    assert (1, 0, 0) not in cache and (0, 0, 0) in cache
+    assert cache.size() == 8 and cache.evictions == 1
+
+
+def test_rollup_by_attributes(tmp_path) -> None:
+    """Test that a rollup scan totals files by extension, owner and age,
+    leaving out empty folders, and agrees with the tree it was scanned with.
+    """
+    import time
+    from tm_rollup import AGE, EXTENSION, OWNER, build_rollup_tree, \
+        group_totals, rollup
+    _write_files(str(tmp_path), {'a.TXT': 10, 'b/c.txt': 20, 'b/d.py': 40,
+                                 'e': 80})
+    os.mkdir(str(tmp_path / 'b' / 'empty'))
+    old = str(tmp_path / 'b' / 'd.py')
+    os.utime(old, (0, 0))
+    tree = FileSystemTree(str(tmp_path), rollup=True)
+    empty = next(t for t in _all_trees(tree) if t._name == 'empty')
+    files_size = tree.data_size - empty.data_size
+    columns = tree.columns
+    assert len(columns) == 4
+    assert group_totals(columns) == (columns.group_sizes,
+                                     columns.group_counts)
+
+    totals = rollup(columns, now=time.time())
+    assert totals[EXTENSION] == {'.txt': (30, 2), '.py': (40, 1),
+                                 '(none)': (80, 1)}
+    assert totals[AGE] == {'today': (110, 3), 'older': (40, 1)}
+    assert sum(size for size, _ in totals[OWNER].values()) == files_size
+
+    by_age = build_rollup_tree(columns, [AGE, EXTENSION])
+    assert by_age.data_size == files_size
+    assert [t._name for t in by_age._subtrees] == ['today', 'older']
+    assert [t.data_size for t in by_age._subtrees[0]._subtrees] == [80, 30]
+
+
+def test_export_tree(tmp_path) -> None:
+    """Test that exporting a tree writes every node with the same path as
+    get_path_string, and writes the fields of PaperTrees.
+    """
+    import csv
+    import io
+    import json
+    from papers import PaperTree
+    from tm_export import CSV, NDJSON, export_tree
+    _write_files(str(tmp_path), {'a.txt': 5, 'b/c/d.txt': 7, 'b/e.txt': 9})
+    tree = FileSystemTree(str(tmp_path))
+    out = io.StringIO()
+    assert export_tree(tree, out, CSV) == 6
+    rows = list(csv.reader(io.StringIO(out.getvalue())))
+    assert rows[0] == ['path', 'size', 'type']
+    expected = [[t.get_path_string().rsplit(' (', 1)[0], str(t.data_size),
+                 'internal' if t._subtrees else 'leaf']
+                for t in _all_trees(tree)]
+    assert rows[1:] == expected
+
+    paper = PaperTree('A, "B"', [], 'Ann', 'doi/1', 3)
+    papers = PaperTree('CS1', [paper])
+    out = io.StringIO()
+    export_tree(papers, out, NDJSON)
+    lines = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert lines[1] == {'path': 'CS1:A, "B"', 'size': 3, 'type': 'leaf',
+                        'authors': 'Ann', 'doi': 'doi/1'}
+
+
+def test_switch_metrics(tmp_path) -> None:
+    """Test that a tree can be switched between its metrics, and that moves,
+    changes of size and undoing them keep every metric up to date.
+    """
+    import pytest
+    from tm_trees import EditJournal
+    _write_files(str(tmp_path), {'a.txt': 10, 'b/c.txt': 20, 'b/d.txt': 30})
+    tree = FileSystemTree(str(tmp_path), metrics=True)
+    assert tree.get_metric() == 'bytes' and tree.data_size == 60
+    assert tree.get_metrics()['files'] == 3
+    old_hash = tree.get_hash()
+
+    tree.set_metric('files')
+    folder = [t for t in tree._subtrees if t._subtrees][0]
+    leaf = [t for t in tree._subtrees if not t._subtrees][0]
+    assert (tree.data_size, folder.data_size) == (3, 2)
+    assert tree.get_hash() == old_hash
+
+    journal = EditJournal(tree)
+    with tree.transaction(journal) as edits:
+        edits.move(leaf, folder)
+    assert folder.get_metrics() == {'bytes': 60, 'files': 3,
+                                    'allocated': tree._metrics[1]}
+    leaf.change_size(1.0)
+    tree.update_data_sizes()
+    assert tree.get_metrics()['files'] == 4
+    tree.set_metric('bytes')
+    assert (tree.data_size, leaf.data_size) == (60, 10)
+
+    journal.undo()
+    assert folder.get_metrics()['bytes'] == 50
+    assert tree.get_metrics()['files'] == 4
+    with pytest.raises(ValueError):
+        tree.set_metric('lines')
+
+
+def test_approximate_tree_refines(tmp_path) -> None:
+    """Test that an approximate tree estimates the folders it could not
+    list, and becomes the exact tree once they are all scanned.
+    """
+    import shutil
+    from tm_approx import ESTIMATE_COLOUR, ApproxRefiner, ApproxTree
+    _write_files(str(tmp_path), {'{}/{}/f{}.txt'.format(i, j, k): 10 * i + k
+                                 for i in range(4) for j in range(3)
+                                 for k in range(2)})
+    exact = FileSystemTree(str(tmp_path))
+
+    tree = ApproxTree(str(tmp_path), listings=6, seed=0)
+    assert tree.is_estimate()
+    estimates = [t for t in _all_trees(tree) if getattr(t, '_path', None)]
+    assert estimates and all(t._colour == ESTIMATE_COLOUR
+                             for t in estimates)
+    assert 'estimated' in estimates[0].get_suffix()
+    low, high = tree.get_bounds()
+    assert low <= tree.data_size and (high is None or tree.data_size <= high)
+
+    refiner = ApproxRefiner(tree)
+    refiner.start()
+    assert refiner.wait() == len(estimates)
+    assert refiner.is_finished() and not tree.is_estimate()
+    assert tree.data_size == exact.data_size
+    assert tree.get_bounds() == (exact.data_size, exact.data_size)
+    assert tree.get_hash() == exact.get_hash()
+    assert ApproxTree(str(tmp_path)).get_hash() == exact.get_hash()
+
+    tree = ApproxTree(str(tmp_path), listings=6, seed=0)
+    estimates = [t for t in _all_trees(tree) if getattr(t, '_path', None)]
+    shutil.rmtree(estimates[0]._path)
+    refiner = ApproxRefiner(tree)
+    refiner.start()
+    assert refiner.wait() == len(estimates)
+    assert refiner.is_finished() and not tree.is_estimate()
+    assert tree.data_size == FileSystemTree(str(tmp_path)).data_size
+
+
+def test_stored_tree_loads_on_demand(tmp_path) -> None:
+    """Test that a tree saved to a store is laid out like the tree itself
+    while loading only the trees large enough to show, and that subtrees
+    dropped to stay within the memory budget are loaded again when needed.
+    """
+    import tm_store
+    from tm_zoom import ZoomView
+    _write_files(str(tmp_path), {'{}/{}/f{}.txt'.format(i, j, k): 1 + k
+                                 for i in range(10) for j in range(10)
+                                 for k in range(10)})
+    tree = FileSystemTree(str(tmp_path))
+    path = str(tmp_path / 'tree.db')
+    assert tm_store.write_store(tree, path) == len(_all_trees(tree))
+
+    stored = tm_store.open_store(path)
+    assert stored.data_size == tree.data_size
+    assert stored.get_hash() == tree.get_hash()
+    stored.update_rectangles((0, 0, 40, 40))
+    assert stored.get_store_stats()['loaded'] < len(_all_trees(tree)) - 1
+
+    rect = (0, 0, 1024, 768)
+    view = ZoomView(tree, rect)
+    view.layout()
+    expected = [r for r, _ in tree.get_rectangles()]
+    stored = tm_store.open_store(path, memory=50 * tm_store.NODE_BYTES)
+    stored_view = ZoomView(stored, rect)
+    stored_view.layout()
+    assert [r for r, _ in stored.get_rectangles()] == expected
+    for pos in [(0, 0), (500, 400), (1023, 767)]:
+        leaf = stored_view.get_tree_at_position(pos)
+        assert leaf.rect == view.get_tree_at_position(pos).rect
+        assert leaf.get_path_string().endswith('f{}.txt (leaf)'.format(
+            int(leaf.data_size) - 1))
+
+    folder = stored_view.get_tree_at_position((500, 400))._parent_tree
+    stored_view.zoom_in(folder._parent_tree)
+    stats = stored.get_store_stats()
+    assert stats['drops'] > 0
+    assert stats['loaded'] < len(_all_trees(tree)) - 1
+    stored_view.zoom_out()
+    assert [r for r, _ in stored.get_rectangles()] == expected
+    stored.close()
+
+
+def test_stored_tree_keeps_expansion(tmp_path) -> None:
+    """Test that a stored tree shows the same trees expanded and collapsed as
+    the tree itself after subtrees are dropped and loaded again.
+    """
+    import tm_store
+    from tm_zoom import ZoomView
+    _write_files(str(tmp_path), {'{}/{}/f{}.txt'.format(i, j, k): 1 + k
+                                 for i in range(10) for j in range(10)
+                                 for k in range(10)})
+    tree = FileSystemTree(str(tmp_path))
+    path = str(tmp_path / 'tree.db')
+    tm_store.write_store(tree, path)
+    stored = tm_store.open_store(path, memory=50 * tm_store.NODE_BYTES)
+    rect = (0, 0, 1024, 768)
+    views = [ZoomView(tree, rect), ZoomView(stored, rect)]
+
+    def check(*steps: str) -> None:
+        for step in steps:
+            for view in views:
+                folder = view.root._subtrees[3]
+                if step == 'collapse':
+                    folder._subtrees[0].collapse()
+                elif step == 'expand':
+                    folder.expand(False)
+                elif step == 'expand child':
+                    folder._subtrees[2].expand(False)
+                elif step == 'expand all':
+                    folder.expand_all(False)
+                view.invalidate()
+                view.layout()
+        for view in views:
+            view.zoom_in(view.root._subtrees[6]._subtrees[0])
+            view.invalidate()
+            view.zoom_out(2)
+        assert [r for r, _ in stored.get_rectangles()] == \
+            [r for r, _ in tree.get_rectangles()]
+
+    check('collapse')
+    check('expand')
+    check('expand child')
+    assert stored.get_store_stats()['drops'] > 0
+    check('collapse', 'expand all')
+    stored.close()
+
+
 ##############################################################################
 # Helpers
 ##############################################################################
@@ -144,6 +823,33 @@ def is_valid_colour(colour: Tuple[int, int, int]) -> bool:
     return True
 
 
+def _copy_tree(tree: TMTree) -> TMTree:
+    """Return a copy of <tree> built with the TMTree constructor.
+    """
+    return TMTree(tree._name, [_copy_tree(t) for t in tree._subtrees],
+                  tree.data_size)
+
+
+def _all_trees(tree: TMTree) -> list:
+    """Return every tree in <tree>, in preorder.
+    """
+    trees = [tree]
+    for subtree in tree._subtrees:
+        trees.extend(_all_trees(subtree))
+    return trees
+
+
+def _write_files(root: str, sizes: dict) -> None:
+    """Create a file of the given size for every relative path in <sizes>,
+    under the folder <root>.
+    """
+    for relative_path, size in sizes.items():
+        path = os.path.join(root, *relative_path.split('/'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write('x' * size)
+
+
 def _sort_subtrees(tree: TMTree) -> None:
     """Sort the subtrees of <tree> in alphabetical order.
     THIS IS FOR THE PURPOSES OF THE SAMPLE TEST ONLY; YOU SHOULD NOT SORT
@@ -22,16 +22,28 @@ and we can then run it through our treemap visualisation tool to get a nice
 interactive graphical representation of this data.
 """
 import csv
-from typing import List, Dict
+import math
+from typing import List, Dict, Optional
 from tm_trees import TMTree
+from tm_profile import PROFILER
 
 # Filename for the dataset
 DATA_FILE = 'cs1_papers.csv'
 
+# The year in which the citations in the dataset were counted
+DATA_YEAR = 2019
+
+# The metrics every PaperTree can be sized by
+PAPER_METRICS = ['citations', 'papers', 'citations per year']
+
 
 class PaperTree(TMTree):
     """A tree representation of Computer Science Education research paper data.
 
+    Every paper has the metrics in PAPER_METRICS: its citations, a count of
+    one paper, and its citations per year since it was published (rounded
+    up), so the tree can be switched between them with set_metric.
+
     === Private Attributes ===
     _authors:
         The authors of this PaperTree.
@@ -53,8 +65,12 @@ class PaperTree(TMTree):
     _parent_tree:
         The parent tree of this tree; i.e., the tree that contains this tree
         as a subtree, or None if this tree is not part of a larger tree.
-    _expanded:
-        Whether or not this tree is considered expanded for visualization.
+    _shown_since:
+        The time at which this tree was last expanded, or -1 if it has been
+        collapsed since.
+    _reset_at:
+        The time at which this tree was last collapsed or expanded on its
+        own, or 0 if it never has been.
 
     === Representation Invariants ===
     - All TMTree RIs are inherited.
@@ -65,9 +81,11 @@ class PaperTree(TMTree):
 
     def __init__(self, name: str, subtrees: List[TMTree], authors: str = '',
                  doi: str = '', citations: int = 0, by_year: bool = True,
-                 all_papers: bool = False) -> None:
+                 all_papers: bool = False, year: Optional[int] = None) -> None:
         """Initialize a new PaperTree with the given <name> and <subtrees>,
         <authors> and <doi>, and with <citations> as the size of the data.
+        A paper published in <year> has its citations per year counted from
+        then until DATA_YEAR, or over one year if <year> is None.
 
         If <all_papers> is True, then this tree is to be the root of the paper
         tree. In that case, load data about papers from DATA_FILE to build the
@@ -81,11 +99,14 @@ class PaperTree(TMTree):
         """
         if all_papers:
             temp_dict = _load_papers_to_dict(by_year)
-            temp_subtrees = _build_tree_from_dict(temp_dict)
+            temp_subtrees = PROFILER.call('build paper tree',
+                                          _build_tree_from_dict, temp_dict)
         else:
             temp_subtrees = subtrees
 
-        super().__init__(name, temp_subtrees, citations)
+        years = 1 if year is None else max(1, DATA_YEAR - year)
+        super().__init__(name, temp_subtrees, citations,
+                         [citations, 1, math.ceil(citations / years)])
         self._authors = authors
         self._doi = doi
 
@@ -103,7 +124,13 @@ class PaperTree(TMTree):
         else:
             return ' (category)'
 
+    def get_metric_names(self) -> List[str]:
+        """Return PAPER_METRICS.
+        """
+        return list(PAPER_METRICS)
+
 
+@PROFILER.phase('load papers')
 def _load_papers_to_dict(by_year: bool = True) -> Dict:
     """Return a nested dictionary of the data read from the papers dataset file.
 
@@ -138,6 +165,7 @@ def _load_papers_to_dict(by_year: bool = True) -> Dict:
             working_dict['name'] = name
             working_dict['doi'] = doi
             working_dict['citations'] = int(citations)
+            working_dict['year'] = int(year)
 
     return result
 
@@ -153,7 +181,8 @@ def _build_tree_from_dict(nested_dict: Dict) -> List[PaperTree]:
 
     elif 'authors' in nested_dict.keys():
         ans.append(PaperTree(nested_dict['name'], [], nested_dict['authors'],
-                             nested_dict['doi'], nested_dict['citations']))
+                             nested_dict['doi'], nested_dict['citations'],
+                             year=nested_dict['year']))
 
     else:
         for name, yep in nested_dict.items():
@@ -165,7 +194,8 @@ def _build_tree_from_dict(nested_dict: Dict) -> List[PaperTree]:
 if __name__ == '__main__':
     import python_ta
     python_ta.check_all(config={
-        'allowed-import-modules': ['python_ta', 'typing', 'csv', 'tm_trees'],
+        'allowed-import-modules': ['python_ta', 'typing', 'csv', 'math',
+                                   'tm_trees', 'tm_profile'],
         'allowed-io': ['_load_papers_to_dict'],
-        'max-args': 8
+        'max-args': 9
     })
@@ -0,0 +1,590 @@
+"""Assignment 2: Approximate treemaps of enormous file systems
+
+=== Module Description ===
+Even a parallel scan of a volume with hundreds of millions of files takes a
+long time, so this module builds a first picture of it from a sample, and
+then refines that picture as an exact scan proceeds in the background.
+
+An ApproxTree lists at most a fixed budget of folders. Half of the budget
+lists the top of the tree, breadth first; the rest is spent on random
+probes below it. A probe walks from a folder down to a folder with no
+subfolders, choosing a subfolder at random at each step, and multiplies the
+size of the files it finds at each level by the number of choices it had
+on the way (Knuth's estimator). That gives an unbiased estimate of the size
+of every folder on its path, and so a sample of the sizes of the subfolders
+of each of them.
+
+Every folder that was listed is shown as it is, and every folder that was
+not is shown as an estimate: the mean of the samples of its siblings, with
+an approximate 95% interval for its size. Folder sizes are heavy tailed, so
+the interval is only a rough guide. Estimates are drawn in ESTIMATE_COLOUR,
+and their suffix (and that of every folder containing one) gives the
+bounds.
+
+An ApproxRefiner lists the estimated folders in full, largest estimate
+first, in a background thread. Each time the visualiser calls apply, the
+folders that have been listed replace their estimates in the tree.
+
+Folders are listed with os.scandir without following symbolic links, and
+in disk usage mode a file with several hard links is counted only the first
+time it is found, as in the disk usage mode of FileSystemTree.
+"""
+from __future__ import annotations
+import math
+import os
+import queue
+import random
+import sys
+import threading
+from stat import S_ISDIR
+from typing import Dict, List, Optional, Set, Tuple
+from tm_trees import FileSystemTree, TMTree
+
+# The number of folders listed to build an ApproxTree
+DEFAULT_LISTINGS = 2000
+
+# The number of standard deviations either side of an estimate that its
+# interval covers, for about 95% confidence
+Z_95 = 1.96
+
+# The colour of folders whose size is still an estimate
+ESTIMATE_COLOUR = (128, 128, 128)
+
+
+class _Listing:
+    """The contents of a folder, as listed by a _Sampler.
+
+    === Public Attributes ===
+    files:
+        The name and size of each entry that is not a folder.
+    folders:
+        The name, path and size of each subfolder, where the size is that of
+        the folder itself, not counting what it holds.
+    size:
+        The total size of files.
+    """
+    files: List[Tuple[str, int]]
+    folders: List[Tuple[str, str, int]]
+    size: int
+
+    def __init__(self, files: List[Tuple[str, int]],
+                 folders: List[Tuple[str, str, int]]) -> None:
+        """Initialize a new _Listing of <files> and <folders>.
+        """
+        self.files = files
+        self.folders = folders
+        self.size = sum(size for _, size in files)
+
+
+class _Sampler:
+    """Lists folders, each at most once, until a budget of listings is
+    spent, and samples the sizes of folders by random probes.
+
+    === Public Attributes ===
+    listings:
+        The listing of each folder listed so far, keyed by its path.
+    samples:
+        Estimates of the sizes of the subfolders of each folder, from the
+        probes that passed through it, keyed by the path of the folder.
+    depth_samples:
+        Estimates of the sizes of folders at each depth below the root,
+        from every probe.
+
+    === Private Attributes ===
+    _budget:
+        The number of folders that can still be listed.
+    _disk_usage:
+        Whether files are measured by the space allocated to them.
+    _rng:
+        The source of the random choices of probes.
+    _links:
+        The packed (device, inode) pairs of the hard linked files counted
+        so far, in disk usage mode.
+    """
+    listings: Dict[str, _Listing]
+    samples: Dict[str, List[int]]
+    depth_samples: Dict[int, List[int]]
+    _budget: int
+    _disk_usage: bool
+    _rng: random.Random
+    _links: Set[int]
+
+    def __init__(self, budget: int, disk_usage: bool, rng: random.Random,
+                 links: Set[int]) -> None:
+        """Initialize a new _Sampler that lists at most <budget> folders,
+        and counts the hard linked files not in <links>, adding them to it.
+        """
+        self.listings = {}
+        self.samples = {}
+        self.depth_samples = {}
+        self._budget = budget
+        self._disk_usage = disk_usage
+        self._rng = rng
+        self._links = links
+
+    def remaining(self) -> int:
+        """Return the number of folders that can still be listed.
+        """
+        return self._budget
+
+    def list(self, path: str) -> Optional[_Listing]:
+        """Return the listing of the folder at <path>, or None if it has not
+        been listed and the budget is spent.
+
+        Symbolic links are never followed, and a folder that cannot be
+        listed is treated as empty.
+        """
+        if path in self.listings:
+            return self.listings[path]
+        if self._budget <= 0:
+            return None
+        self._budget -= 1
+
+        files = []
+        folders = []
+        try:
+            with os.scandir(path) as it:
+                entries = list(it)
+        except OSError:
+            entries = []
+        for entry in entries:
+            try:
+                stat = entry.stat(follow_symlinks=False)
+            except OSError:
+                continue
+            size = _entry_size(stat, self._disk_usage)
+            if S_ISDIR(stat.st_mode):
+                folders.append((entry.name, entry.path, size))
+            elif not self._disk_usage or stat.st_nlink == 1:
+                files.append((entry.name, size))
+            elif (stat.st_dev << 64 | stat.st_ino) in self._links:
+                files.append((entry.name, 0))
+            else:
+                self._links.add(stat.st_dev << 64 | stat.st_ino)
+                files.append((entry.name, size))
+        listing = self.listings[path] = _Listing(files, folders)
+        return listing
+
+    def probe(self, path: str, depth: int) -> bool:
+        """Walk from the folder at <path>, which is <depth> folders below the
+        root, down to a folder with no subfolders, and record the sample of
+        subfolder sizes it gives for each folder on the way. Return False if
+        the budget ran out first, in which case nothing is recorded.
+        """
+        steps = []
+        while True:
+            listing = self.list(path)
+            if listing is None:
+                return False
+            steps.append((path, listing))
+            if not listing.folders:
+                break
+            path = self._rng.choice(listing.folders)[1]
+
+        # Estimate the size under each folder on the path, deepest first;
+        # the estimate for the folder after steps[i] is a sample of the
+        # sizes of the subfolders of steps[i]
+        estimate = 0
+        for i in range(len(steps) - 1, -1, -1):
+            path, listing = steps[i]
+            if listing.folders:
+                self.samples.setdefault(path, []).append(estimate)
+                self.depth_samples.setdefault(depth + i + 1,
+                                              []).append(estimate)
+            estimate = listing.size + len(listing.folders) * estimate
+        return True
+
+    def estimate(self, parent: str, depth: int
+                 ) -> Tuple[int, int, Optional[int]]:
+        """Return an estimate of the size of an unlisted subfolder of the
+        folder at <parent>, which is <depth> folders below the root, with
+        the low and high ends of an approximate 95% interval for it. The
+        high end is None if there are too few samples to bound it.
+
+        The samples of the subfolders of <parent> are used if there are at
+        least two, or else those of every folder at the same depth.
+        """
+        values = self.samples.get(parent, [])
+        if len(values) < 2:
+            values = self.depth_samples.get(depth + 1, values)
+        if not values:
+            return 0, 0, None
+        mean = sum(values) / len(values)
+        if len(values) == 1:
+            return round(mean), 0, None
+        variance = sum((value - mean) ** 2 for value in values) / \
+            (len(values) - 1)
+        # The interval for a single folder, rather than for the mean
+        spread = Z_95 * math.sqrt(variance * (1 + 1 / len(values)))
+        return round(mean), max(0, math.floor(mean - spread)), \
+            math.ceil(mean + spread)
+
+
+class ApproxTree(FileSystemTree):
+    """A tree of files and folders whose sizes may be estimates.
+
+    A folder that was not listed is a leaf standing in for the whole folder,
+    with an estimated size and the path to scan it by. Refining the tree
+    replaces it with an exact ApproxTree of the folder.
+
+    === Private Attributes ===
+    _low:
+        The lowest size this tree is likely to have.
+    _high:
+        The highest size this tree is likely to have, or None if that is
+        unknown.
+    _estimated:
+        The number of estimated folders in this tree, including itself.
+    _path:
+        The path of the folder, if this tree stands in for a folder that was
+        not listed; otherwise None.
+    _links:
+        For the root, the packed (device, inode) pairs of the hard linked
+        files counted so far, in disk usage mode; otherwise None.
+
+    === Inherited Attributes ===
+    rect:
+        The pygame rectangle representing this node in the treemap
+        visualization.
+    data_size:
+        The size of this tree, or its estimated size.
+    columns:
+        Always None.
+    _colour:
+        The RGB colour value of the root of this tree.
+    _name:
+        The name of the file or folder this tree represents.
+    _subtrees:
+        The subtrees of this tree.
+    _parent_tree:
+        The parent tree of this tree; i.e., the tree that contains this tree
+        as a subtree, or None if this tree is not part of a larger tree.
+    _shown_since:
+        The time at which this tree was last expanded, or -1 if it has been
+        collapsed since.
+    _reset_at:
+        The time at which this tree was last collapsed or expanded on its
+        own, or 0 if it never has been.
+
+    === Representation Invariants ===
+    - All TMTree RIs are inherited.
+    - _low <= data_size, and _high is None or data_size <= _high
+    - If _estimated is 0, then _low == _high == data_size
+    - _path is not None iff this tree is an estimated leaf
+    """
+    _low: int
+    _high: Optional[int]
+    _estimated: int
+    _path: Optional[str]
+    _links: Optional[Set[int]]
+
+    def __init__(self, path: str, disk_usage: bool = False,
+                 listings: int = DEFAULT_LISTINGS,
+                 seed: Optional[int] = None) -> None:
+        """Build an approximate tree of the file or folder at <path>, listing
+        at most <listings> folders. Files are measured as FileSystemTree
+        measures them with <disk_usage>. Probes are chosen using <seed>.
+
+        Precondition: <path> is a valid path for this computer.
+        """
+        links = set()
+        sampler = _Sampler(listings, disk_usage, random.Random(seed), links)
+        stat = os.lstat(path)
+        size = _entry_size(stat, disk_usage)
+        if S_ISDIR(stat.st_mode):
+            frontier = _list_breadth_first(sampler, path,
+                                           sampler.remaining() // 2)
+            # Probe until the budget is spent, or a round of probes finds
+            # nothing new
+            remaining = None
+            while frontier and remaining != sampler.remaining():
+                remaining = sampler.remaining()
+                frontier = [(folder, depth) for folder, depth in frontier
+                            if sampler.probe(folder, depth)]
+            _list_breadth_first(sampler, path, 0)
+            root = _build_approx(sampler, os.path.basename(path), path, size)
+        else:
+            root = ApproxTree._node(os.path.basename(path), [], size, size,
+                                    size, None)
+        self.columns = None
+        TMTree.__init__(self, root._name, root._subtrees, root.data_size)
+        self._low, self._high = root._low, root._high
+        self._estimated, self._path = root._estimated, root._path
+        self._links = links
+
+    @classmethod
+    def _node(cls, name: str, subtrees: List[TMTree], size: int, low: int,
+              high: Optional[int], path: Optional[str]) -> ApproxTree:
+        """Return a new ApproxTree named <name> of <subtrees>, or of <size>,
+        between <low> and <high>, if it is a leaf. An estimated leaf stands
+        in for the folder at <path>.
+        """
+        tree = cls.__new__(cls)
+        tree.columns = None
+        TMTree.__init__(tree, name, subtrees, size)
+        tree._path = path
+        tree._links = None
+        if path is not None:
+            tree._low, tree._high, tree._estimated = low, high, 1
+            tree._colour = ESTIMATE_COLOUR
+        else:
+            tree._update_bounds()
+            if not subtrees:
+                tree._low = tree._high = size
+        return tree
+
+    def _update_bounds(self) -> None:
+        """Recompute the bounds of this folder from those of its subtrees.
+        """
+        self._low = 0
+        self._high = 0
+        self._estimated = 0
+        for tree in self._subtrees:
+            low, high, estimated = _bounds(tree)
+            self._low += low
+            self._estimated += estimated
+            if self._high is not None:
+                self._high = None if high is None else self._high + high
+
+    def is_estimate(self) -> bool:
+        """Return True iff the size of this tree is not yet exact.
+        """
+        return self._estimated > 0
+
+    def get_bounds(self) -> Tuple[int, Optional[int]]:
+        """Return the lowest and highest sizes this tree is likely to have.
+        The highest is None if it is unknown.
+        """
+        return self._low, self._high
+
+    def get_suffix(self) -> str:
+        """Return the final descriptor of this tree, with its bounds if it
+        is an estimate.
+        """
+        if not self.is_estimate():
+            return super().get_suffix()
+        bounds = '{} to {}'.format(self._low, '?' if self._high is None
+                                   else self._high)
+        if self._path is not None:
+            return ' (estimated folder, {})'.format(bounds)
+        else:
+            return ' (folder, estimated {})'.format(bounds)
+
+
+def _entry_size(stat: os.stat_result, disk_usage: bool) -> int:
+    """Return the size of the file or folder with the given <stat>, as
+    FileSystemTree measures it with <disk_usage>.
+    """
+    blocks = getattr(stat, 'st_blocks', None)
+    if disk_usage and blocks is not None:
+        return blocks * 512
+    else:
+        return stat.st_size
+
+
+def _bounds(tree: TMTree) -> Tuple[int, Optional[int], int]:
+    """Return the low and high bounds of the size of <tree>, and the number
+    of estimated folders in it. Trees that are not ApproxTrees are exact.
+    """
+    if isinstance(tree, ApproxTree):
+        return tree._low, tree._high, tree._estimated
+    return tree.data_size, tree.data_size, 0
+
+
+def _list_breadth_first(sampler: _Sampler, path: str,
+                        reserve: int) -> List[Tuple[str, int]]:
+    """List the folders of the tree at <path> breadth first, until only
+    <reserve> of the budget of <sampler> remains, and return the path and
+    depth of each folder that was found but not listed.
+
+    Folders that <sampler> has already listed cost nothing.
+    """
+    frontier = [(path, 0)]
+    position = 0
+    while position < len(frontier) and (sampler.remaining() > reserve or
+                                        frontier[position][0] in
+                                        sampler.listings):
+        folder, depth = frontier[position]
+        position += 1
+        listing = sampler.list(folder)
+        frontier.extend((child[1], depth + 1) for child in listing.folders)
+    return frontier[position:]
+
+
+def _build_approx(sampler: _Sampler, name: str, path: str,
+                  size: int) -> ApproxTree:
+    """Return the ApproxTree of the folder named <name> at <path>, from the
+    folders listed by <sampler>. <size> is the size of the folder itself,
+    which is its size in the tree if it is empty.
+
+    Precondition: the folder at <path> was listed.
+    """
+    # Each frame holds a folder's name, path, size, depth, listing and the
+    # subtrees built so far
+    stack = [(name, path, size, 0, sampler.listings[path], [])]
+    tree = None
+    while stack:
+        name, path, size, depth, listing, subtrees = stack[-1]
+        if tree is not None:
+            subtrees.append(tree)
+            tree = None
+        while len(subtrees) < len(listing.files) + len(listing.folders):
+            position = len(subtrees) - len(listing.files)
+            if position < 0:
+                file_name, size = listing.files[len(subtrees)]
+                subtrees.append(ApproxTree._node(file_name, [], size, size,
+                                                 size, None))
+                continue
+            child_name, child_path, child_size = listing.folders[position]
+            if child_path in sampler.listings:
+                stack.append((child_name, child_path, child_size, depth + 1,
+                              sampler.listings[child_path], []))
+                break
+            estimate, low, high = sampler.estimate(path, depth)
+            subtrees.append(ApproxTree._node(child_name, [], estimate, low,
+                                             high, child_path))
+        else:
+            stack.pop()
+            tree = ApproxTree._node(name, subtrees, size, size, size, None)
+    return tree
+
+
+class ApproxRefiner:
+    """Scans the estimated folders of an ApproxTree exactly, in a background
+    thread, so that their estimates can be replaced.
+
+    === Private Attributes ===
+    _root:
+        The root of the tree being refined.
+    _disk_usage:
+        Whether files are measured by the space allocated to them.
+    _done:
+        The estimated folders that have been scanned, each with the exact
+        ApproxTree of it, waiting for apply.
+    _stop:
+        Set to make the background thread stop after its current folder.
+    _thread:
+        The background thread, or None if it has not been started.
+    """
+    _root: ApproxTree
+    _disk_usage: bool
+    _done: queue.Queue
+    _stop: threading.Event
+    _thread: Optional[threading.Thread]
+
+    def __init__(self, root: ApproxTree, disk_usage: bool = False) -> None:
+        """Initialize a new ApproxRefiner of the tree rooted at <root>,
+        which was built with <disk_usage>.
+        """
+        self._root = root
+        self._disk_usage = disk_usage
+        self._done = queue.Queue()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self) -> None:
+        """Start scanning the estimated folders, largest estimate first.
+        """
+        estimates = []
+        stack = [self._root]
+        while stack:
+            tree = stack.pop()
+            if isinstance(tree, ApproxTree) and tree._estimated > 0:
+                if tree._path is not None:
+                    estimates.append(tree)
+                stack.extend(tree._subtrees)
+        estimates.sort(key=lambda tree: -tree.data_size)
+        self._thread = threading.Thread(target=self._scan,
+                                        args=(estimates,), daemon=True)
+        self._thread.start()
+
+    def _scan(self, estimates: List[ApproxTree]) -> None:
+        """Scan the folder of each tree in <estimates> in turn, and queue
+        the result, until told to stop.
+
+        A folder that can no longer be read is replaced by an empty tree,
+        just as an unreadable folder is when the tree is built.
+        """
+        try:
+            for tree in estimates:
+                if self._stop.is_set():
+                    break
+                sampler = _Sampler(sys.maxsize, self._disk_usage,
+                                   random.Random(), self._root._links)
+                _list_breadth_first(sampler, tree._path, 0)
+                try:
+                    size = _entry_size(os.lstat(tree._path), self._disk_usage)
+                except OSError:
+                    size = 0
+                self._done.put((tree, _build_approx(sampler, tree._name,
+                                                    tree._path, size)))
+        finally:
+            self._done.put(None)
+
+    def apply(self) -> int:
+        """Replace every estimated folder scanned so far with its exact tree,
+        and return how many were replaced.
+
+        This must be called from the thread that uses the tree, and does
+        not lay the tree out again.
+        """
+        count = 0
+        while True:
+            try:
+                item = self._done.get_nowait()
+            except queue.Empty:
+                return count
+            if item is None:
+                self._stop.set()
+                continue
+            _replace(*item)
+            count += 1
+
+    def is_finished(self) -> bool:
+        """Return True iff every estimated folder has been scanned and
+        replaced, or refining was stopped.
+        """
+        return self._stop.is_set() and self._done.empty()
+
+    def wait(self) -> int:
+        """Wait for the background scans to finish, then replace every
+        estimated folder that was scanned, and return how many were.
+        """
+        if self._thread is not None:
+            self._thread.join()
+        return self.apply()
+
+    def stop(self) -> None:
+        """Stop scanning after the folder being scanned now.
+        """
+        self._stop.set()
+
+
+def _replace(estimate: ApproxTree, exact: ApproxTree) -> None:
+    """Put <exact> in the place of <estimate> in its tree, and update the
+    sizes and bounds of its ancestors.
+    """
+    parent = estimate._parent_tree
+    if parent is None:
+        return
+    exact._shown_since = estimate._shown_since
+    exact._reset_at = estimate._reset_at
+    index = estimate._detach(False)
+    exact._attach(parent, index)
+    delta = exact.data_size - estimate.data_size
+    tree = parent
+    while tree is not None:
+        tree.data_size += delta
+        if isinstance(tree, ApproxTree):
+            tree._update_bounds()
+        tree = tree._parent_tree
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'python_ta', 'typing', 'math', 'os', 'queue', 'random', 'sys',
+            'threading', 'stat', 'tm_trees', '__future__'
+        ]
+    })
@@ -0,0 +1,975 @@
+"""Assignment 2: Benchmarks for the treemap trees
+
+=== Module Description ===
+This module times the expensive operations on treemap trees, so that changes
+to them can be checked for speed as well as for correctness.
+
+Trees of any size can be generated in several shapes: wide, deep, skewed
+(with Zipf-like file sizes), real folders written to disk, and the papers
+dataset copied many times over. Each operation is timed on each tree, and the
+timings can be saved as a baseline that later runs are compared against.
+
+The module also contains a reference implementation of the size and layout
+algorithms, written as plainly as possible. check_tree compares the results
+of the TMTree methods against it, so that any optimization of those methods
+can be shown to produce exactly the same rectangles and sizes.
+
+Run it from the command line, for example:
+
+    python tm_bench.py suite --sizes 1000,100000 --check
+    python tm_bench.py suite --save
+    python tm_bench.py scan /usr/lib
+    python tm_bench.py tiles --nodes 1000000 --workers 4
+    python tm_bench.py export --nodes 10000000
+    python tm_bench.py store --fanout 10 --depth 8
+"""
+import argparse
+import csv
+import json
+import math
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from itertools import accumulate
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+import papers
+from papers import PaperTree
+from tm_trees import TMTree, FileSystemTree, EditJournal, FileColumns, \
+    NormalizedLayout
+import tm_approx
+import tm_export
+import tm_rollup
+import tm_store
+import tm_tiles
+from tm_zoom import ZoomView
+
+# Where timings are saved by --save, and compared against otherwise
+BASELINE_FILE = 'tm_bench_baselines.json'
+
+# A timing is a regression if it is this many times slower than its baseline
+REGRESSION_RATIO = 1.5
+
+# Differences smaller than this many seconds are treated as noise
+NOISE_SECONDS = 0.002
+
+# The number of tree sizes used when none are given
+DEFAULT_SIZES = [1000, 10000, 100000]
+
+# The rectangle that trees are laid out in
+BENCH_RECT = (0, 0, 1024, 738)
+
+# The number of hit-tests, moves and edits in a transaction timed on each tree
+HIT_TESTS = 100
+MOVES = 100
+TRANSACTION_EDITS = 10000
+
+# The number of levels in a deep tree
+DEEP_DEPTH = 200
+
+# The number of entries in the folder used to time moves out of a flat folder
+FLAT_CHILDREN = 1000000
+
+# The number of frames timed while browsing a stored tree
+STORE_FRAMES = 200
+
+
+class SyntheticTree(TMTree):
+    """A generated tree, for benchmarking.
+
+    === Inherited Attributes ===
+    rect:
+        The pygame rectangle representing this node in the treemap
+        visualization.
+    data_size:
+        The size of the data represented by this tree.
+    _colour:
+        The RGB colour value of the root of this tree.
+    _name:
+        The root value of this tree, or None if this tree is empty.
+    _subtrees:
+        The subtrees of this tree.
+    _parent_tree:
+        The parent tree of this tree; i.e., the tree that contains this tree
+        as a subtree, or None if this tree is not part of a larger tree.
+    _shown_since:
+        The time at which this tree was last expanded, or -1 if it has been
+        collapsed since.
+    _reset_at:
+        The time at which this tree was last collapsed or expanded on its
+        own, or 0 if it never has been.
+
+    === Representation Invariants ===
+    - All TMTree RIs are inherited.
+    """
+
+    def get_separator(self) -> str:
+        """Return the separator between names in a path.
+        """
+        return '/'
+
+    def get_suffix(self) -> str:
+        """Return the final descriptor of this tree.
+        """
+        if len(self._subtrees) == 0:
+            return ' (file)'
+        else:
+            return ' (folder)'
+
+
+##############################################################################
+# Tree generators
+##############################################################################
+def _tree_from_parents(parents: List[int],
+                       sizes: Callable[[], int]) -> SyntheticTree:
+    """Return the tree in which the parent of node i is parents[i], with the
+    size of each leaf drawn from <sizes>.
+
+    Precondition: parents[0] == -1, and parents[i] < i for every other i.
+    """
+    children = [[] for _ in parents]
+    for i in range(len(parents) - 1, 0, -1):
+        children[parents[i]].append(i)
+
+    nodes = [None] * len(parents)
+    for i in range(len(parents) - 1, -1, -1):
+        subtrees = [nodes[child] for child in reversed(children[i])]
+        nodes[i] = SyntheticTree(str(i), subtrees,
+                                 0 if subtrees else sizes())
+        for child in children[i]:
+            nodes[child] = None
+        children[i] = None
+    return nodes[0]
+
+
+def wide_tree(n: int, seed: int = 0, fanout: int = 1000) -> SyntheticTree:
+    """Return a tree of <n> nodes in which every folder holds <fanout>
+    entries.
+    """
+    rng = random.Random(seed)
+    parents = [-1] + [(i - 1) // fanout for i in range(1, n)]
+    return _tree_from_parents(parents, lambda: rng.randint(1, 1000))
+
+
+def deep_tree(n: int, seed: int = 0,
+              depth: int = DEEP_DEPTH) -> SyntheticTree:
+    """Return a tree of about <n> nodes made of chains <depth> folders deep,
+    where every folder holds one file and the next folder of its chain.
+    """
+    rng = random.Random(seed)
+    chains = []
+    for _ in range(max(1, n // (2 * depth + 1))):
+        tree = SyntheticTree('end', [], rng.randint(1, 1000))
+        for level in range(depth):
+            leaf = SyntheticTree('file', [], rng.randint(1, 1000))
+            tree = SyntheticTree(str(level), [leaf, tree])
+        chains.append(tree)
+    return SyntheticTree('root', chains)
+
+
+def skewed_tree(n: int, seed: int = 0) -> SyntheticTree:
+    """Return a random tree of <n> nodes whose file sizes follow a Zipf-like
+    distribution, so that a few files are much larger than all the others.
+    """
+    rng = random.Random(seed)
+    parents = [-1] + [rng.randrange(i) for i in range(1, n)]
+    return _tree_from_parents(
+        parents, lambda: min(10 ** 9, int(rng.paretovariate(1.1))))
+
+
+def disk_tree(n: int, root: str, seed: int = 0,
+              fanout: int = 20) -> FileSystemTree:
+    """Write about <n> files and folders under the folder <root>, with every
+    folder holding <fanout> entries, and return the FileSystemTree for it.
+    """
+    rng = random.Random(seed)
+    folders = [root]
+    count = 0
+    for folder in folders:
+        if count >= n:
+            break
+        os.makedirs(folder, exist_ok=True)
+        for i in range(fanout):
+            if count >= n:
+                break
+            count += 1
+            if len(folders) * fanout < n and i % 4 == 0:
+                folders.append(os.path.join(folder, 'd{}'.format(i)))
+            else:
+                with open(os.path.join(folder, 'f{}'.format(i)), 'w') as f:
+                    f.write('x' * rng.randint(1, 2000))
+    return FileSystemTree(root)
+
+
+def stored_rows(fanout: int, depth: int) -> Iterator[tm_store.Row]:
+    """Yield the rows of a store of a complete tree in which every folder
+    holds <fanout> entries, and every file is <depth> levels below the root.
+
+    The rows are generated one at a time, so the tree can be far larger than
+    memory: the file sizes repeat every 1000 files, so the size of any
+    folder can be worked out from the range of files it holds.
+    """
+    period = [1 + (i * 7919) % 1000 for i in range(1000)]
+    prefix = [0] + list(accumulate(period))
+
+    def files_size(n: int) -> int:
+        """Return the total size of the first <n> files."""
+        return (n // 1000) * prefix[1000] + prefix[n % 1000]
+
+    node_id = 1
+    first = 2
+    for level in range(depth + 1):
+        files = fanout ** (depth - level)
+        for offset in range(fanout ** level):
+            size = files_size((offset + 1) * files) - files_size(offset * files)
+            node_hash = (node_id * 0x9E3779B97F4A7C15) & ((1 << 64) - 1)
+            if level == 0:
+                yield node_id, 'root', size, first, fanout, node_hash
+                first += fanout
+            elif level < depth:
+                yield (node_id, 'd{}'.format(offset % fanout), size, first,
+                       fanout, node_hash)
+                first += fanout
+            else:
+                yield (node_id, 'f{}'.format(offset % fanout), size, 0, 0,
+                       node_hash)
+            node_id += 1
+
+
+def scaled_papers(copies: int, folder: str) -> PaperTree:
+    """Write <copies> copies of the papers dataset to a file in <folder>,
+    each with differently named papers, and return the PaperTree loaded from
+    it.
+    """
+    path = os.path.join(folder, 'papers.csv')
+    with open(papers.DATA_FILE, 'r') as original, \
+            open(path, 'w', newline='') as scaled:
+        header = original.readline()
+        rows = list(csv.reader(original))
+        scaled.write(header)
+        writer = csv.writer(scaled)
+        for copy in range(copies):
+            for row in rows:
+                writer.writerow([row[0], '{} #{}'.format(row[1], copy)] +
+                                row[2:])
+
+    old_file = papers.DATA_FILE
+    papers.DATA_FILE = path
+    try:
+        return PaperTree('CS1', [], all_papers=True, by_year=True)
+    finally:
+        papers.DATA_FILE = old_file
+
+
+##############################################################################
+# Reference implementation
+##############################################################################
+def _reference_sizes(tree: TMTree, sizes: Dict[int, int]) -> int:
+    """Store the data_size of every node of <tree> in <sizes>, keyed by id,
+    as computed by summing the sizes of the leaves, and return the size of
+    <tree>.
+    """
+    if tree.is_empty():
+        size = 0
+    elif not tree._subtrees:
+        size = tree.data_size
+    else:
+        size = sum(_reference_sizes(subtree, sizes)
+                   for subtree in tree._subtrees)
+    sizes[id(tree)] = size
+    return size
+
+
+class ExpansionModel:
+    """Whether or not each tree within a tree is expanded, kept as one flag
+    per tree. Each method changes the flags just as the TMTree method of the
+    same name changes which trees are expanded, but by visiting every tree it
+    affects.
+
+    === Attributes ===
+    flags:
+        Whether or not each tree is expanded, keyed by id. Trees that are not
+        in it are expanded, as every tree starts out.
+    """
+    flags: Dict[int, bool]
+
+    def __init__(self) -> None:
+        """Initialize a new ExpansionModel in which every tree is expanded.
+        """
+        self.flags = {}
+
+    def is_expanded(self, tree: TMTree) -> bool:
+        """Return whether or not <tree> is expanded.
+        """
+        return self.flags.get(id(tree), True)
+
+    def expand(self, tree: TMTree) -> None:
+        """Expand <tree>, leaving the trees within it as they are.
+        """
+        if tree._subtrees:
+            self.flags[id(tree)] = True
+
+    def expand_all(self, tree: TMTree) -> None:
+        """Expand <tree> and every tree within it.
+        """
+        if tree._subtrees and not self.is_expanded(tree):
+            for subtree in _reference_trees(tree):
+                self.flags[id(subtree)] = True
+
+    def collapse(self, tree: TMTree) -> None:
+        """Collapse the parent of <tree>, if it has one.
+        """
+        if tree._parent_tree is not None:
+            for subtree in _reference_trees(tree._parent_tree):
+                self.flags[id(subtree)] = False
+
+    def collapse_all(self, tree: TMTree) -> None:
+        """Collapse the root of <tree>, and every tree within it.
+        """
+        while tree._parent_tree is not None:
+            tree = tree._parent_tree
+        for subtree in _reference_trees(tree):
+            self.flags[id(subtree)] = False
+
+
+def _reference_trees(tree: TMTree) -> List[TMTree]:
+    """Return <tree> and every tree within it.
+    """
+    trees = [tree]
+    for subtree in tree._subtrees:
+        trees.extend(_reference_trees(subtree))
+    return trees
+
+
+def _reference_layout(tree: TMTree, rect: Tuple[int, int, int, int],
+                      rects: Dict[int, Tuple[int, int, int, int]],
+                      model: ExpansionModel) -> None:
+    """Store the rectangle of every node in the displayed-tree rooted at
+    <tree> in <rects>, keyed by id, as laid out in <rect> by the treemap
+    algorithm. <model> holds which trees are expanded.
+    """
+    if tree.is_empty() or tree.data_size == 0:
+        return
+    rects[id(tree)] = rect
+    if not tree._subtrees or not model.is_expanded(tree):
+        return
+
+    x, y, width, height = rect
+    # The original algorithm scales by abs(x - width) rather than by width;
+    # the layout must match it exactly, so that quirk is kept.
+    if width > height:
+        position, extent = x, width
+    else:
+        position, extent = y, height
+    start = position
+    last = len(tree._subtrees) - 1
+    for i, subtree in enumerate(tree._subtrees):
+        length = math.floor(abs(start - extent) *
+                            (subtree.data_size / tree.data_size))
+        if i == last and position + length - start != extent:
+            length = extent + start - position
+        if width > height:
+            _reference_layout(subtree, (position, y, length, height), rects,
+                              model)
+        else:
+            _reference_layout(subtree, (x, position, width, length), rects,
+                              model)
+        position += length
+
+
+def _reference_leaves(tree: TMTree, rects: Dict[int, Tuple[int, int, int, int]],
+                      leaves: List[Tuple[Tuple[int, int, int, int],
+                                         Tuple[int, int, int]]],
+                      model: ExpansionModel) -> None:
+    """Append the rectangle from <rects> and the colour of every leaf of the
+    displayed-tree rooted at <tree> to <leaves>. <model> holds which trees
+    are expanded.
+    """
+    if not model.is_expanded(tree) or \
+            (not tree._subtrees and not tree.is_empty()):
+        leaves.append((rects.get(id(tree), tree.rect), tree._colour))
+    else:
+        for subtree in tree._subtrees:
+            _reference_leaves(subtree, rects, leaves, model)
+
+
+def check_tree(tree: TMTree,
+               rect: Tuple[int, int, int, int] = BENCH_RECT,
+               model: Optional[ExpansionModel] = None) -> List[str]:
+    """Return a description of every way in which the sizes and layout of
+    <tree>, computed by its own methods, differ from those computed by the
+    reference implementation. Return an empty list if there are none.
+
+    <model> holds which trees the reference takes to be expanded, having made
+    the same expansions and collapses as <tree>; by default, every tree is.
+
+    This updates the data sizes and rectangles of <tree>.
+    """
+    if model is None:
+        model = ExpansionModel()
+    problems = []
+    sizes = {}
+    _reference_sizes(tree, sizes)
+    tree.update_data_sizes()
+    tree.update_rectangles(rect)
+    rects = {}
+    _reference_layout(tree, rect, rects, model)
+
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        if node.data_size != sizes[id(node)]:
+            problems.append('{}: size {} instead of {}'.format(
+                node.get_path_string(), node.data_size, sizes[id(node)]))
+        if id(node) in rects and node.rect != rects[id(node)]:
+            problems.append('{}: rect {} instead of {}'.format(
+                node.get_path_string(), node.rect, rects[id(node)]))
+        stack.extend(node._subtrees)
+
+    leaves = []
+    _reference_leaves(tree, rects, leaves, model)
+    if tree.get_rectangles() != leaves:
+        problems.append('get_rectangles does not match the displayed leaves')
+
+    # The visualiser draws a NormalizedLayout of the tree in its rectangle,
+    # which must be the same layout
+    NormalizedLayout(tree, rect=rect).apply(rect)
+    if tree.get_rectangles() != leaves:
+        problems.append('NormalizedLayout does not match the displayed leaves')
+    return problems
+
+
+##############################################################################
+# Timing
+##############################################################################
+def _timed(func: Callable, *args: object) -> float:
+    """Return the number of seconds taken to call <func> with <args>.
+    """
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def _render_headless(tree: TMTree, rect: Tuple[int, int, int, int]) -> None:
+    """Draw the rectangles of <tree> onto an off-screen surface of the size
+    of <rect>, as render_display does.
+    """
+    import pygame
+    surface = pygame.Surface((rect[2], rect[3]))
+    for leaf_rect, colour in tree.get_rectangles():
+        pygame.draw.rect(surface, colour, leaf_rect)
+
+
+def time_operations(tree: TMTree, seed: int = 0,
+                    rect: Tuple[int, int, int, int] = BENCH_RECT
+                    ) -> Dict[str, float]:
+    """Return the number of seconds taken by each expensive operation on
+    <tree>, laid out in <rect>.
+
+    The headless render is skipped if pygame is not installed. Moves and a
+    transaction of TRANSACTION_EDITS edits are timed last, since they change
+    the tree; the time of the transaction includes laying the tree out again
+    once it is committed.
+    """
+    rng = random.Random(seed)
+    timings = {'update_data_sizes': _timed(tree.update_data_sizes),
+               'update_rectangles': _timed(tree.update_rectangles, rect),
+               'get_rectangles': _timed(tree.get_rectangles)}
+
+    points = [(rng.randrange(rect[2]), rng.randrange(rect[3]))
+              for _ in range(HIT_TESTS)]
+    start = time.perf_counter()
+    for point in points:
+        tree.get_tree_at_position(point)
+    timings['get_tree_at_position'] = time.perf_counter() - start
+
+    try:
+        timings['render'] = _timed(_render_headless, tree, rect)
+    except ImportError:
+        pass
+
+    leaves, folders = [], []
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        (folders if node._subtrees else leaves).append(node)
+        stack.extend(node._subtrees)
+    start = time.perf_counter()
+    for _ in range(MOVES):
+        rng.choice(leaves).move(rng.choice(folders))
+    timings['move'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with tree.transaction() as edits:
+        for _ in range(TRANSACTION_EDITS // 2):
+            edits.change_size(rng.choice(leaves), rng.choice([0.5, -0.3]))
+            edits.move(rng.choice(leaves), rng.choice(folders))
+    timings['transaction'] = time.perf_counter() - start
+    return timings
+
+
+def run_suite(sizes: List[int], check: bool = False
+              ) -> Dict[str, float]:
+    """Return the timings of every operation on every kind of generated tree
+    of each of the given <sizes>, keyed by 'kind/size/operation'.
+
+    If <check>, also compare each tree against the reference implementation
+    and raise an AssertionError if they differ.
+    """
+    timings = {}
+    folder = tempfile.mkdtemp()
+    try:
+        for size in sizes:
+            generators = [
+                ('wide', lambda n=size: wide_tree(n)),
+                ('deep', lambda n=size: deep_tree(n)),
+                ('skewed', lambda n=size: skewed_tree(n)),
+                ('disk', lambda n=size: disk_tree(
+                    n, os.path.join(folder, 'disk{}'.format(n)))),
+                ('papers', lambda n=size: scaled_papers(
+                    max(1, n // 1000), folder))]
+            for kind, generate in generators:
+                start = time.perf_counter()
+                tree = generate()
+                key = '{}/{}/'.format(kind, size)
+                timings[key + 'construct'] = time.perf_counter() - start
+                if check:
+                    problems = check_tree(tree)
+                    assert problems == [], '\n'.join([key] + problems[:10])
+                for operation, seconds in time_operations(tree).items():
+                    timings[key + operation] = seconds
+    finally:
+        shutil.rmtree(folder)
+    return timings
+
+
+def find_regressions(timings: Dict[str, float],
+                     baselines: Dict[str, float]) -> List[str]:
+    """Return a description of each of the <timings> that is a regression
+    from its baseline in <baselines>.
+    """
+    regressions = []
+    for key, seconds in timings.items():
+        baseline = baselines.get(key)
+        if baseline is not None and seconds > baseline * REGRESSION_RATIO \
+                and seconds - baseline > NOISE_SECONDS:
+            regressions.append('{}: {:.4f}s, baseline {:.4f}s'.format(
+                key, seconds, baseline))
+    return regressions
+
+
+def bench_scan(path: str, max_workers: int = 0,
+               disk_usage: bool = True) -> List[Tuple[int, float]]:
+    """Return the number of seconds taken to scan <path> with 1, 2, 4, ...
+    processes, up to <max_workers> (or the number of CPUs if it is 0).
+
+    Each scan is timed once, after an untimed scan that warms the operating
+    system's caches.
+    """
+    if max_workers <= 0:
+        max_workers = os.cpu_count() or 1
+    FileSystemTree(path, disk_usage=disk_usage)
+
+    timings = []
+    workers = 1
+    while workers <= max_workers:
+        start = time.perf_counter()
+        FileSystemTree(path, disk_usage=disk_usage, workers=workers)
+        timings.append((workers, time.perf_counter() - start))
+        workers *= 2
+    return timings
+
+
+def bench_flat_moves(children: int = FLAT_CHILDREN,
+                     moves: int = MOVES) -> Tuple[float, float]:
+    """Return the number of seconds taken to move <moves> files out of a
+    folder of <children> files and back again, and to undo all of those
+    moves as one transaction.
+
+    These take time proportional to <children> if removing a subtree from
+    its parent is not constant time.
+    """
+    rng = random.Random(0)
+    flat = wide_tree(children + 1, fanout=children)
+    other = SyntheticTree('other', [SyntheticTree('x', [], 1)])
+    root = SyntheticTree('root', [flat, other])
+    files = list(flat._subtrees)
+
+    start = time.perf_counter()
+    for _ in range(moves):
+        tree = rng.choice(files)
+        tree.move(other)
+        tree.move(flat)
+    seconds = time.perf_counter() - start
+
+    journal = EditJournal(root)
+    with root.transaction(journal, False) as edits:
+        for tree in rng.sample(files, moves):
+            edits.move(tree, other)
+    start = time.perf_counter()
+    journal.undo(False)
+    return seconds, time.perf_counter() - start
+
+
+def bench_tiles(nodes: int, requests: int = 2000, concurrency: int = 8,
+                workers: int = 0) -> Dict[str, float]:
+    """Serve a wide tree of <nodes> nodes as tiles on localhost, and return
+    the results of tm_tiles.load_test against it.
+
+    If <workers> is 0, tiles are rendered on the server's request threads.
+    """
+    server = tm_tiles.make_server(wide_tree(nodes), port=0, workers=workers)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        host, port = server.server_address[:2]
+        return tm_tiles.load_test('http://{}:{}'.format(host, port),
+                                  requests, concurrency)
+    finally:
+        server.shutdown()
+        server.server_close()
+        server.tiles.close()
+
+
+def bench_rollup(files: int, seed: int = 0) -> Tuple[float, float, float]:
+    """Return the number of seconds taken to record <files> generated files
+    in a FileColumns, as a scan does, to roll them up by extension, owner
+    and age at once, and to build the RollupTree of them by owner and
+    extension.
+
+    The files are spread over 40 extensions, 20 owners and 2000 days.
+    """
+    rng = random.Random(seed)
+    names = ['file{}.ext{}'.format(i, i % 40) for i in range(1000)]
+    owners = [1000 + i for i in range(20)]
+    start = time.perf_counter()
+    columns = FileColumns()
+    for i in range(files):
+        columns.add(names[i % 1000], i, owners[i % 20],
+                    18000 + rng.randrange(2000))
+    add_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    tm_rollup.rollup(columns, now=20000 * 86400)
+    seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    tm_rollup.build_rollup_tree(columns, [tm_rollup.OWNER,
+                                          tm_rollup.EXTENSION])
+    return add_seconds, seconds, time.perf_counter() - start
+
+
+def bench_export(nodes: int) -> Dict[str, float]:
+    """Return the number of seconds taken to export a wide tree and a deep
+    tree of <nodes> nodes each as CSV and as NDJSON, keyed by the kind of
+    tree and the format.
+    """
+    timings = {}
+    for kind, tree in [('wide', wide_tree(nodes)), ('deep', deep_tree(nodes))]:
+        for file_format in [tm_export.CSV, tm_export.NDJSON]:
+            with open(os.devnull, 'w') as out:
+                timings[kind + ' ' + file_format] = _timed(
+                    tm_export.export_tree, tree, out, file_format)
+    return timings
+
+
+def bench_metrics(copies: int) -> Dict[str, float]:
+    """Return the number of seconds taken to load <copies> copies of the
+    papers dataset, to lay the tree out, and to switch it to each of its
+    metrics in turn and lay it out again, keyed by what was timed.
+    """
+    timings = {}
+    folder = tempfile.mkdtemp()
+    try:
+        start = time.perf_counter()
+        tree = scaled_papers(copies, folder)
+        timings['load'] = time.perf_counter() - start
+    finally:
+        shutil.rmtree(folder)
+    rect = (0, 0, 1024, 768)
+    timings['layout'] = _timed(tree.update_rectangles, rect)
+    for name in tree.get_metric_names()[1:] + tree.get_metric_names()[:1]:
+        timings['switch to ' + name] = _timed(tree.set_metric, name)
+    return timings
+
+
+def bench_approx(path: str, listings: int) -> Dict[str, float]:
+    """Return the number of seconds taken to build an ApproxTree of the
+    folder at <path> listing at most <listings> folders, to refine it, and
+    to scan the folder exactly in disk usage mode, with the error of the
+    first estimate relative to the exact size.
+    """
+    start = time.perf_counter()
+    tree = tm_approx.ApproxTree(path, disk_usage=True, listings=listings,
+                                seed=0)
+    timings = {'estimate': time.perf_counter() - start}
+    estimate = tree.data_size
+
+    refiner = tm_approx.ApproxRefiner(tree, disk_usage=True)
+    start = time.perf_counter()
+    refiner.start()
+    refiner.wait()
+    timings['refine'] = time.perf_counter() - start
+    timings['exact scan'] = _timed(FileSystemTree, path, True)
+    timings['error'] = abs(estimate - tree.data_size) / max(tree.data_size,
+                                                            1)
+    return timings
+
+
+def bench_store(path: str, memory: int, frames: int = STORE_FRAMES,
+                seed: int = 0) -> Dict[str, object]:
+    """Return the frame times and memory use of browsing the store at <path>
+    with a memory budget of <memory> bytes.
+
+    Each of <frames> frames zooms into the tree under a random point, or
+    out of the tree in focus, and then lays out, draws and hit-tests the
+    tree in focus, as the visualiser does. The browsing is done twice, the
+    second time tracing the memory allocated, which slows it down.
+    """
+    results = {}
+    for traced in [False, True]:
+        rng = random.Random(seed)
+        if traced:
+            tracemalloc.start()
+        root = tm_store.open_store(path, memory)
+        view = ZoomView(root, BENCH_RECT)
+        times = []
+        for _ in range(frames):
+            start = time.perf_counter()
+            if len(view._path) > 1 and rng.random() < 0.4:
+                view.zoom_out(rng.randint(1, len(view._path) - 1))
+            else:
+                point = (rng.randrange(BENCH_RECT[2]),
+                         rng.randrange(BENCH_RECT[3]))
+                hit = view.get_tree_at_position(point)
+                if hit is None or hit is view.focus():
+                    view.layout()
+                else:
+                    view.zoom_in(hit)
+            _render_headless(view.focus(), BENCH_RECT)
+            view.get_tree_at_position((rng.randrange(BENCH_RECT[2]),
+                                       rng.randrange(BENCH_RECT[3])))
+            times.append(time.perf_counter() - start)
+        if traced:
+            results['peak bytes'] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        else:
+            times.sort()
+            results['median frame'] = times[len(times) // 2]
+            results['95% frame'] = times[len(times) * 95 // 100]
+            results['slowest frame'] = times[-1]
+            results.update(root.get_store_stats())
+        root.close()
+    return results
+
+
+##############################################################################
+# Command line
+##############################################################################
+def _print_suite(sizes: List[int], check: bool, save: bool,
+                 baseline_file: Optional[str] = BASELINE_FILE) -> int:
+    """Run the benchmark suite, print its timings and any regressions, and
+    return the number of regressions found.
+
+    If <save>, store the timings as the new baselines instead.
+    """
+    timings = run_suite(sizes, check)
+    for key, seconds in timings.items():
+        print('{:<40}{:>10.4f}s'.format(key, seconds))
+
+    if save:
+        baselines = {}
+        if os.path.exists(baseline_file):
+            with open(baseline_file, 'r') as file:
+                baselines = json.load(file)
+        baselines.update(timings)
+        with open(baseline_file, 'w') as file:
+            json.dump(baselines, file, indent=1, sort_keys=True)
+        return 0
+
+    if not os.path.exists(baseline_file):
+        return 0
+    with open(baseline_file, 'r') as file:
+        regressions = find_regressions(timings, json.load(file))
+    for regression in regressions:
+        print('REGRESSION ' + regression)
+    return len(regressions)
+
+
+def _print_scan(path: str) -> None:
+    """Print how the time to scan <path> scales with the number of processes.
+    """
+    timings = bench_scan(path)
+    print('workers  seconds  speedup')
+    for workers, seconds in timings:
+        print('{:>7}  {:>7.3f}  {:>7.2f}'.format(workers, seconds,
+                                                 timings[0][1] / seconds))
+
+
+def _print_flat(children: int) -> None:
+    """Print the time taken to move files out of a folder of <children>
+    files and back.
+    """
+    moves, undo = bench_flat_moves(children)
+    print('{} moves out and back  {:>8.4f}s'.format(MOVES, moves))
+    print('undo of {} moves       {:>8.4f}s'.format(MOVES, undo))
+
+
+def _print_tiles(nodes: int, requests: int, concurrency: int,
+                 workers: int) -> None:
+    """Print the throughput and latency of a tile server of <nodes> nodes.
+    """
+    results = bench_tiles(nodes, requests, concurrency, workers)
+    print('tiles per second  {:>10.1f}'.format(results['tiles_per_second']))
+    print('p50 latency       {:>10.4f}s'.format(results['p50']))
+    print('p99 latency       {:>10.4f}s'.format(results['p99']))
+    print('errors            {:>10}'.format(results['errors']))
+
+
+def _print_rollup(files: int) -> None:
+    """Print the time taken to roll up <files> files.
+    """
+    add_seconds, seconds, tree_seconds = bench_rollup(files)
+    print('recording {} files  {:>8.3f}s'.format(files, add_seconds))
+    print('rollup by 3 attributes  {:>8.3f}s'.format(seconds))
+    print('rollup tree             {:>8.3f}s'.format(tree_seconds))
+
+
+def _print_export(nodes: int) -> None:
+    """Print the time taken to export trees of <nodes> nodes.
+    """
+    for name, seconds in bench_export(nodes).items():
+        print('{:<12} {:>8.3f}s  {:>10.0f} nodes/s'.format(name, seconds,
+                                                          nodes / seconds))
+
+
+def _print_metrics(copies: int) -> None:
+    """Print the time taken to switch the metric of <copies> copies of the
+    papers dataset, next to the time taken to load and to lay them out.
+    """
+    for name, seconds in bench_metrics(copies).items():
+        print('{:<30} {:>8.3f}s'.format(name, seconds))
+
+
+def _print_approx(path: str, listings: int) -> None:
+    """Print how quickly and how well the folder at <path> is estimated.
+    """
+    timings = bench_approx(path, listings)
+    for name in ['estimate', 'refine', 'exact scan']:
+        print('{:<12} {:>8.3f}s'.format(name, timings[name]))
+    print('{:<12} {:>8.1%}'.format('error', timings['error']))
+
+
+def _print_store(fanout: int, depth: int, memory: int,
+                 path: Optional[str]) -> None:
+    """Print the frame times and memory use of browsing a store of a
+    complete tree of the given <fanout> and <depth>, written to <path>, or to
+    a temporary file if <path> is None. An existing file at <path> is used
+    as it is.
+    """
+    folder = None
+    if path is None:
+        folder = tempfile.mkdtemp()
+        path = os.path.join(folder, 'store.db')
+    try:
+        if not os.path.exists(path):
+            start = time.perf_counter()
+            nodes = tm_store.write_store_rows(path, stored_rows(fanout, depth),
+                                              '/')
+            print('wrote {} nodes ({:.0f} MB)  {:>8.1f}s'.format(
+                nodes, os.path.getsize(path) / 2 ** 20,
+                time.perf_counter() - start))
+        results = bench_store(path, memory)
+        for name in ['median frame', '95% frame', 'slowest frame']:
+            print('{:<16} {:>8.1f}ms'.format(name, results[name] * 1000))
+        print('{:<16} {:>8.1f}MB'.format('peak memory',
+                                         results['peak bytes'] / 2 ** 20))
+        for name in ['peak', 'budget', 'loads', 'drops']:
+            print('{:<16} {:>10}'.format('nodes ' + name, results[name]))
+    finally:
+        if folder is not None:
+            shutil.rmtree(folder)
+
+
+def main(args: List[str]) -> int:
+    """Run the benchmarks named in the command line arguments <args>, and
+    return the exit status.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+    suite = commands.add_parser('suite', help='time every tree operation')
+    suite.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+                       help='comma-separated numbers of nodes')
+    suite.add_argument('--check', action='store_true',
+                       help='compare against the reference implementation')
+    suite.add_argument('--save', action='store_true',
+                       help='save the timings as the new baselines')
+    scan = commands.add_parser('scan', help='time parallel file system scans')
+    scan.add_argument('path')
+    flat = commands.add_parser('flat', help='time moves out of a flat folder')
+    flat.add_argument('--children', type=int, default=FLAT_CHILDREN,
+                      help='number of files in the folder')
+    tiles = commands.add_parser('tiles', help='load test the tile server')
+    tiles.add_argument('--nodes', type=int, default=100000,
+                       help='number of nodes in the served tree')
+    tiles.add_argument('--requests', type=int, default=2000)
+    tiles.add_argument('--concurrency', type=int, default=8)
+    tiles.add_argument('--workers', type=int, default=0,
+                       help='processes rendering tiles')
+    rollup = commands.add_parser('rollup', help='time rollups of many files')
+    rollup.add_argument('--files', type=int, default=10000000)
+    export = commands.add_parser('export', help='time exports of every node')
+    export.add_argument('--nodes', type=int, default=1000000)
+    approx = commands.add_parser('approx', help='time approximate scans')
+    approx.add_argument('path')
+    approx.add_argument('--listings', type=int,
+                        default=tm_approx.DEFAULT_LISTINGS)
+    metrics = commands.add_parser('metrics', help='time switching metrics')
+    metrics.add_argument('--copies', type=int, default=1000,
+                         help='copies of the papers dataset to load')
+    store = commands.add_parser('store', help='time browsing a stored tree')
+    store.add_argument('--fanout', type=int, default=10)
+    store.add_argument('--depth', type=int, default=6,
+                       help='levels below the root of the stored tree')
+    store.add_argument('--memory', type=int, default=tm_store.DEFAULT_MEMORY,
+                       help='memory budget in bytes')
+    store.add_argument('--path', help='where to keep the store')
+    options = parser.parse_args(args)
+
+    # Deep trees need deeper recursion than Python allows by default
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 10 * DEEP_DEPTH))
+    if options.command == 'suite':
+        sizes = [int(size) for size in options.sizes.split(',')]
+        return 1 if _print_suite(sizes, options.check, options.save) else 0
+    if options.command == 'flat':
+        _print_flat(options.children)
+        return 0
+    if options.command == 'rollup':
+        _print_rollup(options.files)
+        return 0
+    if options.command == 'approx':
+        _print_approx(options.path, options.listings)
+        return 0
+    if options.command == 'metrics':
+        _print_metrics(options.copies)
+        return 0
+    if options.command == 'store':
+        _print_store(options.fanout, options.depth, options.memory,
+                     options.path)
+        return 0
+    if options.command == 'export':
+        _print_export(options.nodes)
+        return 0
+    if options.command == 'tiles':
+        _print_tiles(options.nodes, options.requests, options.concurrency,
+                     options.workers)
+        return 0
+    _print_scan(options.path)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
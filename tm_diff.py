@@ -0,0 +1,277 @@
+"""Assignment 2: Diffing two treemap trees
+
+=== Module Description ===
+This module compares two scans of the same hierarchy (for example, two
+FileSystemTrees of one folder taken a day apart) and reports which entries
+were added, removed or resized, along with their change in size.
+
+Nodes are matched by their path relative to the root of each tree. Subtrees
+whose size and hash (see TMTree.get_hash) agree in both scans are skipped
+without being visited, so unchanged parts of a large scan cost almost nothing.
+
+The differences can also be turned into a DiffTree, which the treemap
+visualiser can display, with each rectangle coloured by how much it grew
+or shrank.
+"""
+from __future__ import annotations
+from typing import Dict, Iterator, List, Optional, Tuple
+from tm_trees import TMTree
+
+# Kinds of change reported by diff_trees
+ADDED = 'added'
+REMOVED = 'removed'
+RESIZED = 'resized'
+
+# Colours used when rendering a DiffTree
+_GROWTH_COLOUR = (0, 200, 0)
+_SHRINK_COLOUR = (200, 0, 0)
+
+
+class DiffEntry:
+    """A single difference between two trees.
+
+    === Public Attributes ===
+    names:
+        The names of the nodes on the path from (but not including) the root
+        of each tree down to the changed node.
+    kind:
+        One of ADDED, REMOVED or RESIZED.
+    old_size:
+        The data_size of the node in the old tree, or 0 if it was added.
+    new_size:
+        The data_size of the node in the new tree, or 0 if it was removed.
+    """
+    names: Tuple[str, ...]
+    kind: str
+    old_size: int
+    new_size: int
+
+    def __init__(self, names: Tuple[str, ...], kind: str, old_size: int,
+                 new_size: int) -> None:
+        """Initialize a new DiffEntry.
+        """
+        self.names = names
+        self.kind = kind
+        self.old_size = old_size
+        self.new_size = new_size
+
+    @property
+    def delta(self) -> int:
+        """The change in size, in the same units as data_size.
+        """
+        return self.new_size - self.old_size
+
+    def get_path_string(self, separator: str) -> str:
+        """Return the path of this entry, joined with <separator>.
+        """
+        return separator.join(self.names)
+
+    def __repr__(self) -> str:
+        """Return a representation of this entry for debugging.
+        """
+        return 'DiffEntry({!r}, {!r}, {:+d})'.format(
+            '/'.join(self.names), self.kind, self.delta)
+
+
+def diff_trees(old: TMTree, new: TMTree) -> Iterator[DiffEntry]:
+    """Yield a DiffEntry for every difference between <old> and <new>.
+
+    An added or removed folder is reported once, with the size of the whole
+    folder, rather than once per file inside it. A node that exists in both
+    trees is reported as RESIZED only if it is a leaf in both; a folder that
+    became a file (or vice versa) is reported as REMOVED then ADDED.
+
+    Siblings with the same name, which some trees allow, are paired in the
+    order they appear in each tree; any left over are reported as ADDED or
+    REMOVED.
+
+    Entries are produced lazily in a depth-first order, so the whole diff
+    never has to be held in memory at once.
+    """
+    stack = [((), old, new)]
+    while stack:
+        names, old_node, new_node = stack.pop()
+
+        if old_node.data_size == new_node.data_size and \
+                old_node.get_hash() == new_node.get_hash():
+            continue
+
+        old_subtrees = old_node.get_subtrees()
+        new_subtrees = new_node.get_subtrees()
+        if not old_subtrees and not new_subtrees:
+            if old_node.data_size != new_node.data_size:
+                yield DiffEntry(names, RESIZED, old_node.data_size,
+                                new_node.data_size)
+        elif not old_subtrees or not new_subtrees:
+            yield DiffEntry(names, REMOVED, old_node.data_size, 0)
+            yield DiffEntry(names, ADDED, 0, new_node.data_size)
+        else:
+            # Siblings may share a name, so each name maps to all the new
+            # subtrees with it, which are paired with the old ones in order
+            new_children = {}
+            for tree in new_subtrees:
+                new_children.setdefault(tree.get_name(), []).append(tree)
+            for tree in old_subtrees:
+                name = tree.get_name()
+                matches = new_children.get(name)
+                if not matches:
+                    yield DiffEntry(names + (name,), REMOVED,
+                                    tree.data_size, 0)
+                else:
+                    stack.append((names + (name,), tree, matches.pop(0)))
+            for name, trees in new_children.items():
+                for tree in trees:
+                    yield DiffEntry(names + (name,), ADDED, 0,
+                                    tree.data_size)
+
+
+class DiffTree(TMTree):
+    """A tree of the differences between two trees, for the visualiser.
+
+    Each leaf is one DiffEntry, sized by the magnitude of its change and
+    coloured green if it grew or red if it shrank; the stronger the colour,
+    the larger the change relative to the largest change in the diff.
+
+    === Private Attributes ===
+    _delta:
+        The total change in size of this tree.
+    _kind:
+        The kind of change for a leaf, or None for an internal node.
+    _separator:
+        The separator used by the trees that were compared.
+
+    === Inherited Attributes ===
+    rect:
+        The pygame rectangle representing this node in the treemap
+        visualization.
+    data_size:
+        The absolute change in size of this tree.
+    _colour:
+        The RGB colour value of the root of this tree.
+    _name:
+        The root value of this tree, or None if this tree is empty.
+    _subtrees:
+        The subtrees of this tree.
+    _parent_tree:
+        The parent tree of this tree; i.e., the tree that contains this tree
+        as a subtree, or None if this tree is not part of a larger tree.
+    _shown_since:
+        The time at which this tree was last expanded, or -1 if it has been
+        collapsed since.
+    _reset_at:
+        The time at which this tree was last collapsed or expanded on its
+        own, or 0 if it never has been.
+
+    === Representation Invariants ===
+    - All TMTree RIs are inherited.
+    """
+    _delta: int
+    _kind: Optional[str]
+    _separator: str
+
+    def __init__(self, name: str, subtrees: List[DiffTree], delta: int = 0,
+                 kind: Optional[str] = None, separator: str = '/') -> None:
+        """Initialize a new DiffTree with the given <name> and <subtrees>,
+        whose size changed by <delta>.
+        """
+        super().__init__(name, subtrees, abs(delta))
+        self._kind = kind
+        self._separator = separator
+        if subtrees == []:
+            self._delta = delta
+        else:
+            self._delta = sum(tree._delta for tree in subtrees)
+
+    def get_separator(self) -> str:
+        """Return the separator of the trees that were compared.
+        """
+        return self._separator
+
+    def get_suffix(self) -> str:
+        """Return the final descriptor of this tree.
+        """
+        if self._kind is None:
+            return ' ({:+d})'.format(self._delta)
+        else:
+            return ' ({} {:+d})'.format(self._kind, self._delta)
+
+    def _set_growth_colours(self, largest: int) -> None:
+        """Colour this tree and its subtrees by their change in size, relative
+        to the <largest> absolute change of any leaf.
+        """
+        base = _GROWTH_COLOUR if self._delta >= 0 else _SHRINK_COLOUR
+        scale = 0.25 + 0.75 * min(1.0, abs(self._delta) / max(largest, 1))
+        self._colour = (int(base[0] * scale), int(base[1] * scale),
+                        int(base[2] * scale))
+        for tree in self._subtrees:
+            tree._set_growth_colours(largest)
+
+
+def build_diff_tree(old: TMTree, new: TMTree) -> DiffTree:
+    """Return a DiffTree of the differences between <old> and <new>.
+
+    If the two trees are identical, the DiffTree has no subtrees.
+    """
+    nested = {}
+    largest = 0
+    for entry in diff_trees(old, new):
+        working_dict = nested
+        for name in entry.names[:-1]:
+            child = working_dict.get(name)
+            if isinstance(child, DiffEntry):
+                # A sibling with the same name was a leaf, so make room for
+                # the folder
+                working_dict[_free_key(working_dict, name, child.kind)] = \
+                    child
+                child = None
+            if child is None:
+                child = working_dict[name] = {}
+            working_dict = child
+        # A name can appear twice when a file became a folder, or vice versa,
+        # or when siblings share a name
+        key = entry.names[-1] if entry.names else new.get_name()
+        if key in working_dict:
+            key = _free_key(working_dict, key, entry.kind)
+        working_dict[key] = entry
+        largest = max(largest, abs(entry.delta))
+
+    separator = new.get_separator()
+    root = DiffTree(new.get_name(), _build_diff_subtrees(nested, separator),
+                    separator=separator)
+    root._set_growth_colours(largest)
+    return root
+
+
+def _free_key(nested_dict: Dict, name: str, kind: str) -> str:
+    """Return a key for an entry of <kind> named <name> that is not yet used
+    in <nested_dict>.
+    """
+    key = '{} ({})'.format(name, kind)
+    number = 2
+    while key in nested_dict:
+        key = '{} ({} {})'.format(name, kind, number)
+        number += 1
+    return key
+
+
+def _build_diff_subtrees(nested_dict: Dict, separator: str) -> List[DiffTree]:
+    """Return a list of DiffTrees from the nested dictionary <nested_dict>,
+    whose leaves are DiffEntry objects.
+    """
+    ans = []
+    for name, value in nested_dict.items():
+        if isinstance(value, DiffEntry):
+            ans.append(DiffTree(name, [], value.delta, value.kind, separator))
+        else:
+            ans.append(DiffTree(name, _build_diff_subtrees(value, separator),
+                                separator=separator))
+    return ans
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'python_ta', 'typing', 'tm_trees', '__future__'
+        ]
+    })
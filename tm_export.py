@@ -0,0 +1,199 @@
+"""Assignment 2: Exporting a whole tree, du-style
+
+=== Module Description ===
+This module writes every node of a TMTree, with its path, size and type, to
+a text file as CSV or as NDJSON (one JSON object per line), much like the
+output of du. Trees of the subclasses in this project also export their own
+fields: the authors and DOI of a PaperTree, the change of a DiffTree and the
+number of files in a RollupTree.
+
+Calling get_path_string on every node would walk up to the root for each of
+them, which takes time proportional to the number of nodes times the depth
+of the tree. Instead, the nodes are visited in one depth-first traversal
+that keeps the path of each folder on its stack, so each path is built from
+its parent's path with a single concatenation. The stack holds one entry
+per level rather than every node waiting to be visited, and rows are
+written in batches of BATCH_ROWS, so exporting takes time proportional to
+the number of nodes and memory proportional to the depth of the tree.
+
+Run this module with the path of a folder to export a scan of it to
+standard output.
+"""
+from __future__ import annotations
+import argparse
+import csv
+import json
+import sys
+from itertools import islice
+from operator import attrgetter
+from typing import Callable, Iterator, List, TextIO, Tuple
+from tm_trees import TMTree, FileSystemTree
+from papers import PaperTree
+from tm_diff import DiffTree
+from tm_rollup import RollupTree
+
+# Formats that trees can be exported in
+CSV = 'csv'
+NDJSON = 'ndjson'
+
+# The number of rows written to the file at a time
+BATCH_ROWS = 4096
+
+# Values of the type column
+LEAF = 'leaf'
+INTERNAL = 'internal'
+
+# The columns exported for each subclass of TMTree, after the path, size and
+# type, as (column, attribute) pairs
+EXTRA_FIELDS = {
+    PaperTree: (('authors', '_authors'), ('doi', '_doi')),
+    DiffTree: (('kind', '_kind'), ('delta', '_delta')),
+    RollupTree: (('files', '_files'),)
+}
+
+
+def export_columns(tree: TMTree) -> List[str]:
+    """Return the names of the columns exported for <tree>.
+    """
+    return ['path', 'size', 'type'] + [column for column, _ in
+                                       _extra_fields(tree)]
+
+
+def _extra_fields(tree: TMTree) -> Tuple[Tuple[str, str], ...]:
+    """Return the extra (column, attribute) pairs exported for <tree>, as
+    listed in EXTRA_FIELDS for the closest class it is an instance of.
+    """
+    for cls in type(tree).__mro__:
+        if cls in EXTRA_FIELDS:
+            return EXTRA_FIELDS[cls]
+    return ()
+
+
+def iter_rows(tree: TMTree) -> Iterator[tuple]:
+    """Yield a row of the values of export_columns(tree) for <tree> and for
+    every tree within it, in preorder.
+
+    The path of each tree is made of the names from <tree> down to it, each
+    preceded by the separator of the tree it names, as in get_path_string,
+    but without a suffix.
+    """
+    extras = [attribute for _, attribute in _extra_fields(tree)]
+    if extras:
+        get_extras = attrgetter(*extras)
+        single = len(extras) == 1
+    else:
+        get_extras = None
+        single = False
+
+    def row(node: TMTree, path: str) -> tuple:
+        """Return the row of <node>, whose path is <path>.
+        """
+        kind = INTERNAL if node._subtrees else LEAF
+        if get_extras is None:
+            return path, node.data_size, kind
+        elif single:
+            return path, node.data_size, kind, get_extras(node)
+        else:
+            return (path, node.data_size, kind) + get_extras(node)
+
+    yield row(tree, tree._name)
+    if not tree._subtrees:
+        return
+    stack = [(tree._name, iter(tree._subtrees))]
+    while stack:
+        prefix, children = stack[-1]
+        for child in children:
+            path = prefix + child.get_separator() + child._name
+            yield row(child, path)
+            if child._subtrees:
+                stack.append((path, iter(child._subtrees)))
+                break
+        else:
+            stack.pop()
+
+
+def export_tree(tree: TMTree, out: TextIO, file_format: str = CSV,
+                header: bool = True) -> int:
+    """Write every node of <tree> to <out> in <file_format>, one per line,
+    and return the number of nodes written.
+
+    CSV output starts with a row of the column names if <header> is True.
+    Each line of NDJSON output is an object keyed by the column names.
+
+    Raise a ValueError if <file_format> is not CSV or NDJSON.
+    """
+    columns = export_columns(tree)
+    rows = iter_rows(tree)
+    if file_format == CSV:
+        write = csv.writer(out, lineterminator='\n').writerows
+        if header:
+            write([columns])
+    elif file_format == NDJSON:
+        write = _ndjson_writer(out, columns)
+    else:
+        raise ValueError('cannot export as {!r}'.format(file_format))
+
+    total = 0
+    batch = list(islice(rows, BATCH_ROWS))
+    while batch:
+        write(batch)
+        total += len(batch)
+        batch = list(islice(rows, BATCH_ROWS))
+    return total
+
+
+def _ndjson_writer(out: TextIO, columns: List[str]
+                   ) -> Callable[[List[tuple]], None]:
+    """Return a function that writes a batch of rows of <columns> to <out>
+    as NDJSON.
+
+    The size and type are formatted directly, and the path is encoded as
+    json.dumps(path, ensure_ascii=False) would, by one encoder made up
+    front. Only the extra columns, whose values may be of any JSON type, go
+    through the default JSON encoder.
+    """
+    encode_string = json.JSONEncoder(ensure_ascii=False).encode
+    keys = [encode_string(column) + ': ' for column in columns]
+    start = '{' + keys[0]
+    size_key = ', ' + keys[1]
+    type_keys = {kind: ', {}"{}"'.format(keys[2], kind)
+                 for kind in (LEAF, INTERNAL)}
+    extra_keys = [', ' + key for key in keys[3:]]
+    dumps = json.JSONEncoder().encode
+
+    def write(batch: List[tuple]) -> None:
+        """Write the rows in <batch> to <out>.
+        """
+        lines = []
+        for row in batch:
+            line = (start + encode_string(row[0]) + size_key +
+                    str(row[1]) + type_keys[row[2]])
+            for key, value in zip(extra_keys, row[3:]):
+                line += key + dumps(value)
+            lines.append(line + '}\n')
+        out.write(''.join(lines))
+
+    return write
+
+
+def main(args: List[str]) -> int:
+    """Export a scan of the folder named in the command line arguments
+    <args> to standard output, and return the exit status.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('path', help='the folder to scan and export')
+    parser.add_argument('--format', choices=[CSV, NDJSON], default=CSV)
+    parser.add_argument('--disk-usage', action='store_true',
+                        help='count blocks allocated on disk, as du does')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='processes scanning the folder')
+    options = parser.parse_args(args)
+
+    tree = FileSystemTree(options.path, disk_usage=options.disk_usage,
+                          workers=options.workers)
+    export_tree(tree, sys.stdout, options.format)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
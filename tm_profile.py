@@ -0,0 +1,171 @@
+"""Assignment 2: Profiling the treemap
+
+=== Module Description ===
+This module measures where the treemap spends its time. The expensive
+operations of the trees and the visualiser are marked as phases; while
+profiling is enabled, each call to a phase is timed, and the number of nodes
+or rectangles it handled is counted.
+
+The most recent measurements are kept in a ring buffer, grouped into frames
+of the visualiser, and can be summarised, drawn over the treemap, or written
+out as JSON or CSV.
+
+Profiling is disabled by default. While disabled, a phase costs one extra
+function call and one attribute check per call of the operation, not per
+node, so it is safe to leave the phases in place.
+"""
+import csv
+import json
+from collections import deque
+from functools import wraps
+from time import perf_counter
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+# The number of measurements kept by default
+DEFAULT_CAPACITY = 8192
+
+
+class Profiler:
+    """A recorder of timings and counts for the phases of the treemap.
+
+    === Public Attributes ===
+    enabled:
+        Whether or not measurements are being recorded.
+
+    === Private Attributes ===
+    _samples:
+        The most recent measurements, oldest first, as tuples of the frame,
+        the name of the phase or counter, the seconds taken and the count.
+    _frame:
+        The number of the current frame.
+    """
+    enabled: bool
+    _samples: Deque[Tuple[int, str, float, int]]
+    _frame: int
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY) -> None:
+        """Initialize a new, disabled Profiler that keeps the last <capacity>
+        measurements.
+        """
+        self.enabled = False
+        self._samples = deque(maxlen=capacity)
+        self._frame = 0
+
+    def enable(self) -> None:
+        """Start recording measurements.
+        """
+        self.enabled = True
+
+    def disable(self) -> None:
+        """Stop recording measurements. Those already recorded are kept.
+        """
+        self.enabled = False
+
+    def clear(self) -> None:
+        """Discard every measurement recorded so far.
+        """
+        self._samples.clear()
+
+    def phase(self, name: str) -> Callable[[Callable], Callable]:
+        """Return a decorator that times every call of a function as the phase
+        <name>.
+        """
+        def decorator(func: Callable) -> Callable:
+            @wraps(func)
+            def wrapper(*args: Any, **kwargs: Any) -> Any:
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                start = perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self._samples.append((self._frame, name,
+                                          perf_counter() - start, 0))
+            return wrapper
+        return decorator
+
+    def call(self, name: str, func: Callable, *args: Any) -> Any:
+        """Call <func> with <args>, timing it as the phase <name>, and return
+        its result.
+        """
+        if not self.enabled:
+            return func(*args)
+        start = perf_counter()
+        try:
+            return func(*args)
+        finally:
+            self._samples.append((self._frame, name,
+                                  perf_counter() - start, 0))
+
+    def count(self, name: str, amount: int) -> None:
+        """Add <amount> to the counter <name> for the current frame.
+        """
+        if self.enabled:
+            self._samples.append((self._frame, name, 0.0, amount))
+
+    def next_frame(self) -> None:
+        """Start a new frame.
+        """
+        self._frame += 1
+
+    def summary(self, frame: Optional[int] = None
+                ) -> Dict[str, Tuple[float, int, int]]:
+        """Return the total seconds, number of calls and total count for each
+        phase or counter recorded in <frame>, or in the last complete frame
+        if <frame> is None.
+        """
+        if frame is None:
+            frame = self._frame - 1
+        totals = {}
+        for sample_frame, name, seconds, amount in self._samples:
+            if sample_frame == frame:
+                old = totals.get(name, (0.0, 0, 0))
+                totals[name] = (old[0] + seconds, old[1] + 1, old[2] + amount)
+        return totals
+
+    def summary_lines(self, frame: Optional[int] = None) -> List[str]:
+        """Return one line of text for each phase or counter in the summary
+        of <frame>, slowest first, for displaying over the treemap.
+        """
+        totals = self.summary(frame)
+        lines = []
+        for name in sorted(totals, key=lambda key: -totals[key][0]):
+            seconds, calls, amount = totals[name]
+            if seconds > 0:
+                lines.append('{:<22}{:>8.2f} ms {:>4}x'.format(
+                    name, seconds * 1000, calls))
+            else:
+                lines.append('{:<22}{:>11}'.format(name, amount))
+        return lines
+
+    def dump_json(self, path: str) -> None:
+        """Write every measurement kept to the file at <path>, as JSON.
+        """
+        with open(path, 'w') as file:
+            json.dump([{'frame': frame, 'name': name, 'seconds': seconds,
+                        'count': amount}
+                       for frame, name, seconds, amount in self._samples],
+                      file, indent=1)
+
+    def dump_csv(self, path: str) -> None:
+        """Write every measurement kept to the file at <path>, as CSV.
+        """
+        with open(path, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(['frame', 'name', 'seconds', 'count'])
+            writer.writerows(self._samples)
+
+
+# The profiler shared by the trees and the visualiser
+PROFILER = Profiler()
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'python_ta', 'typing', 'csv', 'json', 'collections', 'functools',
+            'time'
+        ],
+        'allowed-io': ['dump_json', 'dump_csv']
+    })
@@ -0,0 +1,236 @@
+"""Assignment 2: Rolling up a file system scan by attribute
+
+=== Module Description ===
+This module answers questions that cut across the folder hierarchy of a
+FileSystemTree, such as how many bytes each file extension, each owner or
+each age of file takes up.
+
+A FileSystemTree scanned with rollup=True records the extension, owner and
+day of last modification of every file in its columns (see FileColumns).
+Files that agree on all three attributes share a group, and the total size
+and number of files in each group are kept as the scan records the files.
+rollup answers any number of group-bys in one pass over those group totals,
+so its work depends only on the number of groups (at most a few for each
+extension, owner and day), not on the number of files. group_totals can
+recompute the totals from the columns of files, in one pass over them.
+
+Any combination of attributes can also be turned into a RollupTree, which
+the treemap visualiser can display like any other tree: for example, by
+owner and then by extension.
+"""
+from __future__ import annotations
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Sequence, Tuple
+from tm_trees import FileColumns, TMTree
+
+try:
+    from pwd import getpwuid
+except ImportError:
+    getpwuid = None
+
+# Attributes that files can be rolled up by
+EXTENSION = 'extension'
+OWNER = 'owner'
+AGE = 'age'
+
+# The buckets of file age, as the number of days up to which a file belongs
+# to each, and its label; the last bucket holds every older file
+AGE_BUCKETS = [(1, 'today'), (7, 'this week'), (30, 'this month'),
+               (365, 'this year'), (None, 'older')]
+
+
+def group_totals(columns: FileColumns) -> Tuple[List[int], List[int]]:
+    """Return the total size and the number of files in each group of
+    <columns>, computed from the columns of files rather than taken from
+    columns.group_sizes and columns.group_counts.
+
+    This takes time proportional to the number of files.
+    """
+    sizes = [0] * len(columns.keys)
+    for group, size in zip(columns.groups, columns.sizes):
+        sizes[group] += size
+    counts = Counter(columns.groups)
+    return sizes, [counts[group] for group in range(len(columns.keys))]
+
+
+def rollup(columns: FileColumns,
+           attributes: Sequence[str] = (EXTENSION, OWNER, AGE),
+           now: Optional[float] = None
+           ) -> Dict[str, Dict[str, Tuple[int, int]]]:
+    """Return the total size and number of files for each value of each of
+    the <attributes>, keyed by attribute and then by value.
+
+    Ages are measured from the time <now>, in seconds since the start of
+    1970, or from the current time if it is None.
+    """
+    sizes, counts = columns.group_sizes, columns.group_counts
+    labeller = _Labeller(now)
+    totals = {attribute: {} for attribute in attributes}
+    for group, key in enumerate(columns.keys):
+        for attribute in attributes:
+            label = labeller.label(attribute, key)
+            old = totals[attribute].get(label, (0, 0))
+            totals[attribute][label] = (old[0] + sizes[group],
+                                        old[1] + counts[group])
+    return totals
+
+
+class _Labeller:
+    """The names given to the values of each attribute.
+
+    === Private Attributes ===
+    _today:
+        The current day, in days since the start of 1970.
+    _owners:
+        The name of each owner looked up so far, keyed by user id.
+    """
+    _today: int
+    _owners: Dict[int, str]
+
+    def __init__(self, now: Optional[float] = None) -> None:
+        """Initialize a new _Labeller that measures ages from <now>, or from
+        the current time if it is None.
+        """
+        self._today = int(time.time() if now is None else now) // 86400
+        self._owners = {}
+
+    def label(self, attribute: str, key: Tuple[str, int, int]) -> str:
+        """Return the name of the value of <attribute> for the files of a
+        group with the given <key>.
+
+        Raise a ValueError if <attribute> is not EXTENSION, OWNER or AGE.
+        """
+        extension, owner, day = key
+        if attribute == EXTENSION:
+            return extension or '(none)'
+        elif attribute == OWNER:
+            if owner not in self._owners:
+                self._owners[owner] = _owner_name(owner)
+            return self._owners[owner]
+        elif attribute == AGE:
+            age = self._today - day
+            for days, label in AGE_BUCKETS:
+                if days is None or age < days:
+                    return label
+        raise ValueError('cannot roll up by {!r}'.format(attribute))
+
+
+def _owner_name(owner: int) -> str:
+    """Return the user name of the user id <owner>, or the id itself if it
+    has no name on this computer.
+    """
+    if getpwuid is not None:
+        try:
+            return getpwuid(owner).pw_name
+        except KeyError:
+            pass
+    return str(owner)
+
+
+class RollupTree(TMTree):
+    """A tree of the totals of a rollup, for the visualiser.
+
+    Each level of the tree groups files by one attribute, and each leaf
+    holds the files that share a value of every attribute, sized by their
+    total size. Subtrees are ordered from largest to smallest.
+
+    === Private Attributes ===
+    _files:
+        The number of files in this tree.
+
+    === Inherited Attributes ===
+    rect:
+        The pygame rectangle representing this node in the treemap
+        visualization.
+    data_size:
+        The total size of the files in this tree.
+    _colour:
+        The RGB colour value of the root of this tree.
+    _name:
+        The value of the attribute shared by the files in this tree.
+    _subtrees:
+        The subtrees of this tree.
+    _parent_tree:
+        The parent tree of this tree; i.e., the tree that contains this tree
+        as a subtree, or None if this tree is not part of a larger tree.
+    _shown_since:
+        The time at which this tree was last expanded, or -1 if it has been
+        collapsed since.
+    _reset_at:
+        The time at which this tree was last collapsed or expanded on its
+        own, or 0 if it never has been.
+
+    === Representation Invariants ===
+    - All TMTree RIs are inherited.
+    """
+    _files: int
+
+    def __init__(self, name: str, subtrees: List[RollupTree],
+                 data_size: int = 0, files: int = 0) -> None:
+        """Initialize a new RollupTree named <name>, holding <subtrees>, or
+        <files> files of total size <data_size> if it is a leaf.
+        """
+        super().__init__(name, subtrees, data_size)
+        if subtrees:
+            self._files = sum(tree._files for tree in subtrees)
+        else:
+            self._files = files
+
+    def get_separator(self) -> str:
+        """Return the separator between the values in a path.
+        """
+        return ' / '
+
+    def get_suffix(self) -> str:
+        """Return the final descriptor of this tree.
+        """
+        return ' ({} files)'.format(self._files)
+
+
+def build_rollup_tree(columns: FileColumns, attributes: Sequence[str],
+                      now: Optional[float] = None,
+                      name: str = 'files') -> RollupTree:
+    """Return a RollupTree named <name> of the files in <columns>, grouped
+    by each of the <attributes> in turn.
+
+    Ages are measured from <now>, as in rollup.
+
+    Precondition: <attributes> is not empty.
+    """
+    sizes, counts = columns.group_sizes, columns.group_counts
+    labeller = _Labeller(now)
+    nested = {}
+    for group, key in enumerate(columns.keys):
+        working_dict = nested
+        for attribute in attributes[:-1]:
+            working_dict = working_dict.setdefault(
+                labeller.label(attribute, key), {})
+        label = labeller.label(attributes[-1], key)
+        old = working_dict.get(label, (0, 0))
+        working_dict[label] = (old[0] + sizes[group], old[1] + counts[group])
+    return RollupTree(name, _build_rollup_subtrees(nested))
+
+
+def _build_rollup_subtrees(nested_dict: Dict) -> List[RollupTree]:
+    """Return a list of RollupTrees from the nested dictionary <nested_dict>,
+    whose leaves are (size, files) tuples, largest first.
+    """
+    ans = []
+    for name, value in nested_dict.items():
+        if isinstance(value, tuple):
+            ans.append(RollupTree(name, [], value[0], value[1]))
+        else:
+            ans.append(RollupTree(name, _build_rollup_subtrees(value)))
+    ans.sort(key=lambda tree: -tree.data_size)
+    return ans
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'python_ta', 'typing', 'time', 'collections', 'pwd', 'tm_trees',
+            '__future__'
+        ]
+    })
@@ -0,0 +1,622 @@
+"""Assignment 2: Trees stored on disk, for trees larger than memory
+
+=== Module Description ===
+Some trees have more nodes than fit in memory, even as the compact nodes of
+a TMTree. This module keeps the nodes of such a tree in an SQLite database
+instead, and only turns into StoredTrees the parts of it that the
+visualiser is laying out, drawing or hit-testing.
+
+write_store saves a whole TMTree, and write_store_rows saves a tree given as
+rows, so that a store can be made of a tree that never fits in memory at
+all. The nodes are numbered in breadth-first order, so the subtrees of each
+node are a contiguous range of numbers, and loading them is a single range
+query on the primary key.
+
+open_store returns the root of a store. The subtrees of a StoredTree are
+loaded the first time they are needed. Each load is remembered in a least
+recently used cache, and once the trees loaded take up more than the memory
+budget, the subtrees loaded least recently are dropped again: they are
+loaded from the store again if they are needed later. Trees used since the
+last layout was applied are never dropped, so the budget is a soft limit
+that the part of the tree on the screen may exceed. Dropping the subtrees of
+a tree also drops every tree loaded below them, unless that would forget
+which of them are expanded or collapsed.
+
+A treemap has no room to draw the subtrees of a tree whose rectangle is only
+a few pixels in size, so a StoredTree whose rectangle covers fewer than
+MIN_AREA square pixels is laid out, drawn and hit-tested as if it were a
+leaf, without loading its subtrees. However many nodes a store holds, the
+number of trees loaded to display it is then limited by the number of pixels
+on the screen. Zooming into such a tree lays out its subtrees.
+
+A StoredTree cannot be edited: moves and size changes are ignored.
+"""
+from __future__ import annotations
+import os
+import sqlite3
+from collections import OrderedDict, deque
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from tm_trees import TMTree, TMTransaction, EditJournal, NormalizedLayout
+
+# The default memory budget of an open store, in bytes
+DEFAULT_MEMORY = 256 * 1024 * 1024
+
+# The approximate number of bytes of memory taken by each StoredTree loaded
+NODE_BYTES = 500
+
+# Trees whose rectangles cover fewer square pixels than this are laid out,
+# drawn and hit-tested as leaves
+MIN_AREA = 64
+
+# The number of rows inserted into a store at a time
+INSERT_ROWS = 10000
+
+# The columns of each node in a store: its number, name and size, the number
+# of its first subtree and how many subtrees it has, and its hash as a signed
+# 64-bit integer
+_SCHEMA = """
+CREATE TABLE nodes (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    first INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    hash INTEGER NOT NULL
+);
+CREATE TABLE meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+_SELECT_RANGE = ('SELECT id, name, size, first, count, hash FROM nodes '
+                 'WHERE id >= ? AND id < ? ORDER BY id')
+
+# A row of the nodes table
+Row = Tuple[int, str, int, int, int, int]
+
+
+def write_store(tree: TMTree, path: str) -> int:
+    """Save every node of <tree> to a new store at <path>, replacing any
+    file already there, and return the number of nodes saved.
+
+    Only the names, data sizes, shape and hashes of the trees are saved.
+
+    Precondition: <tree> is not empty.
+    """
+    def rows() -> Iterator[Row]:
+        """Yield the row of each tree in <tree>, breadth first.
+        """
+        waiting = deque([tree])
+        next_id = 2
+        node_id = 1
+        while waiting:
+            node = waiting.popleft()
+            subtrees = node.get_subtrees()
+            yield (node_id, node.get_name(), node.data_size,
+                   next_id if subtrees else 0, len(subtrees),
+                   node.get_hash())
+            next_id += len(subtrees)
+            node_id += 1
+            waiting.extend(subtrees)
+
+    return write_store_rows(path, rows(), tree.get_separator())
+
+
+def write_store_rows(path: str, rows: Iterable[Row],
+                     separator: str = os.sep) -> int:
+    """Save the nodes given by <rows> to a new store at <path>, replacing any
+    file already there, and return the number of nodes saved. The names of
+    the trees are separated by <separator> in their paths.
+
+    Each row is (number, name, size, first, count, hash): the number of a
+    node, its name and data size, the number of its first subtree (or 0)
+    and how many subtrees it has, and an unsigned 64-bit hash of it.
+
+    Precondition: the rows are in order of number, starting at 1 for the
+    root; the subtrees of each node are numbered consecutively, and each size
+    is the total size of the node's subtrees if it has any.
+    """
+    if os.path.exists(path):
+        os.remove(path)
+    connection = sqlite3.connect(path)
+    try:
+        connection.execute('PRAGMA journal_mode = OFF')
+        connection.execute('PRAGMA synchronous = OFF')
+        connection.executescript(_SCHEMA)
+        connection.execute('INSERT INTO meta VALUES (?, ?)',
+                           ('separator', separator))
+        total = 0
+        rows = iter(rows)
+        batch = list(islice(rows, INSERT_ROWS))
+        while batch:
+            connection.executemany(
+                'INSERT INTO nodes VALUES (?, ?, ?, ?, ?, ?)',
+                [row[:5] + (_to_signed(row[5]),) for row in batch])
+            total += len(batch)
+            batch = list(islice(rows, INSERT_ROWS))
+        connection.commit()
+    finally:
+        connection.close()
+    return total
+
+
+def _to_signed(value: int) -> int:
+    """Return the unsigned 64-bit integer <value> as a signed one, which is
+    how SQLite stores integers.
+    """
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def _to_unsigned(value: int) -> int:
+    """Return the signed 64-bit integer <value>, as SQLite stores it, as an
+    unsigned one.
+    """
+    return value + (1 << 64) if value < 0 else value
+
+
+def open_store(path: str, memory: int = DEFAULT_MEMORY) -> StoredTree:
+    """Return the root of the store at <path>, keeping the trees loaded from
+    it to about <memory> bytes.
+
+    Raise a FileNotFoundError if there is no file at <path>.
+    """
+    if not os.path.isfile(path):
+        raise FileNotFoundError(path)
+    store = _Store(sqlite3.connect(path), max(memory // NODE_BYTES, 1))
+    row = store.connection.execute(_SELECT_RANGE, (1, 2)).fetchone()
+    return StoredTree(store, row, None)
+
+
+class _Store:
+    """An open store, and the cache of the subtrees loaded from it.
+
+    === Public Attributes ===
+    connection:
+        The connection to the SQLite database of the store.
+    separator:
+        The separator between names in the paths of the trees.
+    budget:
+        The number of trees that may be loaded before some are dropped.
+    loaded:
+        The number of trees loaded and still in the cache.
+    peak:
+        The largest value that loaded has had.
+    loads:
+        The number of times the subtrees of a tree have been loaded.
+    drops:
+        The number of times the subtrees of a tree have been dropped.
+
+    === Private Attributes ===
+    _cache:
+        The trees whose subtrees are loaded, keyed by their id (as given by
+        the id function), least recently used first.
+    _frame:
+        The number of layouts applied so far. Trees used since the last
+        layout was applied have their _used set to _frame.
+
+    === Representation Invariants ===
+    - loaded is the total number of subtrees of the trees in _cache
+    """
+    connection: sqlite3.Connection
+    separator: str
+    budget: int
+    loaded: int
+    peak: int
+    loads: int
+    drops: int
+    _cache: Dict[int, StoredTree]
+    _frame: int
+
+    def __init__(self, connection: sqlite3.Connection, budget: int) -> None:
+        """Initialize a new _Store reading from <connection>, which keeps up
+        to about <budget> trees loaded.
+        """
+        self.connection = connection
+        self.separator = connection.execute(
+            "SELECT value FROM meta WHERE key = 'separator'").fetchone()[0]
+        self.budget = budget
+        self.loaded = 0
+        self.peak = 0
+        self.loads = 0
+        self.drops = 0
+        self._cache = OrderedDict()
+        self._frame = 0
+
+    def subtrees(self, tree: StoredTree,
+                 reuse: Optional[Dict[int, StoredTree]] = None
+                 ) -> List[StoredTree]:
+        """Return the subtrees of <tree>, loading them if they are not
+        loaded, and mark them as used.
+
+        A subtree being loaded is taken from <reuse>, keyed by its number in
+        the store, if it is there, rather than made anew.
+        """
+        if tree._children is not None:
+            self.use(tree)
+            return tree._children
+
+        rows = self.connection.execute(
+            _SELECT_RANGE, (tree._first, tree._first + tree._count))
+        if reuse:
+            children = [reuse.get(row[0]) or StoredTree(self, row, tree)
+                        for row in rows]
+        else:
+            children = [StoredTree(self, row, tree) for row in rows]
+        tree._children = children
+        tree._used = self._frame
+        self._cache[id(tree)] = tree
+        self.loaded += len(children)
+        self.peak = max(self.peak, self.loaded)
+        self.loads += 1
+        self.trim()
+        return tree._children
+
+    def use(self, tree: StoredTree) -> None:
+        """Mark the subtrees of <tree>, which are loaded, as used.
+        """
+        tree._used = self._frame
+        self._cache.move_to_end(id(tree))
+
+    def new_frame(self, tree: StoredTree) -> None:
+        """Start a new layout of <tree>, after which only the trees used from
+        now on, and the ancestors of <tree>, are kept loaded regardless of
+        the budget.
+        """
+        self._frame += 1
+        tree = tree._parent_tree
+        while tree is not None:
+            if tree._children is not None:
+                self.use(tree)
+            tree = tree._parent_tree
+
+    def trim(self) -> None:
+        """Drop the subtrees of the least recently used trees, along with
+        every tree loaded below them, until the trees loaded are within the
+        budget, or every tree left has been used since the last layout was
+        applied or holds a tree that must be kept (see _droppable).
+        """
+        skipped = 0
+        while self.loaded > self.budget and skipped < len(self._cache):
+            tree = next(iter(self._cache.values()))
+            if tree._used == self._frame:
+                break
+            loaded = _droppable(tree)
+            if loaded is None:
+                self._cache.move_to_end(id(tree))
+                skipped += 1
+            else:
+                for dropped in loaded:
+                    del self._cache[id(dropped)]
+                    self.loaded -= len(dropped._children)
+                    self.drops += 1
+                    dropped._children = None
+
+
+def _droppable(tree: StoredTree) -> Optional[List[StoredTree]]:
+    """Return <tree> and every tree below it whose subtrees are loaded, if
+    dropping all of their subtrees loses nothing, or else None.
+
+    The trees dropped are loaded again as trees that have never been
+    expanded or collapsed. Nothing is lost if each of them would then be
+    expanded or collapsed just as it is now, and each expanded one that is
+    kept as it is would load its own subtrees expanded, as it does now.
+    What lies below a collapsed tree does not matter, since expanding that
+    tree collapses its subtrees again, and expand_all marks every tree.
+    Leaves are drawn the same either way.
+
+    Precondition: the subtrees of <tree> are loaded.
+    """
+    loaded = []
+    # Each entry holds a tree and whether the trees below it must be checked
+    stack = [(tree, True)]
+    while stack:
+        parent, check = stack.pop()
+        loaded.append(parent)
+        reset = parent._reset_at
+        # Loaded again, the subtrees of <tree> are expanded unless <tree> was
+        # ever collapsed or expanded on its own; those of the trees dropped
+        # are expanded
+        fresh = parent is not tree or reset == 0
+        for subtree in parent._children:
+            shown = check and subtree._count > 0 and \
+                subtree._shown_since >= reset
+            if check and subtree._count > 0 and shown != fresh:
+                return None
+            if shown and subtree._children is None and \
+                    subtree._reset_at != 0:
+                return None
+            if subtree._children is not None:
+                stack.append((subtree, shown))
+    return loaded
+
+
+class StoredTree(TMTree):
+    """A tree whose nodes are kept in a store on disk, and loaded as they are
+    needed.
+
+    === Private Attributes ===
+    _store:
+        The store this tree was loaded from.
+    _id:
+        The number of this tree in the store.
+    _first:
+        The number of the first subtree of this tree in the store.
+    _count:
+        The number of subtrees of this tree.
+    _children:
+        The subtrees of this tree, or None if they are not loaded.
+    _open:
+        Whether or not the subtrees of this tree were laid out the last time
+        it was laid out.
+    _used:
+        The layout in which the subtrees of this tree were last used.
+
+    === Inherited Attributes ===
+    rect:
+        The pygame rectangle representing this node in the treemap
+        visualization.
+    data_size:
+        The size of the data represented by this tree.
+    _colour:
+        The RGB colour value of the root of this tree, which is taken from
+        its hash so that it is the same each time the tree is loaded.
+    _name:
+        The name of this tree.
+    _subtrees:
+        The subtrees of this tree, which are loaded when this is read.
+    _parent_tree:
+        The parent tree of this tree; i.e., the tree that contains this tree
+        as a subtree, or None if this tree is the root of the store.
+    _shown_since:
+        The time at which this tree was last expanded, or -1 if it has been
+        collapsed since.
+    _reset_at:
+        The time at which this tree was last collapsed or expanded on its
+        own, or 0 if it never has been.
+    _hash:
+        The hash of this tree, as saved in the store.
+    _child_hash_sum:
+        Always 0, since a StoredTree is never rehashed.
+    _metrics:
+        Always None.
+
+    === Representation Invariants ===
+    - All TMTree RIs are inherited, except the one on _child_hash_sum.
+    - _children is None or has _count trees
+    - If _count is 0, then _children is None
+    """
+    _store: _Store
+    _id: int
+    _first: int
+    _count: int
+    _children: Optional[List[StoredTree]]
+    _open: bool
+    _used: int
+
+    def __init__(self, store: _Store, row: Row,
+                 parent: Optional[StoredTree]) -> None:
+        """Initialize a new StoredTree from the <row> of <store> for it, as a
+        subtree of <parent>.
+
+        The TMTree initializer is not used, as it would load the whole tree
+        to add up its size, which the store already holds.
+        """
+        node_id, name, size, first, count, node_hash = row
+        self.rect = (0, 0, 0, 0)
+        self.data_size = size
+        self._name = name
+        self._parent_tree = parent
+        self._shown_since = 0
+        self._reset_at = 0
+        self._hash = _to_unsigned(node_hash)
+        self._child_hash_sum = 0
+        self._metrics = None
+        self._colour = (self._hash & 255, (self._hash >> 8) & 255,
+                        (self._hash >> 16) & 255)
+        self._store = store
+        self._id = node_id
+        self._first = first
+        self._count = count
+        self._children = None
+        self._open = False
+        self._used = 0
+
+    @property
+    def _subtrees(self) -> List[StoredTree]:
+        """Return the subtrees of this tree, loading them if need be.
+
+        A StoredTree is never edited, so its subtrees are kept in a plain
+        list.
+        """
+        if self._count == 0:
+            return []
+        return self._store.subtrees(self)
+
+    def _layout(self, rect: Tuple[int, int, int, int], expanded: bool) -> int:
+        """Update the rectangles in this tree and its descendents to fill
+        <rect>, and return the number of trees whose rectangles were updated,
+        laying out the subtrees of this tree only if opens_subtrees says to.
+
+        <expanded> is whether or not this tree is expanded.
+        """
+        if self.data_size == 0:
+            return 0
+        self.rect = rect
+        if not expanded or not self.opens_subtrees(rect[2] * rect[3]):
+            return 1
+        return 1 + self._divide_rects(rect)
+
+    def opens_subtrees(self, area: float) -> bool:
+        """Return whether the subtrees of this tree are laid out when it is
+        expanded and its rectangle covers <area> square pixels: if it has
+        any, and <area> is at least MIN_AREA. They are loaded if so.
+        """
+        self._open = self._count > 0 and area >= MIN_AREA
+        if self._open:
+            self._store.subtrees(self)
+        return self._open
+
+    def finish_layout(self, layout: NormalizedLayout) -> None:
+        """Record which of the trees in <layout> had their subtrees laid out,
+        since that is what decides whether they are drawn as leaves, and mark
+        their subtrees as used.
+
+        If <layout> was computed before some of those subtrees were dropped,
+        they are loaded again, keeping the trees in <layout> so that they
+        have the rectangles it gave them.
+        """
+        store = self._store
+        store.new_frame(self)
+        dropped = {}
+        for index, (tree, end) in enumerate(zip(layout.trees, layout.ends)):
+            tree._open = end != index + 1
+            if tree._open and tree._children is None:
+                dropped[id(tree)] = {}
+            elif tree._open:
+                store.use(tree)
+        if dropped:
+            for tree in layout.trees:
+                if id(tree._parent_tree) in dropped:
+                    dropped[id(tree._parent_tree)][tree._id] = tree
+            for tree in layout.trees:
+                if id(tree) in dropped:
+                    store.subtrees(tree, dropped[id(tree)])
+        store.trim()
+
+    def update_rectangles(self, rect: Tuple[int, int, int, int]) -> None:
+        """Update the rectangles in this tree and its descendents using the
+        treemap algorithm to fill the area defined by pygame rectangle <rect>.
+
+        Trees whose rectangles cover fewer than MIN_AREA square pixels are
+        laid out as leaves.
+        """
+        self._store.new_frame(self)
+        super().update_rectangles(rect)
+        self._store.trim()
+
+    def _collect_rectangles(self, rects: List[Tuple[Tuple[int, int, int, int],
+                                                    Tuple[int, int, int]]],
+                            expanded: bool) -> None:
+        """Append the rectangle and colour of every leaf in the displayed-tree
+        rooted at this tree to <rects>, treating it as a leaf if its subtrees
+        were not laid out, or have been dropped since. <expanded> is whether
+        or not this tree is expanded.
+        """
+        if self._open and self._children is not None:
+            super()._collect_rectangles(rects, expanded)
+        else:
+            rects.append((self.rect, self._colour))
+
+    def _find(self, pos: Tuple[int, int],
+              expanded: bool) -> Tuple[Optional[TMTree], int]:
+        """Return the leaf in the displayed-tree rooted at this tree whose
+        rectangle contains position <pos>, as in get_tree_at_position, and
+        the number of trees visited to find it, treating this tree as a leaf
+        as _collect_rectangles does. <expanded> is whether or not this tree
+        is expanded.
+        """
+        if expanded and self._open and self._children is not None:
+            return super()._find(pos, True)
+        x, y = pos
+        left, top, width, height = self.rect
+        if left <= x <= left + width and top <= y <= top + height:
+            return self, 1
+        return None, 1
+
+    def update_data_sizes(self) -> int:
+        """Return the data_size of this tree, which the store already holds.
+        """
+        return self.data_size
+
+    def expand_all(self, relayout: bool = True) -> None:
+        """Expand this tree, and all trees within it, laying this tree out
+        again if <relayout>.
+        If this tree is exanded, or a leaf, do nothing.
+
+        Trees that are not loaded are expanded when they are loaded again
+        (see _droppable), so only the trees loaded are marked as expanded,
+        and those below them are then expanded as well.
+        """
+        if self._count == 0 or self._is_expanded():
+            pass
+
+        else:
+            loaded = []
+            stack = [self]
+            while stack:
+                tree = stack.pop()
+                loaded.append(tree)
+                if tree._children is not None:
+                    stack.extend(tree._children)
+            TMTree.mark_expanded(loaded)
+            if relayout:
+                self.update_rectangles(self.rect)
+
+    def move(self, destination: TMTree) -> None:
+        """Do nothing, since a StoredTree cannot be edited.
+        """
+
+    def change_size(self, factor: float) -> None:
+        """Do nothing, since a StoredTree cannot be edited.
+        """
+
+    def transaction(self, journal: Optional[EditJournal] = None,
+                    relayout: bool = True) -> TMTransaction:
+        """Return a new transaction on the whole tree containing this tree, as
+        in TMTree.transaction, whose edits are all ignored. Nothing is ever
+        recorded in <journal>.
+        """
+        return _ReadOnlyTransaction(self._get_root(), None, relayout)
+
+    def get_separator(self) -> str:
+        """Return the separator saved with the store.
+        """
+        return self._store.separator
+
+    def get_suffix(self) -> str:
+        """Return the final descriptor of this tree.
+        """
+        if self._count == 0:
+            return ' (leaf)'
+        return ' ({} subtrees)'.format(self._count)
+
+    def get_store_stats(self) -> Dict[str, int]:
+        """Return the number of trees loaded from the store of this tree, the
+        most that have been loaded at once, the number that may be loaded
+        before some are dropped, and the number of times subtrees have been
+        loaded and dropped.
+        """
+        store = self._store
+        return {'loaded': store.loaded, 'peak': store.peak,
+                'budget': store.budget, 'loads': store.loads,
+                'drops': store.drops}
+
+    def close(self) -> None:
+        """Close the store of this tree. Trees that are not loaded can no
+        longer be loaded.
+        """
+        self._store.connection.close()
+
+
+class _ReadOnlyTransaction(TMTransaction):
+    """A transaction on a StoredTree, which ignores every edit.
+    """
+
+    def commit(self) -> None:
+        """Discard every queued edit, and lay the tree out if asked to.
+        """
+        self._edits = []
+        if self._relayout:
+            self._root.update_rectangles(self._root.rect)
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'python_ta', 'typing', 'os', 'sqlite3', 'collections', 'itertools',
+            'tm_trees', '__future__'
+        ]
+    })
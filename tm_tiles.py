@@ -0,0 +1,581 @@
+"""Assignment 2: Serving a treemap as map tiles
+
+=== Module Description ===
+This module serves a snapshot of a TMTree over HTTP, so that a treemap of a
+scan can be browsed from any machine with a web browser or a small script,
+without running pygame.
+
+The treemap is laid out once, as a NormalizedLayout of a square, and served
+as 256x256 PNG tiles in the usual z/x/y scheme: at zoom level z the square is
+cut into 2 ** z by 2 ** z tiles. Only the rectangles that overlap a tile are
+visited when drawing it, and a folder whose rectangle is smaller than a pixel
+is drawn in its own colour rather than visited, so a tile takes time
+proportional to what it shows rather than to the size of the tree.
+
+Run this module with the path of a folder to scan it and serve its tiles.
+The server has three kinds of endpoint:
+    /tiles/<z>/<x>/<y>.png   a tile of the treemap
+    /hit?x=<x>&y=<y>         the leaf at a point, given as fractions of the
+                             width and height of the whole treemap
+    /search?q=<text>         the trees whose names contain <text>
+and /info describes the snapshot.
+
+Rendered tiles are kept in a TileCache, which evicts the least recently used
+tiles once their total size in bytes passes a budget. Tiles can be rendered
+by a pool of worker processes; the top few zoom levels are rendered when the
+server starts, and once a tile has been asked for HOT_REQUESTS times, the
+four tiles that zoom into it are rendered in the background.
+
+load_test measures how many tiles per second a running server delivers, and
+its latency.
+"""
+from __future__ import annotations
+import argparse
+import json
+import math
+import os
+import random
+import struct
+import sys
+import threading
+import time
+import zlib
+from array import array
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+from urllib.request import urlopen
+from tm_trees import FileSystemTree, NormalizedLayout, TMTree
+
+# The width and height of a tile, in pixels
+TILE_SIZE = 256
+
+# The deepest zoom level served
+MAX_ZOOM = 24
+
+# The zoom levels up to which every tile is rendered when the server starts
+PRERENDER_ZOOM = 2
+
+# The number of requests for a tile after which the tiles inside it are
+# rendered ahead of time
+HOT_REQUESTS = 3
+
+# The default budget of the tile cache, in bytes
+DEFAULT_CACHE_BYTES = 64 * 1024 * 1024
+
+# The most search results returned by default
+DEFAULT_SEARCH_LIMIT = 50
+
+# The colour of the parts of a tile outside the treemap
+_BACKGROUND = b'\x00\x00\x00'
+
+# The snapshot used by each worker process
+_WORKER_SNAPSHOT = None
+
+
+class TileSnapshot:
+    """The parts of a layout needed to draw tiles.
+
+    This holds no trees, so it is cheap to send to worker processes.
+
+    === Public Attributes ===
+    coords:
+        The left, top, right and bottom edges of each tree in the layout, as
+        fractions of the side of the whole square, in preorder.
+    ends:
+        For each tree, the position just after its last descendant.
+    colours:
+        The RGB colour of each tree, three bytes per tree.
+    """
+    coords: array
+    ends: array
+    colours: bytes
+
+    def __init__(self, layout: NormalizedLayout) -> None:
+        """Initialize a new TileSnapshot of <layout>.
+        """
+        self.coords = layout.coords
+        self.ends = layout.ends
+        self.colours = bytes(channel for tree in layout.trees
+                             for channel in tree._colour)
+
+
+def render_tile(snapshot: TileSnapshot, z: int, x: int, y: int) -> bytes:
+    """Return tile <x>, <y> at zoom level <z> of <snapshot>, as a PNG image.
+    """
+    scale = TILE_SIZE * (1 << z)
+    left_edge, top_edge = x * TILE_SIZE, y * TILE_SIZE
+    stride = TILE_SIZE * 3
+    pixels = bytearray(_BACKGROUND * (TILE_SIZE * TILE_SIZE))
+    coords, ends, colours = snapshot.coords, snapshot.ends, snapshot.colours
+
+    i = 0
+    while i < len(ends):
+        # Edges are rounded as in NormalizedLayout.apply, so that tiles meet
+        left = math.floor(coords[4 * i] * scale + 0.5) - left_edge
+        top = math.floor(coords[4 * i + 1] * scale + 0.5) - top_edge
+        right = math.floor(coords[4 * i + 2] * scale + 0.5) - left_edge
+        bottom = math.floor(coords[4 * i + 3] * scale + 0.5) - top_edge
+        if right <= max(left, 0) or bottom <= max(top, 0) or \
+                left >= TILE_SIZE or top >= TILE_SIZE:
+            i = ends[i]
+        elif ends[i] == i + 1 or (right - left <= 1 and bottom - top <= 1):
+            left, right = max(left, 0), min(right, TILE_SIZE)
+            row = colours[3 * i:3 * i + 3] * (right - left)
+            for line in range(max(top, 0), min(bottom, TILE_SIZE)):
+                pixels[line * stride + 3 * left:line * stride + 3 * right] = \
+                    row
+            i = ends[i]
+        else:
+            i += 1
+    return _encode_png(pixels, TILE_SIZE, TILE_SIZE)
+
+
+def _encode_png(pixels: bytearray, width: int, height: int) -> bytes:
+    """Return the RGB image <pixels>, of the given <width> and <height>, as
+    a PNG file.
+    """
+    stride = width * 3
+    raw = b''.join(b'\x00' + pixels[line * stride:(line + 1) * stride]
+                   for line in range(height))
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack('>I', len(data)) + kind + data + \
+            struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+
+    return b'\x89PNG\r\n\x1a\n' + \
+        chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)) \
+        + chunk(b'IDAT', zlib.compress(raw, 6)) + chunk(b'IEND', b'')
+
+
+def _init_worker(snapshot: TileSnapshot) -> None:
+    """Store <snapshot> for the tiles rendered by this worker process.
+    """
+    global _WORKER_SNAPSHOT
+    _WORKER_SNAPSHOT = snapshot
+
+
+def _render_in_worker(z: int, x: int, y: int) -> bytes:
+    """Return tile <x>, <y> at zoom level <z> of this worker's snapshot.
+    """
+    return render_tile(_WORKER_SNAPSHOT, z, x, y)
+
+
+class TileCache:
+    """The most recently used tiles, up to a budget of bytes.
+
+    === Public Attributes ===
+    max_bytes:
+        The most bytes of tiles kept.
+    hits:
+        The number of lookups that found their tile.
+    misses:
+        The number of lookups that did not.
+    evictions:
+        The number of tiles evicted to make room for others.
+
+    === Private Attributes ===
+    _tiles:
+        The cached tiles, keyed by (z, x, y), least recently used first.
+    _bytes:
+        The total size of the cached tiles.
+    _lock:
+        Held while the cache is read or changed, since the server handles
+        each request on its own thread.
+
+    === Representation Invariants ===
+    - _bytes == sum(len(tile) for tile in _tiles.values()) <= max_bytes
+    """
+    max_bytes: int
+    hits: int
+    misses: int
+    evictions: int
+    _tiles: Dict[Tuple[int, int, int], bytes]
+    _bytes: int
+    _lock: threading.Lock
+
+    def __init__(self, max_bytes: int = DEFAULT_CACHE_BYTES) -> None:
+        """Initialize a new, empty TileCache of at most <max_bytes>.
+        """
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._tiles = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        """Return the number of cached tiles.
+        """
+        return len(self._tiles)
+
+    def __contains__(self, key: Tuple[int, int, int]) -> bool:
+        """Return True iff the tile <key> is cached.
+        """
+        return key in self._tiles
+
+    def size(self) -> int:
+        """Return the total size of the cached tiles, in bytes.
+        """
+        return self._bytes
+
+    def get(self, key: Tuple[int, int, int]) -> Optional[bytes]:
+        """Return the cached tile <key>, or None if it is not cached.
+        """
+        with self._lock:
+            tile = self._tiles.get(key)
+            if tile is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._tiles.move_to_end(key)
+            return tile
+
+    def put(self, key: Tuple[int, int, int], tile: bytes) -> None:
+        """Cache <tile> as <key>, evicting the least recently used tiles
+        until it fits. A tile larger than the whole budget is not cached.
+        """
+        if len(tile) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._tiles.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old)
+            while self._bytes + len(tile) > self.max_bytes:
+                _, evicted = self._tiles.popitem(last=False)
+                self._bytes -= len(evicted)
+                self.evictions += 1
+            self._tiles[key] = tile
+            self._bytes += len(tile)
+
+
+class TreemapTiles:
+    """A snapshot of a tree, served as tiles, hit-tests and searches.
+
+    Later changes to the tree do not affect the snapshot.
+
+    === Public Attributes ===
+    cache:
+        The rendered tiles.
+
+    === Private Attributes ===
+    _trees:
+        The trees of the snapshot's layout, in preorder.
+    _separator:
+        The separator used in the paths of the trees.
+    _snapshot:
+        What is needed to draw tiles.
+    _pool:
+        The worker processes that render tiles, or None to render them on
+        the thread that asks for them.
+    _pending:
+        The tiles being rendered by the pool, keyed by (z, x, y).
+    _requests:
+        The number of times each tile has been asked for.
+    _lock:
+        Held while _pending or _requests is read or changed.
+    """
+    cache: TileCache
+    _trees: List[TMTree]
+    _separator: str
+    _snapshot: TileSnapshot
+    _pool: Optional[ProcessPoolExecutor]
+    _pending: Dict[Tuple[int, int, int], Future]
+    _requests: Dict[Tuple[int, int, int], int]
+    _lock: threading.Lock
+
+    def __init__(self, tree: TMTree, cache_bytes: int = DEFAULT_CACHE_BYTES,
+                 workers: int = 0) -> None:
+        """Initialize a new TreemapTiles of the displayed-tree rooted at
+        <tree>, caching up to <cache_bytes> of tiles.
+
+        If <workers> is positive, tiles are rendered by that many worker
+        processes, and the tiles up to zoom level PRERENDER_ZOOM are rendered
+        in the background.
+        """
+        layout = NormalizedLayout(tree)
+        self.cache = TileCache(cache_bytes)
+        self._trees = layout.trees
+        self._separator = tree.get_separator()
+        self._snapshot = TileSnapshot(layout)
+        self._pending = {}
+        self._requests = {}
+        self._lock = threading.Lock()
+        self._pool = None
+        if workers > 0:
+            self._pool = ProcessPoolExecutor(workers, initializer=_init_worker,
+                                             initargs=(self._snapshot,))
+            for z in range(PRERENDER_ZOOM + 1):
+                for x in range(1 << z):
+                    for y in range(1 << z):
+                        self._render_later((z, x, y))
+
+    def close(self) -> None:
+        """Stop the worker processes, if there are any.
+        """
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+
+    def get_tile(self, z: int, x: int, y: int) -> bytes:
+        """Return tile <x>, <y> at zoom level <z>, as a PNG image.
+
+        Raise a ValueError if there is no such tile.
+        """
+        if not (0 <= z <= MAX_ZOOM and 0 <= x < (1 << z) and
+                0 <= y < (1 << z)):
+            raise ValueError('no tile {}/{}/{}'.format(z, x, y))
+        key = (z, x, y)
+        with self._lock:
+            self._requests[key] = self._requests.get(key, 0) + 1
+            hot = self._requests[key] == HOT_REQUESTS and z < MAX_ZOOM
+        if hot:
+            for child in ((z + 1, 2 * x + dx, 2 * y + dy)
+                          for dx in (0, 1) for dy in (0, 1)):
+                self._render_later(child)
+
+        tile = self.cache.get(key)
+        if tile is not None:
+            return tile
+        future = self._render_later(key)
+        if future is None:
+            tile = render_tile(self._snapshot, z, x, y)
+            self.cache.put(key, tile)
+            return tile
+        return future.result()
+
+    def _render_later(self, key: Tuple[int, int, int]) -> Optional[Future]:
+        """Start rendering tile <key> in the pool, unless it is cached or
+        already being rendered, and return the Future of its PNG image.
+
+        Return None if there is no pool, or the tile is already cached.
+        """
+        if self._pool is None or key in self.cache:
+            return None
+        with self._lock:
+            future = self._pending.get(key)
+            if future is None:
+                future = self._pool.submit(_render_in_worker, *key)
+                self._pending[key] = future
+                future.add_done_callback(
+                    lambda done: self._finish_render(key, done))
+        return future
+
+    def _finish_render(self, key: Tuple[int, int, int],
+                       future: Future) -> None:
+        """Cache tile <key>, which <future> has finished rendering.
+        """
+        if not future.cancelled() and future.exception() is None:
+            self.cache.put(key, future.result())
+        with self._lock:
+            self._pending.pop(key, None)
+
+    def hit(self, x: float, y: float) -> Optional[int]:
+        """Return the position in the snapshot of the leaf at (<x>, <y>),
+        given as fractions of the side of the whole square, or None if there
+        is none.
+
+        As in TMTree.get_tree_at_position, a point on an edge belongs to the
+        rectangle nearer the origin.
+        """
+        coords, ends = self._snapshot.coords, self._snapshot.ends
+        i = 0
+        while i < len(ends):
+            if coords[4 * i] <= x <= coords[4 * i + 2] and \
+                    coords[4 * i + 1] <= y <= coords[4 * i + 3]:
+                if ends[i] == i + 1:
+                    return i
+                i += 1
+            else:
+                i = ends[i]
+        return None
+
+    def search(self, text: str,
+               limit: int = DEFAULT_SEARCH_LIMIT) -> List[int]:
+        """Return the positions in the snapshot of up to <limit> trees whose
+        names contain <text>, ignoring case, in preorder.
+        """
+        text = text.lower()
+        matches = []
+        for index, tree in enumerate(self._trees):
+            if text in str(tree._name).lower():
+                matches.append(index)
+                if len(matches) == limit:
+                    break
+        return matches
+
+    def tree_at(self, index: int) -> TMTree:
+        """Return the tree at position <index> in the snapshot.
+        """
+        return self._trees[index]
+
+    def describe(self, index: int) -> Dict[str, object]:
+        """Return the name, path, size and bounds of the tree at position
+        <index> in the snapshot, for the JSON endpoints.
+        """
+        tree = self._trees[index]
+        return {'name': tree._name, 'path': tree.get_path_string(),
+                'size': tree.data_size,
+                'leaf': self._snapshot.ends[index] == index + 1,
+                'bounds': list(self._snapshot.coords[4 * index:
+                                                     4 * index + 4])}
+
+    def info(self) -> Dict[str, object]:
+        """Return a description of the snapshot and the cache, for the /info
+        endpoint.
+        """
+        return {'trees': len(self._trees), 'tile_size': TILE_SIZE,
+                'max_zoom': MAX_ZOOM, 'separator': self._separator,
+                'cached_tiles': len(self.cache),
+                'cached_bytes': self.cache.size(),
+                'cache_hits': self.cache.hits,
+                'cache_misses': self.cache.misses,
+                'cache_evictions': self.cache.evictions}
+
+
+class _TileHandler(BaseHTTPRequestHandler):
+    """The handler of each request to a tile server.
+    """
+    server: ThreadingHTTPServer
+
+    def do_GET(self) -> None:
+        """Answer a GET request for a tile, a hit-test, a search or the
+        description of the snapshot.
+        """
+        tiles = self.server.tiles
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        parts = url.path.strip('/').split('/')
+        try:
+            if len(parts) == 4 and parts[0] == 'tiles' and \
+                    parts[3].endswith('.png'):
+                tile = tiles.get_tile(int(parts[1]), int(parts[2]),
+                                      int(parts[3][:-4]))
+                self._send(200, 'image/png', tile)
+            elif url.path == '/hit':
+                index = tiles.hit(float(query['x'][0]), float(query['y'][0]))
+                self._send_json(None if index is None
+                                else tiles.describe(index))
+            elif url.path == '/search':
+                limit = int(query.get('limit', [DEFAULT_SEARCH_LIMIT])[0])
+                self._send_json([tiles.describe(index) for index in
+                                 tiles.search(query['q'][0], limit)])
+            elif url.path in ('/', '/info'):
+                self._send_json(tiles.info())
+            else:
+                self._send_json({'error': 'not found'}, 404)
+        except (KeyError, ValueError) as error:
+            self._send_json({'error': str(error)}, 400)
+
+    def _send(self, status: int, content_type: str, body: bytes) -> None:
+        """Send a response with the given <status>, <content_type> and
+        <body>.
+        """
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, value: object, status: int = 200) -> None:
+        """Send <value> as a JSON response with the given <status>.
+        """
+        self._send(status, 'application/json', json.dumps(value).encode())
+
+    def log_message(self, *args: object) -> None:
+        """Do not log each request.
+        """
+
+
+def make_server(tree: TMTree, host: str = 'localhost', port: int = 8148,
+                cache_bytes: int = DEFAULT_CACHE_BYTES,
+                workers: int = 0) -> ThreadingHTTPServer:
+    """Return an HTTP server of tiles of <tree> at <host> and <port>, which
+    has not started serving yet. If <port> is 0, any free port is used.
+
+    The server's tiles attribute is its TreemapTiles, which must be closed
+    once the server is shut down.
+    """
+    server = ThreadingHTTPServer((host, port), _TileHandler)
+    server.daemon_threads = True
+    server.tiles = TreemapTiles(tree, cache_bytes, workers)
+    return server
+
+
+def load_test(base_url: str, requests: int = 1000, concurrency: int = 8,
+              max_zoom: int = 8, seed: int = 0) -> Dict[str, float]:
+    """Request <requests> random tiles, of zoom levels up to <max_zoom>, from
+    the tile server at <base_url>, <concurrency> at a time, and return the
+    tiles per second, the median and 99th percentile latency in seconds, and
+    the number of errors.
+
+    Tiles at lower zoom levels are asked for more often, as when browsing.
+    """
+    rng = random.Random(seed)
+    urls = []
+    for _ in range(requests):
+        z = min(int(rng.expovariate(0.5)), max_zoom)
+        urls.append('{}/tiles/{}/{}/{}.png'.format(
+            base_url, z, rng.randrange(1 << z), rng.randrange(1 << z)))
+
+    def fetch(url: str) -> float:
+        start = time.perf_counter()
+        try:
+            with urlopen(url) as response:
+                response.read()
+        except OSError:
+            return -1.0
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        latencies = list(pool.map(fetch, urls))
+    elapsed = time.perf_counter() - start
+
+    served = sorted(latency for latency in latencies if latency >= 0)
+    if not served:
+        return {'tiles_per_second': 0.0, 'p50': 0.0, 'p99': 0.0,
+                'errors': len(latencies)}
+    return {'tiles_per_second': len(served) / elapsed,
+            'p50': served[len(served) // 2],
+            'p99': served[min(len(served) - 1, int(len(served) * 0.99))],
+            'errors': len(latencies) - len(served)}
+
+
+def main(args: List[str]) -> int:
+    """Serve tiles of the folder named in the command line arguments <args>
+    until interrupted, and return the exit status.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('path', help='the folder to scan and serve')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=8148)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='processes rendering tiles')
+    parser.add_argument('--cache-mb', type=int,
+                        default=DEFAULT_CACHE_BYTES // (1024 * 1024),
+                        help='size of the tile cache, in megabytes')
+    options = parser.parse_args(args)
+
+    tree = FileSystemTree(options.path, disk_usage=True,
+                          workers=options.workers)
+    server = make_server(tree, options.host, options.port,
+                         options.cache_mb * 1024 * 1024, options.workers)
+    print('Serving {} at http://{}:{}/'.format(options.path,
+                                               *server.server_address[:2]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.tiles.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -19,21 +19,220 @@ computer's file system.
 from __future__ import annotations
 import os
 import math
+from hashlib import blake2b
 from random import randint
-from typing import List, Tuple, Optional
+from stat import S_ISDIR
+from array import array
+from bisect import bisect_left
+from itertools import count, islice
+from operator import itemgetter
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Callable, Dict, Iterable, List, Tuple, Optional, Set, \
+    Union
+from tm_profile import PROFILER
+
+# Hashes of trees are unsigned 64-bit integers
+_HASH_MASK = (1 << 64) - 1
+
+# The number of entries a scanning process records before handing the rest
+# of its folders back to the shared queue, for an idle process to pick up.
+_SHARD_BUDGET = 20000
+
+# The source of the times at which trees are expanded and collapsed, which
+# only ever increase
+_EXPANSION_CLOCK = count(1)
+
+# The metrics of a FileSystemTree scanned with metrics set: the apparent size
+# of its files, the space allocated to them on disk, and how many there are
+FILE_METRICS = ['bytes', 'allocated', 'files']
+
+
+class _ChildList(dict):
+    """The subtrees of a tree, in drawing order.
+
+    This behaves like a list of trees, but removing any tree, appending a
+    tree and finding the last tree each take constant time, even when there
+    are millions of subtrees. Finding the tree at any other position takes
+    time proportional to that position.
+
+    It is stored as a dict from each subtree to its position key, in order of
+    position key, so that iterating over it, taking its length and checking
+    whether it is empty run at the speed of a list.
+
+    A tree can be put back with the key it had before it was removed, using
+    restore, which returns it to the same place among the other subtrees.
+    The order is only repaired by settle, so putting back many trees costs a
+    single pass over the subtrees.
+
+    === Private Attributes ===
+    _next_key:
+        A key greater than that of any subtree added so far.
+    _restored:
+        The trees put back out of order since the subtrees were last in
+        order of position key.
+
+    === Representation Invariants ===
+    - Apart from the trees in _restored, the subtrees are in order of
+      position key.
+    """
+    __slots__ = ['_next_key', '_restored']
+    _next_key: int
+    _restored: List[TMTree]
+
+    def __init__(self, trees: Iterable[TMTree] = ()) -> None:
+        """Initialize a new _ChildList holding <trees>, in order.
+        """
+        trees = list(trees)
+        dict.__init__(self, zip(trees, range(len(trees))))
+        self._next_key = len(trees)
+        self._restored = []
+
+    def __eq__(self, other: object) -> bool:
+        """Return True iff <other> is a list or _ChildList holding the same
+        trees in the same order.
+        """
+        if isinstance(other, (list, _ChildList)):
+            return len(self) == len(other) and list(self) == list(other)
+        return NotImplemented
+
+    def __ne__(self, other: object) -> bool:
+        """Return True iff <other> is not equal to this _ChildList.
+        """
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    def __getitem__(self, index: Union[int, slice]
+                    ) -> Union[TMTree, List[TMTree]]:
+        """Return the subtree at position <index>, or a list of the subtrees
+        in the slice <index>.
+        """
+        if isinstance(index, slice):
+            return list(self)[index]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('subtree index out of range')
+        if index == len(self) - 1:
+            return next(reversed(self))
+        return next(islice(self, index, None))
+
+    def __delitem__(self, index: int) -> None:
+        """Remove the subtree at position <index>.
+        """
+        self.remove(self[index])
+
+    def __repr__(self) -> str:
+        """Return a representation of the subtrees, as a list.
+        """
+        return repr(list(self))
+
+    def __reduce__(self) -> Tuple[type, Tuple[List[TMTree]]]:
+        """Return how to copy or pickle this _ChildList: as a list of its
+        subtrees, in order.
+        """
+        return _ChildList, (list(self),)
+
+    def append(self, tree: TMTree) -> None:
+        """Add <tree> as the last subtree.
+        """
+        dict.__setitem__(self, tree, self._next_key)
+        self._next_key += 1
+
+    def remove(self, tree: TMTree) -> None:
+        """Remove <tree> from the subtrees.
+
+        Raise a ValueError if <tree> is not one of them.
+        """
+        if self.pop(tree, None) is None:
+            raise ValueError('tree is not a subtree')
+
+    def index(self, tree: TMTree) -> int:
+        """Return the position of <tree> among the subtrees.
+
+        Raise a ValueError if <tree> is not one of them.
+        """
+        return list(self).index(tree)
+
+    def insert(self, index: int, tree: TMTree) -> None:
+        """Add <tree> so that it is at position <index> among the subtrees.
+        """
+        trees = list(self)
+        trees.insert(index, tree)
+        self._replace(trees)
+
+    def sort(self, key: Optional[Callable] = None,
+             reverse: bool = False) -> None:
+        """Sort the subtrees in place, as list.sort does.
+        """
+        self._replace(sorted(self, key=key, reverse=reverse))
+
+    def _replace(self, trees: List[TMTree]) -> None:
+        """Make <trees> the subtrees, in order, with keys greater than any
+        given out before.
+        """
+        start = self._next_key
+        self.clear()
+        self.update(zip(trees, range(start, start + len(trees))))
+        self._next_key = start + len(trees)
+        self._restored = []
+
+    def key_of(self, tree: TMTree) -> int:
+        """Return the position key of <tree>.
+
+        Precondition: <tree> is one of the subtrees.
+        """
+        return dict.__getitem__(self, tree)
+
+    def restore(self, tree: TMTree, key: int) -> None:
+        """Add <tree> back with the position key <key> that it had before it
+        was removed. Until settle is called, <tree> may be out of place.
+
+        Precondition: <key> was given out by this _ChildList, and no subtree
+        has it now.
+        """
+        dict.__setitem__(self, tree, key)
+        if key < self._next_key - 1:
+            self._restored.append(tree)
+
+    def settle(self) -> None:
+        """Put the subtrees back in order of position key, after restore.
+        """
+        if not self._restored:
+            return
+        # Take out the trees that were put back, then merge them, in order,
+        # into the rest, which are still in order
+        restored = sorted(((self.pop(tree), tree) for tree in self._restored
+                           if tree in self), key=itemgetter(0))
+        self._restored = []
+        trees, keys = list(self), list(self.values())
+        new_trees, new_keys = [], []
+        start = 0
+        for key, tree in restored:
+            end = bisect_left(keys, key, start)
+            new_trees.extend(trees[start:end])
+            new_trees.append(tree)
+            new_keys.extend(keys[start:end])
+            new_keys.append(key)
+            start = end
+        new_trees.extend(trees[start:])
+        new_keys.extend(keys[start:])
+        self.clear()
+        self.update(zip(new_trees, new_keys))
+
 
 class TMTree:
     """A TreeMappableTree: a tree that is compatible with the treemap
     visualiser.
 
     This is an abstract class that should not be instantiated directly.
+    Subclasses must implement get_separator and get_suffix, and may override
+    opens_subtrees and finish_layout to change how they are laid out.
 
-    You may NOT add any attributes, public or private, to this class.
-    However, part of this asignment will involve you implementing new public
-    *methods* for this interface.
-    You should not add any new public methods other than those required by
-    the client code.
-    You can, however, freely add private methods as needed.
+    Beyond the tree itself, each tree keeps the state that lets the treemap
+    stay fast on large trees: when it was expanded and collapsed, so that
+    collapsing takes constant time; its hash, kept up to date by every
+    edit; and, optionally, the metrics it can be sized by. The attributes
+    and their invariants are below.
 
     === Public Attributes ===
     rect:
@@ -48,17 +247,36 @@ class TMTree:
     _name:
         The root value of this tree, or None if this tree is empty.
     _subtrees:
-        The subtrees of this tree.
+        The subtrees of this tree, in drawing order, which can be removed or
+        added in constant time.
     _parent_tree:
         The parent tree of this tree; i.e., the tree that contains this tree
         as a subtree, or None if this tree is not part of a larger tree.
-    _expanded:
-        Whether or not this tree is considered expanded for visualization.
+    _shown_since:
+        The time at which this tree was last expanded, or -1 if it has been
+        collapsed since. Trees start out expanded, at time 0.
+    _reset_at:
+        The time at which this tree was last collapsed or expanded on its
+        own, either of which collapses every tree within it, or 0 if it never
+        has been.
+    _hash:
+        A hash of this tree's name and of its contents: its data_size (or
+        all of its metrics) if it is a leaf, or else the hashes of its
+        subtrees.
+    _child_hash_sum:
+        The sum of the hashes of the subtrees of this tree, modulo 2 ** 64.
+    _metrics:
+        The value of each of the metrics named by get_metric_names for this
+        tree, or None if data_size is the only measure of this tree.
+    _metric:
+        The position in _metrics of the metric that data_size holds. Only set
+        if _metrics is not None.
 
     === Representation Invariants ===
     - data_size >= 0
     - If _subtrees is not empty, then data_size is equal to the sum of the
-      data_size of each subtree.
+      data_size of each subtree. A folder left with no subtrees by move keeps
+      its data_size, as a leaf does.
 
     - _colour's elements are each in the range 0-255.
 
@@ -68,29 +286,51 @@ class TMTree:
 
     - if _parent_tree is not None, then self is in _parent_tree._subtrees
 
-    - if _expanded is True, then _parent_tree._expanded is True
-    - if _expanded is False, then _expanded is False for every tree
-      in _subtrees
-    - if _subtrees is empty, then _expanded is False
+    - A tree is expanded if it is the root and _shown_since >= 0, or if
+      its parent is expanded and its _shown_since >= the parent's _reset_at.
+      So collapsing a tree collapses every tree within it in constant time,
+      and expanding it again leaves the trees within it collapsed.
+
+    - _shown_since is -1 or a time no later than the current time, and
+      _reset_at is 0 or such a time. Times come from _EXPANSION_CLOCK.
+
+    - _child_hash_sum is the sum of the _hash of each subtree, modulo 2 ** 64
+
+    - _hash is the value _compute_hash returns for this tree, except while
+      a batch of edits is being applied, which recomputes it when the batch
+      finishes.
+
+    - If _metrics is not None, then _metrics[_metric] == data_size, and if
+      _subtrees is not empty, each of _metrics is equal to the sum of that
+      metric over the subtrees, which all have the same _metric.
     """
 
     rect: Tuple[int, int, int, int]
     data_size: int
     _colour: Tuple[int, int, int]
     _name: Optional[str]
-    _subtrees: List[TMTree]
+    _subtrees: _ChildList
     _parent_tree: Optional[TMTree]
-    _expanded: bool
+    _shown_since: int
+    _reset_at: int
+    _hash: int
+    _child_hash_sum: int
+    _metrics: Optional[List[int]]
+    _metric: int
 
     def __init__(self, name: str, subtrees: List[TMTree],
-                 data_size: int = 0) -> None:
+                 data_size: int = 0, metrics: Optional[List[int]] = None,
+                 metric: int = 0) -> None:
         """Initialize a new TMTree with a random colour and the provided <name>.
 
         If <subtrees> is empty, use <data_size> to initialize this tree's
-        data_size.
+        data_size. If <metrics> is also given, it holds the value of every
+        metric for this tree instead, and data_size is set to the one at
+        position <metric>.
 
-        If <subtrees> is not empty, ignore the parameter <data_size>,
-        and calculate this tree's data_size instead.
+        If <subtrees> is not empty, ignore the parameters <data_size>,
+        <metrics> and <metric>, and calculate this tree's data_size instead.
+        If every subtree has metrics, each is totalled over the subtrees.
 
         Set this tree as the parent for each of its subtrees.
 
@@ -98,17 +338,32 @@ class TMTree:
         """
         self.rect = (0, 0, 0, 0)
         self._name = name
-        self._subtrees = subtrees[:]
+        self._subtrees = _ChildList(subtrees)
         self._parent_tree = None
-        self._expanded = True
+        self._shown_since = 0
+        self._reset_at = 0
 
         self._colour = (randint(0, 255), randint(0, 255), randint(0, 255))
 
         self.data_size = data_size
+        if self._subtrees:
+            self._metrics = _total_metrics(self._subtrees)
+            if self._metrics is not None:
+                self._metric = self._subtrees[-1]._metric
+        elif metrics is not None and name is not None:
+            self._metrics = list(metrics)
+            self._metric = metric
+            self.data_size = self._metrics[metric]
+        else:
+            self._metrics = None
         self._sum_size()
 
+        self._child_hash_sum = 0
         for tree in self._subtrees:
             tree._parent_tree = self
+            self._child_hash_sum += tree._hash
+        self._child_hash_sum &= _HASH_MASK
+        self._hash = self._compute_hash()
 
     def _sum_size(self) -> int:
         """Return the total data_size of this tree
@@ -116,7 +371,7 @@ class TMTree:
         if self.is_empty():
             self.data_size = 0
 
-        elif self._subtrees == []:
+        elif not self._subtrees:
             pass
 
         else:
@@ -136,14 +391,70 @@ class TMTree:
         else:
             return self._parent_tree._get_root()
 
+    def _compute_hash(self) -> int:
+        """Return the hash of this tree, from its name and either its
+        data_size (for a leaf) or the hashes of its subtrees.
+
+        The hashes of the subtrees are summed, so reordering the subtrees of
+        a tree does not change its hash. A leaf with metrics is hashed by
+        all of them, so switching metrics does not change its hash.
+        """
+        digest = blake2b(str(self._name).encode(), digest_size=8)
+        if not self._subtrees and self._metrics is not None:
+            digest.update(b'\2' + str(self._metrics).encode())
+        elif not self._subtrees:
+            digest.update(b'\0' + str(self.data_size).encode())
+        else:
+            digest.update(b'\1' + self._child_hash_sum.to_bytes(8, 'little'))
+        return int.from_bytes(digest.digest(), 'little')
+
+    def _rehash(self) -> None:
+        """Recompute the hash of this tree, and update the hashes of its
+        ancestors to match.
+        """
+        tree = self
+        new_hash = tree._compute_hash()
+        while new_hash != tree._hash:
+            old_hash = tree._hash
+            tree._hash = new_hash
+            parent = tree._parent_tree
+            if parent is None:
+                break
+            parent._child_hash_sum = \
+                (parent._child_hash_sum - old_hash + new_hash) & _HASH_MASK
+            tree = parent
+            new_hash = tree._compute_hash()
+
+    def get_hash(self) -> int:
+        """Return a hash of the contents of this tree.
+
+        Two trees with the same hash have, with overwhelming probability, the
+        same names, leaf sizes and shape, so the hash can be used to detect
+        whether a subtree has changed, or as a cache key. The hash is kept up
+        to date by move and change_size, and is the same between runs of the
+        program.
+        """
+        return self._hash
+
+    def get_name(self) -> Optional[str]:
+        """Return the name of this tree, or None if it is empty.
+        """
+        return self._name
+
+    def get_subtrees(self) -> List[TMTree]:
+        """Return a new list of the subtrees of this tree, in drawing order.
+        """
+        return list(self._subtrees)
+
     def is_empty(self) -> bool:
         """Return True iff this tree is empty.
         """
         return self._name is None
 
-    def _divide_rects(self, rect: Tuple[int, int, int, int]) -> None:
+    def _divide_rects(self, rect: Tuple[int, int, int, int]) -> int:
         """Divide the subtrees contained in this tree using the formula stated
-        in the assignment description.
+        in the assignment description, and return the number of trees whose
+        rectangles were updated.
 
         Prerequisite: self is not a leaf.
         """
@@ -152,44 +463,81 @@ class TMTree:
 
         if width > height:
             nx = x
+            last = self._subtrees[-1]
             for tree in self._subtrees:
                 nw = math.floor((abs(x - width) *
                                  (tree.data_size / self.data_size)))
-                if tree == self._subtrees[-1] and (nx + nw - x) != width:
+                if tree is last and (nx + nw - x) != width:
                     nw = (width + x) - nx
                 pairings.append((nx, nw))
                 nx += nw
 
-            for tree, coords in zip(self._subtrees, pairings):
-                tree.update_rectangles((coords[0], y, coords[1], height))
+            reset = self._reset_at
+            return sum(tree._layout((coords[0], y, coords[1], height),
+                                    tree._shown_since >= reset)
+                       for tree, coords in zip(self._subtrees, pairings))
 
         else:
             ny = y
+            last = self._subtrees[-1]
             for tree in self._subtrees:
                 nh = math.floor((abs(y - height) *
                                  (tree.data_size / self.data_size)))
-                if tree == self._subtrees[-1] and (ny + nh - y) != height:
+                if tree is last and (ny + nh - y) != height:
                     nh = (height + y) - ny
                 pairings.append((ny, nh))
                 ny += nh
 
-            for tree, coords in zip(self._subtrees, pairings):
-                tree.update_rectangles((x, coords[0], width, coords[1]))
+            reset = self._reset_at
+            return sum(tree._layout((x, coords[0], width, coords[1]),
+                                    tree._shown_since >= reset)
+                       for tree, coords in zip(self._subtrees, pairings))
 
+    @PROFILER.phase('update_rectangles')
     def update_rectangles(self, rect: Tuple[int, int, int, int]) -> None:
         """Update the rectangles in this tree and its descendents using the
         treemap algorithm to fill the area defined by pygame rectangle <rect>.
         """
+        PROFILER.count('nodes laid out',
+                       self._layout(rect, self._is_expanded()))
+
+    def _layout(self, rect: Tuple[int, int, int, int], expanded: bool) -> int:
+        """Update the rectangles in this tree and its descendents to fill
+        <rect>, and return the number of trees whose rectangles were updated.
+
+        <expanded> is whether or not this tree is expanded.
+        """
         if self.is_empty() or self.data_size == 0:
-            pass
+            return 0
 
-        elif self._subtrees == [] or not self._expanded:
+        elif not self._subtrees or not expanded:
             self.rect = rect
+            return 1
 
         else:
             self.rect = rect
-            self._divide_rects(rect)
+            return 1 + self._divide_rects(rect)
+
+    def opens_subtrees(self, area: float) -> bool:
+        """Return whether the subtrees of this tree are laid out when it is
+        expanded and its rectangle covers <area> square pixels: by default,
+        whenever it has any.
+
+        A subclass may override this to lay out small trees as leaves, as
+        StoredTree does; NormalizedLayout then calls it for every expanded
+        tree it lays out.
+        """
+        return bool(self._subtrees)
+
+    def finish_layout(self, layout: NormalizedLayout) -> None:
+        """Finish applying <layout>, whose first tree is this tree, once
+        every rectangle in it has been set. Nothing is left to do by default.
+
+        NormalizedLayout.apply calls this, so that a subclass can update
+        whatever else depends on which trees were laid out.
+        """
 
+    @PROFILER.phase('get_rectangles')
     def get_rectangles(self) -> List[Tuple[Tuple[int, int, int, int],
                                            Tuple[int, int, int]]]:
         """Return a list with tuples for every leaf in the displayed-tree
@@ -197,21 +545,34 @@ class TMTree:
         appropriate pygame rectangle to display for a leaf, and the colour
         to fill it with.
         """
-        if self._expanded:
+        rects = []
+        self._collect_rectangles(rects, self._is_expanded())
+        PROFILER.count('rectangles', len(rects))
+        return rects
+
+    def _collect_rectangles(self, rects: List[Tuple[Tuple[int, int, int, int],
+                                                    Tuple[int, int, int]]],
+                            expanded: bool) -> None:
+        """Append the rectangle and colour of every leaf in the displayed-tree
+        rooted at this tree to <rects>. <expanded> is whether or not this
+        tree is expanded.
+        """
+        if expanded:
             if self.is_empty():
-                return []
+                pass
 
-            elif self._subtrees == []:
-                return [(self.rect, self._colour)]
+            elif not self._subtrees:
+                rects.append((self.rect, self._colour))
 
             else:
-                rects = []
+                reset = self._reset_at
                 for tree in self._subtrees:
-                    rects.extend(tree.get_rectangles())
-                return rects
+                    tree._collect_rectangles(rects,
+                                             tree._shown_since >= reset)
         else:
-            return [(self.rect, self._colour)]
+            rects.append((self.rect, self._colour))
 
+    @PROFILER.phase('get_tree_at_position')
     def get_tree_at_position(self, pos: Tuple[int, int]) -> Optional[TMTree]:
         """Return the leaf in the displayed-tree rooted at this tree whose
         rectangle contains position <pos>, or None if <pos> is outside of this
@@ -220,49 +581,202 @@ class TMTree:
         If <pos> is on the shared edge between two rectangles, return the
         tree represented by the rectangle that is closer to the origin.
         """
+        match, visited = self._find(pos, self._is_expanded())
+        PROFILER.count('nodes visited', visited)
+        return match
+
+    def _find(self, pos: Tuple[int, int],
+              expanded: bool) -> Tuple[Optional[TMTree], int]:
+        """Return the leaf in the displayed-tree rooted at this tree whose
+        rectangle contains position <pos>, as in get_tree_at_position, and
+        the number of trees visited to find it.
+        <expanded> is whether or not this tree is expanded.
+        """
         x, y = pos
         lx, ly, ux, uy = self.rect
 
         if self.is_empty():
-            return None
+            return None, 1
 
-        elif self._subtrees == [] or not self._expanded:
+        elif not self._subtrees or not expanded:
             if lx <= x <= lx + ux and ly <= y <= ly + uy:
-                return self
+                return self, 1
 
             else:
-                return None
+                return None, 1
 
         else:
             matches = []
+            visited = 1
+            reset = self._reset_at
             for tree in self._subtrees:
-                match = tree.get_tree_at_position(pos)
+                match, count = tree._find(pos, tree._shown_since >= reset)
+                visited += count
                 if match is not None:
                     matches.append(match)
 
             #TIE BREAKER
-            return _break_ties(matches)
-
+            return _break_ties(matches), visited
 
+    @PROFILER.phase('update_data_sizes')
     def update_data_sizes(self) -> int:
         """Update the data_size for this tree and its subtrees, based on the
-        size of their leaves, and return the new size.
+        size of their leaves, and return the new size. Every metric of
+        this tree and its subtrees is totalled in the same pass.
 
         If this tree is a leaf, return its size unchanged.
         """
-        return self._sum_size()
+        if self.is_empty():
+            self.data_size = 0
+            return 0
+
+        # Folders are totalled deepest first, so each is totalled once, from
+        # subtrees that are already up to date
+        folders = []
+        stack = [self]
+        while stack:
+            tree = stack.pop()
+            if tree._subtrees:
+                folders.append(tree)
+                stack.extend(tree._subtrees)
+        for tree in reversed(folders):
+            metrics = None
+            if tree._metrics is not None:
+                metrics = _total_metrics(tree._subtrees)
+            if metrics is not None:
+                tree._metrics = metrics
+                tree.data_size = metrics[tree._metric]
+            else:
+                tree.data_size = sum(subtree.data_size
+                                     for subtree in tree._subtrees)
+        return self.data_size
+
+    def get_metric_names(self) -> List[str]:
+        """Return the names of the metrics this tree can be sized by, in the
+        order of its _metrics, or an empty list if it has none.
+        """
+        return []
+
+    def get_metric(self) -> Optional[str]:
+        """Return the name of the metric that data_size currently holds, or
+        None if this tree has no metrics.
+        """
+        if self._metrics is None:
+            return None
+        else:
+            return self.get_metric_names()[self._metric]
+
+    def get_metrics(self) -> Dict[str, int]:
+        """Return the value of each metric of this tree, keyed by name.
+        """
+        if self._metrics is None:
+            return {}
+        else:
+            return dict(zip(self.get_metric_names(), self._metrics))
+
+    @PROFILER.phase('set_metric')
+    def set_metric(self, name: str, relayout: bool = True) -> None:
+        """Size every tree in the whole tree containing this tree by the
+        metric called <name>, which was totalled when the tree was built, so
+        nothing has to be scanned or read again. If <relayout>, the whole
+        tree is laid out again in its current rectangle.
+
+        Hashes already cover every metric, so they are left as they are;
+        layouts cached by hash must be thrown away by the caller.
+
+        Raise a ValueError if <name> is not one of get_metric_names().
+        """
+        names = self.get_metric_names()
+        if name not in names:
+            raise ValueError('no metric named {!r}'.format(name))
+        index = names.index(name)
+
+        root = self._get_root()
+        stack = [root]
+        while stack:
+            tree = stack.pop()
+            if tree._metrics is not None:
+                tree.data_size = tree._metrics[index]
+                tree._metric = index
+            stack.extend(tree._subtrees)
+        if relayout:
+            root.update_rectangles(root.rect)
 
     def move(self, destination: TMTree) -> None:
         """If this tree is a leaf, and <destination> is not a leaf, move this
         tree to be the last subtree of <destination>. Otherwise, do nothing.
         """
-        if self._subtrees != [] or destination._subtrees == []:
+        if self._subtrees or not destination._subtrees:
             pass
         else:
-            self._parent_tree._subtrees.remove(self)
-            self._parent_tree.update_data_sizes()
-            destination._subtrees.append(self)
-            destination.update_data_sizes()
+            # Adjusting the two parents' sizes by this tree's size gives the
+            # same result as update_data_sizes, without visiting every
+            # sibling. A parent left with no subtrees keeps its size, as a
+            # leaf does.
+            old_parent = self._parent_tree
+            self._detach()
+            if old_parent._subtrees:
+                old_parent.data_size -= self.data_size
+                _add_metrics(old_parent, self._metrics, -1)
+            self._attach(destination)
+            destination.data_size += self.data_size
+            _add_metrics(destination, self._metrics, 1)
+
+    def _detach(self, rehash: bool = True) -> int:
+        """Remove this tree from the subtrees of its parent, and return the
+        position key it had among them, which _attach can use to put it back
+        in the same place.
+
+        If <rehash>, the hashes of its former ancestors are updated;
+        otherwise only the sum of the hashes of its parent's subtrees is.
+        Their data sizes are not updated.
+
+        Precondition: self._parent_tree is not None
+        """
+        parent = self._parent_tree
+        index = parent._subtrees.key_of(self)
+        parent._subtrees.remove(self)
+        self._parent_tree = None
+        parent._child_hash_sum = \
+            (parent._child_hash_sum - self._hash) & _HASH_MASK
+        if rehash:
+            parent._rehash()
+        return index
+
+    def _attach(self, parent: TMTree, index: Optional[int] = None,
+                rehash: bool = True) -> None:
+        """Add this tree to the subtrees of <parent>, in the place given by
+        the position key <index> from _detach, or as the last subtree if
+        <index> is None.
+
+        If <rehash>, the hashes of its new ancestors are updated and the
+        subtrees of <parent> are put back in order; otherwise only the sum of
+        the hashes of its parent's subtrees is updated, and the caller must
+        settle the subtrees of <parent>. Their data sizes are not updated.
+
+        Precondition: self._parent_tree is None
+        """
+        if index is None:
+            parent._subtrees.append(self)
+        else:
+            parent._subtrees.restore(self, index)
+        self._parent_tree = parent
+        parent._child_hash_sum = \
+            (parent._child_hash_sum + self._hash) & _HASH_MASK
+        if rehash:
+            parent._subtrees.settle()
+            parent._rehash()
+
+    def transaction(self, journal: Optional[EditJournal] = None,
+                    relayout: bool = True) -> TMTransaction:
+        """Return a new transaction for making many edits to the whole tree
+        containing this tree at once.
+
+        The edits are recorded in <journal> so they can be undone, if it is
+        not None. If <relayout>, the whole tree is laid out again in its
+        current rectangle once the edits are applied.
+        """
+        return TMTransaction(self._get_root(), journal, relayout)
 
     def change_size(self, factor: float) -> None:
         """Change the value of this tree's data_size attribute by <factor>.
@@ -272,39 +786,75 @@ class TMTree:
 
         Do nothing if this tree is not a leaf.
         """
-        if self._subtrees != [] or self.is_empty():
+        if self._subtrees or self.is_empty():
             pass
 
         else:
-            change = math.ceil(self.data_size * (abs(factor)))
-            #Set polarity of change
-            change *= int(factor / abs(factor))
-
-            self.data_size += change
-
-    def expand(self) -> None:
+            self.data_size += self._size_change(factor)
+            if self._metrics is not None:
+                self._metrics[self._metric] = self.data_size
+            self._rehash()
+
+    def _size_change(self, factor: float) -> int:
+        """Return the amount that change_size(<factor>) would add to this
+        tree's data_size.
+        """
+        change = math.ceil(self.data_size * (abs(factor)))
+        #Set polarity of change
+        change *= int(factor / abs(factor))
+        return change
+
+    def _is_expanded(self) -> bool:
+        """Return whether or not this tree is expanded, which depends on
+        every tree on the path to the root.
+        """
+        tree = self
+        while tree._parent_tree is not None:
+            if tree._shown_since < tree._parent_tree._reset_at:
+                return False
+            tree = tree._parent_tree
+        return tree._shown_since >= 0
+
+    def expand(self, relayout: bool = True) -> None:
         """Expand this tree, so that it's subtrees are shown.
         If this tree is expanded, or a leaf, do nothing.
+
+        If <relayout>, this tree is laid out again in its rectangle;
+        otherwise that is left to the caller.
         """
-        if self._expanded or self._subtrees == []:
+        if not self._subtrees or self._is_expanded():
             pass
 
         else:
-            self._expanded = True
-            self.update_rectangles(self.rect)
-
-    def expand_all(self) -> None:
+            # Taking the time as the reset time too leaves every tree within
+            # this one collapsed, whatever was expanded before it collapsed.
+            now = next(_EXPANSION_CLOCK)
+            self._shown_since = now
+            self._reset_at = now
+            if relayout:
+                self.update_rectangles(self.rect)
+
+    def expand_all(self, relayout: bool = True) -> None:
         """Expand this tree, and all trees within it.
         If this tree is exanded, or a leaf, do nothing.
+
+        Every tree within it is marked as expanded first, so the tree is
+        laid out only once, and only if <relayout>.
         """
-        if self._expanded or self._subtrees == []:
+        if not self._subtrees or self._is_expanded():
             pass
 
         else:
-            self._expanded = True
-            self.update_rectangles(self.rect)
-            for tree in self._subtrees:
-                tree.expand_all()
+            folders = []
+            stack = [self]
+            while stack:
+                tree = stack.pop()
+                if tree._subtrees:
+                    folders.append(tree)
+                    stack.extend(tree._subtrees)
+            TMTree.mark_expanded(folders)
+            if relayout:
+                self.update_rectangles(self.rect)
 
     def collapse(self) -> None:
         """Collapse the selected group of trees.
@@ -317,16 +867,10 @@ class TMTree:
             self._parent_tree._collapse_sub()
 
     def _collapse_sub(self) -> None:
-        """Collapse all subtrees of this tree.
+        """Collapse this tree and all trees within it, in constant time.
         """
-        self._expanded = False
-
-        if self._subtrees == []:
-            pass
-
-        else:
-            for tree in self._subtrees:
-                tree._collapse_sub()
+        self._shown_since = -1
+        self._reset_at = next(_EXPANSION_CLOCK)
 
     def collapse_all(self) -> None:
         """Collapse every tree contained in the root of this tree.
@@ -334,6 +878,20 @@ class TMTree:
         root = self._get_root()
         root._collapse_sub()
 
+    @staticmethod
+    def mark_expanded(trees: Iterable[TMTree]) -> None:
+        """Mark every tree in <trees> as expanded, all at one new time, and as
+        never having been collapsed, so that each of their subtrees is
+        expanded as well unless it was collapsed itself.
+
+        The trees are not laid out again. This lets expand_all, and the
+        expand_all of a subclass, expand many trees in a single pass.
+        """
+        now = next(_EXPANSION_CLOCK)
+        for tree in trees:
+            tree._shown_since = now
+            tree._reset_at = 0
+
 
     # Methods for the string representation
     def get_path_string(self, final_node: bool = True) -> str:
@@ -367,6 +925,27 @@ class TMTree:
         raise NotImplementedError
 
 # HELPER FUNCTIONS
+def _total_metrics(trees: Iterable[TMTree]) -> Optional[List[int]]:
+    """Return the total of each metric over <trees>, or None if any of them
+    has no metrics.
+    """
+    columns = [tree._metrics for tree in trees]
+    if None in columns:
+        return None
+    return [sum(column) for column in zip(*columns)]
+
+
+def _add_metrics(tree: TMTree, metrics: Optional[List[int]],
+                 sign: int) -> None:
+    """Add <metrics>, times <sign>, to the metrics of <tree>, if both have
+    metrics, and keep the metric in data_size equal to data_size.
+    """
+    if tree._metrics is not None and metrics is not None:
+        tree._metrics = [total + sign * value
+                         for total, value in zip(tree._metrics, metrics)]
+        tree._metrics[tree._metric] = tree.data_size
+
+
 def _break_ties(matches: List[TMTree]) -> TMTree:
     """Return the TMTree in matches that is clostest to (0,0)
     """
@@ -386,6 +965,497 @@ def _break_ties(matches: List[TMTree]) -> TMTree:
         return None
 
 
+class NormalizedLayout:
+    """A treemap layout that does not depend on the size of the window.
+
+    The rectangle of each tree is stored as fractions of the whole area, so
+    the layout only needs to be computed once; fitting it to a rectangle of
+    any size just scales those fractions, which costs one step per displayed
+    tree rather than a run of the treemap algorithm.
+
+    Subtrees are divided along the longer side of their rectangle, which
+    depends on the aspect ratio of the area the layout was computed for. The
+    layout keeps those directions when it is scaled to a rectangle of a
+    different shape.
+
+    A layout computed for a pygame rectangle holds exactly the rectangles
+    that update_rectangles would give each tree in it, so the treemap shown
+    is the one that the treemap algorithm computes; scaled to any other
+    rectangle, the edges may differ from it by a pixel.
+
+    === Public Attributes ===
+    trees:
+        The trees of the displayed-tree that have a rectangle, in preorder.
+    coords:
+        The left, top, right and bottom edges of the rectangle of each tree,
+        as fractions of the width or height of the whole area.
+    ends:
+        For each tree, the position in trees just after its last descendant.
+    """
+    trees: List[TMTree]
+    coords: array
+    ends: array
+
+    def __init__(self, tree: TMTree, aspect: float = 1.0,
+                 pixels: float = 1.0,
+                 rect: Optional[Tuple[int, int, int, int]] = None) -> None:
+        """Compute the layout of the displayed-tree rooted at <tree>, in an
+        area whose width is <aspect> times its height.
+
+        <pixels> is the number of pixels that the area is expected to cover.
+        If the class of <tree> overrides opens_subtrees, as StoredTree does,
+        the subtrees of each expanded tree are only laid out if
+        opens_subtrees, given the number of square pixels of its rectangle,
+        returns True.
+
+        If <rect> is given, the layout is computed in that pygame rectangle,
+        in whole pixels, just as update_rectangles does, and <aspect> and
+        <pixels> are ignored.
+        """
+        opens = type(tree).opens_subtrees
+        if opens is TMTree.opens_subtrees:
+            opens = None
+        self.trees = []
+        self.coords = array('d')
+        parents = []
+        if rect is not None:
+            self._divide_pixels(tree, rect, opens, parents)
+        else:
+            self._divide(tree, aspect, pixels, opens, parents)
+
+        self.ends = array('l', range(1, len(self.trees) + 1))
+        for index in range(len(self.trees) - 1, 0, -1):
+            parent = parents[index]
+            self.ends[parent] = max(self.ends[parent], self.ends[index])
+
+    def _divide(self, tree: TMTree, aspect: float, pixels: float,
+                opens: Optional[Callable], parents: List[int]) -> None:
+        """Add every tree in the displayed-tree rooted at <tree> to this
+        layout, with its rectangle as fractions of an area whose width is
+        <aspect> times its height and which covers <pixels> pixels, and
+        append the position of its parent in trees to <parents>.
+        """
+        stack = []
+        if not tree.is_empty() and tree.data_size != 0:
+            stack.append((tree, tree._is_expanded(), -1, 0.0, 0.0, 1.0, 1.0))
+
+        while stack:
+            tree, expanded, parent, left, top, right, bottom = stack.pop()
+            index = len(self.trees)
+            self.trees.append(tree)
+            self.coords.extend((left, top, right, bottom))
+            parents.append(parent)
+            if opens is None:
+                if not tree._subtrees or not expanded:
+                    continue
+            elif not expanded or \
+                    not opens(tree, (right - left) * (bottom - top) * pixels):
+                continue
+
+            horizontal = (right - left) * aspect > bottom - top
+            start, end = (left, right) if horizontal else (top, bottom)
+            children = []
+            total = tree.data_size
+            reset = tree._reset_at
+            running = 0
+            for subtree in tree._subtrees:
+                before = running
+                running += subtree.data_size
+                if subtree.is_empty() or subtree.data_size == 0:
+                    continue
+                low = start + (end - start) * before / total
+                high = end if running >= total else \
+                    start + (end - start) * running / total
+                shown = subtree._shown_since >= reset
+                if horizontal:
+                    children.append((subtree, shown, index, low, top, high,
+                                     bottom))
+                else:
+                    children.append((subtree, shown, index, left, low, right,
+                                     high))
+            stack.extend(reversed(children))
+
+    def _divide_pixels(self, tree: TMTree, rect: Tuple[int, int, int, int],
+                       opens: Optional[Callable], parents: List[int]) -> None:
+        """Add every tree in the displayed-tree rooted at <tree> to this
+        layout, with the rectangle that update_rectangles would give it in
+        <rect> as fractions of <rect>, and append the position of its parent
+        in trees to <parents>.
+        """
+        x0, y0, width0, height0 = rect
+        scale_x = 1 / max(width0, 1)
+        scale_y = 1 / max(height0, 1)
+        stack = []
+        if not tree.is_empty() and tree.data_size != 0:
+            stack.append((tree, tree._is_expanded(), -1, rect))
+
+        while stack:
+            tree, expanded, parent, (x, y, width, height) = stack.pop()
+            index = len(self.trees)
+            self.trees.append(tree)
+            self.coords.extend(((x - x0) * scale_x, (y - y0) * scale_y,
+                                (x + width - x0) * scale_x,
+                                (y + height - y0) * scale_y))
+            parents.append(parent)
+            if opens is None:
+                if not tree._subtrees or not expanded:
+                    continue
+            elif not expanded or not opens(tree, width * height):
+                continue
+
+            # The same steps as _divide_rects, including its scaling by
+            # abs(x - width), so the rectangles match it exactly
+            if width > height:
+                position, extent = x, width
+            else:
+                position, extent = y, height
+            start = position
+            children = []
+            total = tree.data_size
+            reset = tree._reset_at
+            last = tree._subtrees[-1]
+            for subtree in tree._subtrees:
+                length = math.floor(abs(start - extent) *
+                                    (subtree.data_size / total))
+                if subtree is last and position + length - start != extent:
+                    length = extent + start - position
+                low = position
+                position += length
+                if subtree.is_empty() or subtree.data_size == 0:
+                    continue
+                shown = subtree._shown_since >= reset
+                if width > height:
+                    children.append((subtree, shown, index,
+                                     (low, y, length, height)))
+                else:
+                    children.append((subtree, shown, index,
+                                     (x, low, width, length)))
+            stack.extend(reversed(children))
+
+    def apply(self, rect: Tuple[int, int, int, int]) -> None:
+        """Set the rectangle of every tree in this layout, scaled to fill the
+        pygame rectangle <rect>.
+
+        Edges are rounded to the nearest pixel, so neighbouring rectangles
+        always meet without gaps or overlaps.
+        """
+        x, y, width, height = rect
+        coords = self.coords
+        lefts = [x + math.floor(v * width + 0.5) for v in coords[0::4]]
+        tops = [y + math.floor(v * height + 0.5) for v in coords[1::4]]
+        rights = [x + math.floor(v * width + 0.5) for v in coords[2::4]]
+        bottoms = [y + math.floor(v * height + 0.5) for v in coords[3::4]]
+        for tree, left, top, right, bottom in zip(self.trees, lefts, tops,
+                                                  rights, bottoms):
+            tree.rect = (left, top, right - left, bottom - top)
+        if self.trees:
+            self.trees[0].finish_layout(self)
+
+
+class TMTransaction:
+    """A batch of moves and size changes to a tree, applied all at once.
+
+    Edits are queued by calling move and change_size on the transaction, and
+    applied by commit, or at the end of a with statement:
+
+        with tree.transaction(journal) as edits:
+            edits.move(leaf, folder)
+            edits.change_size(other_leaf, 0.5)
+
+    However many edits there are, the data sizes of the tree are updated
+    once, by adding up the change in size under each affected folder and
+    passing each total up to the root, and the tree is laid out once.
+
+    === Private Attributes ===
+    _root:
+        The root of the tree being edited.
+    _journal:
+        Where the edits are recorded so they can be undone, or None.
+    _relayout:
+        Whether or not to lay the tree out again once the edits are applied.
+    _edits:
+        The queued edits, in order: either ('move', tree, destination) or
+        ('resize', tree, factor).
+    """
+    _root: TMTree
+    _journal: Optional[EditJournal]
+    _relayout: bool
+    _edits: List[tuple]
+
+    def __init__(self, root: TMTree, journal: Optional[EditJournal] = None,
+                 relayout: bool = True) -> None:
+        """Initialize a new, empty transaction on the tree rooted at <root>.
+        """
+        self._root = root
+        self._journal = journal
+        self._relayout = relayout
+        self._edits = []
+
+    def __enter__(self) -> TMTransaction:
+        """Return this transaction, for use in a with statement.
+        """
+        return self
+
+    def __exit__(self, exc_type: Optional[type], *args: object) -> None:
+        """Commit this transaction, unless the with statement raised an
+        error.
+        """
+        if exc_type is None:
+            self.commit()
+
+    def move(self, tree: TMTree, destination: TMTree) -> None:
+        """Queue a move of <tree> to be the last subtree of <destination>, as
+        in TMTree.move.
+        """
+        self._edits.append(('move', tree, destination))
+
+    def change_size(self, tree: TMTree, factor: float) -> None:
+        """Queue a change of the size of <tree> by <factor>, as in
+        TMTree.change_size.
+        """
+        self._edits.append(('resize', tree, factor))
+
+    def commit(self) -> None:
+        """Apply every queued edit, then update the data sizes and hashes of
+        the tree and lay it out.
+
+        Edits that TMTree.move or TMTree.change_size would ignore are
+        skipped, and are not recorded in the journal.
+        """
+        records = []
+        batch = _EditBatch()
+        for kind, tree, argument in self._edits:
+            if kind == 'move':
+                if not tree._subtrees and argument._subtrees and \
+                        tree._parent_tree is not None:
+                    records.append(batch.apply(
+                        ('move', tree, tree._parent_tree, None, argument),
+                        False))
+            elif not tree._subtrees and not tree.is_empty():
+                batch.settle(tree)
+                records.append(batch.apply(
+                    ('resize', tree, tree.data_size,
+                     tree.data_size + tree._size_change(argument)), False))
+        batch.finish()
+
+        self._edits = []
+        if self._journal is not None and records != []:
+            self._journal.record(records)
+        if self._relayout:
+            self._root.update_rectangles(self._root.rect)
+
+
+class EditJournal:
+    """A record of the transactions applied to a tree, so they can be undone
+    and redone.
+
+    Each transaction is recorded as the list of edits it made, with just
+    enough information to reverse each one: for a move, the tree, where it
+    was and where it went; for a size change, the tree and its sizes before
+    and after.
+
+    === Private Attributes ===
+    _root:
+        The root of the tree whose edits are recorded.
+    _undo:
+        The transactions that can be undone, most recent last.
+    _redo:
+        The transactions that were undone and can be redone, most recently
+        undone last.
+    """
+    _root: TMTree
+    _undo: List[List[tuple]]
+    _redo: List[List[tuple]]
+
+    def __init__(self, root: TMTree) -> None:
+        """Initialize a new, empty journal for the tree rooted at <root>.
+        """
+        self._root = root
+        self._undo = []
+        self._redo = []
+
+    def record(self, records: List[tuple]) -> None:
+        """Record a newly applied transaction, which made the edits in
+        <records>. Transactions that were undone can no longer be redone.
+        """
+        self._undo.append(records)
+        self._redo = []
+
+    def can_undo(self) -> bool:
+        """Return True iff there is a transaction to undo.
+        """
+        return self._undo != []
+
+    def can_redo(self) -> bool:
+        """Return True iff there is an undone transaction to redo.
+        """
+        return self._redo != []
+
+    def undo(self, relayout: bool = True) -> None:
+        """Undo the most recent transaction, if there is one, as a single
+        batch. If <relayout>, lay the tree out again afterwards.
+        """
+        if self._undo != []:
+            records = self._undo.pop()
+            _replay(records, True)
+            self._redo.append(records)
+            if relayout:
+                self._root.update_rectangles(self._root.rect)
+
+    def redo(self, relayout: bool = True) -> None:
+        """Redo the most recently undone transaction, if there is one, as a
+        single batch. If <relayout>, lay the tree out again afterwards.
+        """
+        if self._redo != []:
+            records = self._redo.pop()
+            _replay(records, False)
+            self._undo.append(records)
+            if relayout:
+                self._root.update_rectangles(self._root.rect)
+
+
+def _replay(records: List[tuple], backwards: bool) -> None:
+    """Apply the edits in <records>, or reverse them in the opposite order if
+    <backwards>, then update the data sizes and hashes of the tree.
+    """
+    batch = _EditBatch()
+    for record in (reversed(records) if backwards else records):
+        batch.apply(record, backwards)
+    batch.finish()
+
+
+class _EditBatch:
+    """The updates to data sizes and hashes still owed by a batch of edits.
+
+    Rather than walking up to the root after every edit, each edit records
+    the change in size under its folders, and which folders need their hash
+    recomputed. finish then passes each folder's total change in size up to
+    the root once, and recomputes each affected hash once, deepest first.
+
+    === Public Attributes ===
+    deltas:
+        The folder, the change in size under it, and the change in each of
+        its metrics from moves (or None), keyed by the id of the folder.
+    stale:
+        The trees whose hash must be recomputed, keyed by their id.
+    """
+    deltas: Dict[int, List]
+    stale: Dict[int, TMTree]
+
+    def __init__(self) -> None:
+        """Initialize a new batch with no updates owed.
+        """
+        self.deltas = {}
+        self.stale = {}
+
+    def apply(self, record: tuple, backwards: bool) -> tuple:
+        """Apply the edit in <record>, or reverse it if <backwards>, and
+        return the record with the position that a moved tree was taken from
+        filled in.
+        """
+        tree = record[1]
+        self.settle(tree)
+        if record[0] == 'move':
+            _, _, source, index, destination = record
+            if backwards:
+                tree._detach(False)
+                emptied = not source._subtrees
+                tree._attach(source, index, False)
+            else:
+                index = tree._detach(False)
+                emptied = not source._subtrees
+                tree._attach(destination, rehash=False)
+            sign = -1 if backwards else 1
+            # As in TMTree.move, a folder left with no subtrees keeps its
+            # size, as a leaf does, and so does one given its first subtree
+            # back when this is undone
+            if emptied:
+                self.stale[id(source)] = source
+            else:
+                self._add(source, -sign * tree.data_size, tree._metrics,
+                          -sign)
+            self._add(destination, sign * tree.data_size, tree._metrics, sign)
+            return 'move', tree, source, index, destination
+
+        _, _, old_size, new_size = record
+        if backwards:
+            old_size, new_size = new_size, old_size
+        tree.data_size = new_size
+        if tree._metrics is not None:
+            tree._metrics[tree._metric] = new_size
+        old_hash = tree._hash
+        tree._hash = tree._compute_hash()
+        parent = tree._parent_tree
+        if parent is not None:
+            parent._child_hash_sum = \
+                (parent._child_hash_sum - old_hash + tree._hash) & _HASH_MASK
+            self._add(parent, new_size - old_size)
+        return record
+
+    def _add(self, folder: TMTree, delta: int,
+             metrics: Optional[List[int]] = None, sign: int = 1) -> None:
+        """Record that the size under <folder> changed by <delta>, and its
+        metrics by <metrics> times <sign> if they are not None, and that its
+        hash is stale.
+        """
+        entry = self.deltas.setdefault(id(folder), [folder, 0, None])
+        entry[1] += delta
+        if metrics is not None and folder._metrics is not None:
+            if entry[2] is None:
+                entry[2] = [0] * len(metrics)
+            entry[2] = [total + sign * value
+                        for total, value in zip(entry[2], metrics)]
+        self.stale[id(folder)] = folder
+
+    def settle(self, tree: TMTree) -> None:
+        """Finish the batch so far if <tree> is owed an update.
+
+        This happens when a folder has had all of its subtrees moved out and
+        is about to be edited as a leaf.
+        """
+        if id(tree) in self.deltas or id(tree) in self.stale:
+            self.finish()
+
+    def finish(self) -> None:
+        """Pay every update owed by the batch so far.
+        """
+        for folder, delta, metrics in self.deltas.values():
+            if metrics is not None and not any(metrics):
+                metrics = None
+            tree = folder
+            while tree is not None and (delta != 0 or metrics is not None):
+                tree.data_size += delta
+                if metrics is not None:
+                    _add_metrics(tree, metrics, 1)
+                elif tree._metrics is not None:
+                    tree._metrics[tree._metric] = tree.data_size
+                tree = tree._parent_tree
+        self.deltas.clear()
+
+        # Recompute hashes deepest first, so each is recomputed only once
+        by_depth = {}
+        for tree in self.stale.values():
+            tree._subtrees.settle()
+            depth = 0
+            ancestor = tree._parent_tree
+            while ancestor is not None:
+                depth += 1
+                ancestor = ancestor._parent_tree
+            by_depth.setdefault(depth, {})[id(tree)] = tree
+        self.stale.clear()
+
+        for depth in range(max(by_depth, default=-1), -1, -1):
+            for tree in by_depth.get(depth, {}).values():
+                old_hash = tree._hash
+                tree._hash = tree._compute_hash()
+                parent = tree._parent_tree
+                if parent is not None and tree._hash != old_hash:
+                    parent._child_hash_sum = (parent._child_hash_sum -
+                                              old_hash + tree._hash) \
+                        & _HASH_MASK
+                    by_depth.setdefault(depth - 1, {})[id(parent)] = parent
+
+
 class FileSystemTree(TMTree):
     """A tree representation of files and folders in a file system.
 
@@ -397,13 +1467,57 @@ class FileSystemTree(TMTree):
 
     The data_size attribute for regular files is simply the size of the file,
     as reported by os.path.getsize.
+
+    In disk usage mode, the data_size of a file is instead the space allocated
+    to it on disk, symbolic links are never followed, and a file with several
+    hard links is only counted the first time it is found, like the du
+    command.
+
+    The file system can also be scanned by several processes at once, which
+    helps on network file systems where each folder takes a long time to
+    list. Both disk usage mode and parallel scans use os.scandir and never
+    follow symbolic links.
+
+    A tree scanned with metrics set also records every metric in
+    FILE_METRICS for each file, so that it can be switched between them with
+    set_metric. Like any leaf, an empty folder counts as one file.
+
+    === Public Attributes ===
+    columns:
+        For the root of a tree scanned with rollup set, the extension, owner
+        and modification day of every file in it, which tm_rollup totals by
+        any of those attributes; otherwise None.
     """
+    columns: Optional[FileColumns]
 
-    def __init__(self, path: str) -> None:
+    def __init__(self, path: str, disk_usage: bool = False,
+                 one_file_system: bool = False, workers: int = 1,
+                 rollup: bool = False, metrics: bool = False) -> None:
         """Store the file tree structure contained in the given file or folder.
 
+        If <disk_usage>, measure files by their allocated blocks rather than
+        their apparent size, do not follow symbolic links, and count each hard
+        linked file only once. If <one_file_system>, also skip folders that
+        are on a different device than <path>; this implies <disk_usage>.
+
+        If <workers> is more than 1, scan the file system using that many
+        processes. If <rollup>, also record the attributes of every file in
+        columns, during the same scan. If <metrics>, also record every metric
+        in FILE_METRICS; data_size starts out as 'allocated' in disk usage
+        mode, or 'bytes' otherwise.
+
         Precondition: <path> is a valid path for this computer.
         """
+        self.columns = FileColumns() if rollup else None
+        if disk_usage or one_file_system or workers > 1 or rollup or metrics:
+            root = _scan_tree(path, disk_usage or one_file_system,
+                              one_file_system, workers, self.columns,
+                              metrics)
+            super().__init__(root._name, root._subtrees, root.data_size,
+                             root._metrics,
+                             0 if root._metrics is None else root._metric)
+            return
+
         # Remember that you should recursively go through the file system
         # and create new FileSystemTree objects for each file and folder
         # encountered.
@@ -431,6 +1545,18 @@ class FileSystemTree(TMTree):
         super().__init__(os.path.basename(path), temp_subtrees,
                          os.path.getsize(path))
 
+    @classmethod
+    def _from_scan(cls, name: str, subtrees: List[FileSystemTree],
+                   data_size: int, metrics: Optional[List[int]] = None,
+                   metric: int = 0) -> FileSystemTree:
+        """Return a new FileSystemTree for a file or folder that has already
+        been scanned, without touching the file system again.
+        """
+        tree = cls.__new__(cls)
+        tree.columns = None
+        TMTree.__init__(tree, name, subtrees, data_size, metrics, metric)
+        return tree
+
     def _sum_os_size(self, path: str) -> int:
         """Return the data_size of self
 
@@ -442,7 +1568,7 @@ class FileSystemTree(TMTree):
         elif not os.path.isdir(path):
             return os.path.getsize(path)
 
-        elif self._subtrees == []:
+        elif not self._subtrees:
             return 0
 
         else:
@@ -456,6 +1582,15 @@ class FileSystemTree(TMTree):
         """
         return os.sep
 
+    def get_metric_names(self) -> List[str]:
+        """Return FILE_METRICS if this tree was scanned with metrics, or an
+        empty list otherwise.
+        """
+        if self._metrics is None:
+            return []
+        else:
+            return list(FILE_METRICS)
+
     def get_suffix(self) -> str:
         """Return the final descriptor of this tree.
         """
@@ -465,11 +1600,339 @@ class FileSystemTree(TMTree):
             return ' (folder)'
 
 
+class FileColumns:
+    """The extension, owner and modification day of every file found by a
+    scan, stored as compact columns.
+
+    Files that share an extension, an owner and a day of modification belong
+    to the same group, so each file only costs its size and the number of its
+    group, however many attributes are recorded. The total size and number
+    of files in each group are kept up to date as files are added, so totals
+    by any of the attributes can be computed from the groups alone, without
+    visiting the files again.
+
+    === Public Attributes ===
+    sizes:
+        The size of each file, as counted in the data_size of the tree.
+    groups:
+        The group of each file.
+    keys:
+        The extension (in lower case, with its dot, or '' if there is none),
+        owner user id and day of last modification (counted in days since
+        the start of 1970) of the files in each group.
+    group_sizes:
+        The total size of the files in each group.
+    group_counts:
+        The number of files in each group.
+
+    === Private Attributes ===
+    _codes:
+        The group of each key.
+
+    === Representation Invariants ===
+    - len(sizes) == len(groups)
+    - 0 <= groups[i] < len(keys)
+    - len(group_sizes) == len(group_counts) == len(keys)
+    - _codes[keys[i]] == i
+    """
+    sizes: array
+    groups: array
+    keys: List[Tuple[str, int, int]]
+    group_sizes: List[int]
+    group_counts: List[int]
+    _codes: Dict[Tuple[str, int, int], int]
+
+    def __init__(self) -> None:
+        """Initialize a new FileColumns with no files.
+        """
+        self.sizes = array('q')
+        self.groups = array('l')
+        self.keys = []
+        self.group_sizes = []
+        self.group_counts = []
+        self._codes = {}
+
+    def __len__(self) -> int:
+        """Return the number of files recorded.
+        """
+        return len(self.sizes)
+
+    def add(self, name: str, size: int, owner: int, day: int) -> None:
+        """Record a file named <name> of the given <size>, owned by the user
+        id <owner> and last modified on <day>.
+        """
+        dot = name.rfind('.')
+        key = (name[dot:].lower() if dot > 0 else '', owner, day)
+        group = self._codes.get(key)
+        if group is None:
+            group = self._codes[key] = len(self.keys)
+            self.keys.append(key)
+            self.group_sizes.append(0)
+            self.group_counts.append(0)
+        self.sizes.append(size)
+        self.groups.append(group)
+        self.group_sizes[group] += size
+        self.group_counts[group] += 1
+
+
+class _ScanResult:
+    """The entries of a file system scan, recorded in a compact form that is
+    cheap to send between processes.
+
+    The entries are recorded in preorder, so each folder is followed by its
+    own entries, then by those of its subfolders.
+
+    === Public Attributes ===
+    names:
+        The name of each entry.
+    sizes:
+        The size of each entry, in bytes.
+    counts:
+        The number of entries inside each folder, 0 for a file, or -1 for a
+        folder that was left for another scan to record.
+    links:
+        The (device, inode) pair of each file with more than one hard link,
+        packed into a single int and keyed by the position of its entry.
+    deferred:
+        The paths of the folders with a count of -1, in order.
+    empty_folders:
+        The positions of the folders that have no entries, or could not be
+        listed, which have a count of 0 just as files do.
+    owners:
+        The owner user id of each entry, if attributes are recorded.
+    days:
+        The day on which each entry was last modified, in days since the
+        start of 1970, if attributes are recorded.
+    apparent:
+        The apparent size of each entry, in bytes, if metrics are recorded.
+    allocated:
+        The space allocated to each entry on disk, in bytes, if metrics are
+        recorded.
+    """
+    names: List[str]
+    sizes: array
+    counts: array
+    links: Dict[int, int]
+    deferred: List[str]
+    empty_folders: Set[int]
+    owners: array
+    days: array
+    apparent: array
+    allocated: array
+
+    def __init__(self) -> None:
+        """Initialize a new, empty _ScanResult.
+        """
+        self.names = []
+        self.sizes = array('q')
+        self.counts = array('l')
+        self.links = {}
+        self.deferred = []
+        self.empty_folders = set()
+        self.owners = array('q')
+        self.days = array('q')
+        self.apparent = array('q')
+        self.allocated = array('q')
+
+
+def _scan_records(path: str, disk_usage: bool, device: Optional[int],
+                  budget: Optional[int], attributes: bool = False,
+                  metrics: bool = False) -> _ScanResult:
+    """Return a _ScanResult for the file or folder at <path>.
+
+    If <disk_usage>, record the space allocated to each file rather than its
+    apparent size. If <device> is not None, skip any folder on a different
+    device. If <budget> is not None, then once that many entries are recorded,
+    leave the folders that remain to be listed to other scans. If
+    <attributes>, also record the owner and modification day of each entry.
+    If <metrics>, also record both its apparent and its allocated size.
+
+    Only the stat result of each os.scandir entry is used, so every entry
+    costs at most one system call. Entries that cannot be read are skipped,
+    and folders that cannot be listed are treated as empty.
+    """
+    result = _ScanResult()
+    stack = [(os.path.basename(path), path, os.lstat(path))]
+    while stack:
+        name, entry_path, stat = stack.pop()
+        index = len(result.names)
+        result.names.append(name)
+        # st_blocks is always in units of 512 bytes, but is missing on Windows
+        blocks = getattr(stat, 'st_blocks', None)
+        if disk_usage and blocks is not None:
+            result.sizes.append(blocks * 512)
+        else:
+            result.sizes.append(stat.st_size)
+        if metrics:
+            result.apparent.append(stat.st_size)
+            result.allocated.append(stat.st_size if blocks is None
+                                    else blocks * 512)
+        if attributes:
+            result.owners.append(stat.st_uid)
+            result.days.append(int(stat.st_mtime) // 86400)
+
+        if not S_ISDIR(stat.st_mode):
+            if disk_usage and stat.st_nlink > 1:
+                result.links[index] = (stat.st_dev << 64) | stat.st_ino
+            result.counts.append(0)
+        elif budget is not None and 0 < index and index >= budget:
+            result.counts.append(-1)
+            result.deferred.append(entry_path)
+        else:
+            children = _list_folder(entry_path, device)
+            result.counts.append(len(children))
+            if not children:
+                result.empty_folders.add(index)
+            stack.extend(reversed(children))
+    return result
+
+
+def _scan_deferred(path: str, disk_usage: bool, device: Optional[int],
+                   budget: Optional[int], attributes: bool = False,
+                   metrics: bool = False) -> _ScanResult:
+    """Return a _ScanResult for the folder at <path>, which another scan
+    left to this one, as _scan_records does, or an empty _ScanResult if the
+    folder can no longer be read.
+    """
+    try:
+        return _scan_records(path, disk_usage, device, budget, attributes,
+                             metrics)
+    except OSError:
+        return _ScanResult()
+
+
+def _list_folder(path: str, device: Optional[int]
+                 ) -> List[Tuple[str, str, os.stat_result]]:
+    """Return the name, path and stat result of each entry of the folder at
+    <path>, skipping folders that are not on <device> if it is not None.
+    """
+    try:
+        with os.scandir(path) as it:
+            entries = list(it)
+    except OSError:
+        return []
+
+    children = []
+    for entry in entries:
+        try:
+            stat = entry.stat(follow_symlinks=False)
+        except OSError:
+            continue
+        if device is None or stat.st_dev == device or \
+                not S_ISDIR(stat.st_mode):
+            children.append((entry.name, entry.path, stat))
+    return children
+
+
+def _scan_tree(path: str, disk_usage: bool, one_file_system: bool,
+               workers: int, columns: Optional[FileColumns] = None,
+               metrics: bool = False) -> FileSystemTree:
+    """Return a FileSystemTree for the file or folder at <path>, scanned by
+    <workers> processes, recording the attributes of each file in <columns>
+    if it is not None, and giving each tree FILE_METRICS if <metrics>.
+
+    The folders inside <path> are shared out between the processes. A
+    process that records too many entries hands its remaining folders back
+    to the shared queue, so one huge folder does not leave the other
+    processes idle.
+    """
+    device = os.lstat(path).st_dev if one_file_system else None
+    attributes = columns is not None
+    # The position in FILE_METRICS of the metric that data_size holds
+    metric = (1 if disk_usage else 0) if metrics else None
+    if workers <= 1:
+        top = _scan_records(path, disk_usage, device, None, attributes,
+                            metrics)
+        return _build_records(top, {}, set(), columns, metric)
+
+    top = _scan_records(path, disk_usage, device, 0, attributes, metrics)
+    results = {}
+    with ProcessPoolExecutor(workers) as pool:
+        pending = {pool.submit(_scan_deferred, folder, disk_usage, device,
+                               _SHARD_BUDGET, attributes, metrics): folder
+                   for folder in top.deferred}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                result = future.result()
+                results[pending.pop(future)] = result
+                for folder in result.deferred:
+                    pending[pool.submit(_scan_deferred, folder, disk_usage,
+                                        device, _SHARD_BUDGET, attributes,
+                                        metrics)] = folder
+    return _build_records(top, results, set(), columns, metric)
+
+
+def _build_records(result: _ScanResult, results: Dict[str, _ScanResult],
+                   seen: Set[int], columns: Optional[FileColumns] = None,
+                   metric: Optional[int] = None) -> FileSystemTree:
+    """Return the FileSystemTree recorded in <result>, taking each deferred
+    folder from <results>, and record each file in <columns> if it is not
+    None. If <metric> is not None, give each file the metrics in
+    FILE_METRICS, with data_size holding the one at position <metric>.
+
+    A deferred folder whose _ScanResult is empty, since it vanished before it
+    was scanned, becomes an empty folder, as it would in a scan by one
+    process.
+
+    <seen> holds the packed (device, inode) pairs of the hard linked files
+    already counted; any other link to one of them is given a size of 0.
+    Only files with more than one link are recorded in <seen>, which keeps it
+    small even for very large scans.
+    """
+    deferred = iter(result.deferred)
+    # Each frame holds a folder's name, size, count and finished subtrees
+    stack = []
+    tree = None
+    for index, name in enumerate(result.names):
+        count = result.counts[index]
+        size = result.sizes[index]
+        counted = False
+        if index in result.links:
+            if result.links[index] in seen:
+                size = 0
+                counted = True
+            seen.add(result.links[index])
+
+        is_file = count == 0 and index not in result.empty_folders
+        if count == -1:
+            scanned = results[next(deferred)]
+            if not scanned.names:
+                count = 0
+
+        if count > 0:
+            stack.append((name, size, count, []))
+            continue
+        elif count == -1:
+            tree = _build_records(scanned, results, seen, columns, metric)
+        elif metric is not None:
+            # A hard link that was already counted takes up no more space
+            if counted:
+                metrics = [0, 0, 1]
+            else:
+                metrics = [result.apparent[index], result.allocated[index], 1]
+            tree = FileSystemTree._from_scan(name, [], size, metrics, metric)
+        else:
+            tree = FileSystemTree._from_scan(name, [], size)
+        if is_file and columns is not None:
+            columns.add(name, size, result.owners[index], result.days[index])
+
+        while stack and len(stack[-1][3]) == stack[-1][2] - 1:
+            name, size, _, subtrees = stack.pop()
+            subtrees.append(tree)
+            tree = FileSystemTree._from_scan(name, subtrees, size)
+        if stack:
+            stack[-1][3].append(tree)
+    return tree
+
+
 if __name__ == '__main__':
     # x = FileSystemTree(test_path)
     import python_ta
     python_ta.check_all(config={
         'allowed-import-modules': [
-            'python_ta', 'typing', 'math', 'random', 'os', '__future__'
+            'python_ta', 'typing', 'math', 'random', 'os', 'hashlib', 'stat',
+            'array', 'bisect', 'itertools', 'operator', 'concurrent.futures',
+            'tm_profile', '__future__'
         ]
     })
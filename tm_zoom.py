@@ -0,0 +1,148 @@
+"""Assignment 2: Zooming into a treemap
+
+=== Module Description ===
+This module lets the treemap visualiser zoom into any subtree, so that it
+fills the whole window, and then zoom back out one level at a time.
+
+Only the subtree in focus is laid out, as a NormalizedLayout, so that it
+can be fitted to a window of any size without running the treemap algorithm
+again. The layouts of the last few levels zoomed through are cached, so
+zooming back out just scales the layout that was computed before. A cached
+layout is only reused if the hash of its subtree (see TMTree.get_hash) has
+not changed since it was computed, so a change of size or structure under a
+subtree invalidates its layout.
+"""
+from __future__ import annotations
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+from tm_trees import NormalizedLayout, TMTree
+
+# The number of zoom levels whose layouts are cached
+ZOOM_CACHE_SIZE = 4
+
+
+class ZoomView:
+    """The part of a tree that the visualiser is currently showing.
+
+    === Public Attributes ===
+    root:
+        The whole tree being visualised.
+
+    === Private Attributes ===
+    _path:
+        The trees from root down to the tree in focus, inclusive.
+    _rect:
+        The rectangle that the tree in focus is laid out to fill.
+    _cache:
+        The most recently used layouts, keyed by the id of the tree laid out,
+        least recently used first. Each is stored with the tree and the hash
+        that the tree had when it was laid out.
+
+    === Representation Invariants ===
+    - _path[0] is root
+    - _path[i + 1] is a subtree of _path[i]
+    - len(_cache) <= ZOOM_CACHE_SIZE
+    """
+    root: TMTree
+    _path: List[TMTree]
+    _rect: Tuple[int, int, int, int]
+    _cache: Dict[int, Tuple[TMTree, int, NormalizedLayout]]
+
+    def __init__(self, root: TMTree, rect: Tuple[int, int, int, int]) -> None:
+        """Initialize a new ZoomView of the whole of <root>, laid out in
+        <rect>.
+        """
+        self.root = root
+        self._path = [root]
+        self._rect = rect
+        self._cache = OrderedDict()
+
+    def focus(self) -> TMTree:
+        """Return the tree that is currently in focus.
+        """
+        return self._path[-1]
+
+    def zoom_in(self, tree: TMTree) -> None:
+        """Make <tree> the tree in focus, and lay it out. If <tree> is a leaf,
+        focus on its parent instead.
+
+        Do nothing if <tree> is not inside the tree in focus.
+        """
+        if not tree._subtrees and tree._parent_tree is not None:
+            tree = tree._parent_tree
+        path = []
+        while tree is not None and tree is not self.focus():
+            path.append(tree)
+            tree = tree._parent_tree
+        if tree is not None and path != []:
+            self._path.extend(reversed(path))
+            self.layout()
+
+    def zoom_out(self, levels: int = 1) -> None:
+        """Move the focus up by <levels> trees, or to the root if that is
+        fewer levels away, and lay it out.
+        """
+        levels = min(levels, len(self._path) - 1)
+        if levels > 0:
+            del self._path[-levels:]
+            self.layout()
+
+    def get_breadcrumbs(self) -> str:
+        """Return the names of the trees from the root down to the tree in
+        focus, separated as in a path.
+        """
+        separator = self.root.get_separator()
+        return separator.join(str(tree._name) for tree in self._path)
+
+    def resize(self, rect: Tuple[int, int, int, int]) -> None:
+        """Fit the tree in focus to <rect> from now on.
+
+        If the tree has not changed, its layout is only rescaled, which takes
+        time proportional to the number of displayed trees.
+        """
+        self._rect = rect
+        self.layout()
+
+    def invalidate(self) -> None:
+        """Forget every cached layout.
+
+        This must be called whenever a tree is expanded or collapsed, or
+        switched to another metric, since that does not change any hash.
+        """
+        self._cache.clear()
+
+    def layout(self) -> None:
+        """Lay out the tree in focus, reusing its cached layout if it is
+        still valid. A new layout gives every tree the rectangle that
+        update_rectangles would; a cached one is rescaled to the current
+        rectangle.
+
+        The data sizes of the tree must already be up to date.
+        """
+        focus = self.focus()
+        cached = self._cache.get(id(focus))
+        if cached is not None and cached[0] is focus and \
+                cached[1] == focus.get_hash():
+            self._cache.move_to_end(id(focus))
+            layout = cached[2]
+        else:
+            layout = NormalizedLayout(focus, rect=self._rect)
+            self._cache[id(focus)] = (focus, focus.get_hash(), layout)
+            while len(self._cache) > ZOOM_CACHE_SIZE:
+                self._cache.popitem(last=False)
+        layout.apply(self._rect)
+
+    def get_tree_at_position(self, pos: Tuple[int, int]) -> Optional[TMTree]:
+        """Return the leaf in the displayed-tree of the tree in focus whose
+        rectangle contains <pos>, as in TMTree.get_tree_at_position.
+        """
+        return self.focus().get_tree_at_position(pos)
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'python_ta', 'typing', 'collections', 'tm_trees', '__future__'
+        ]
+    })
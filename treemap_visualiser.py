@@ -19,13 +19,20 @@ to them.
 """
 from typing import Optional, Tuple
 import pygame
-from tm_trees import TMTree, FileSystemTree
+from tm_trees import EditJournal, TMTree, FileSystemTree
 from papers import PaperTree
+from tm_diff import build_diff_tree
+from tm_rollup import EXTENSION, OWNER, build_rollup_tree
+from tm_approx import ApproxRefiner, ApproxTree
+from tm_store import open_store
+from tm_profile import PROFILER
+from tm_zoom import ZoomView
 
 
 # Screen dimensions and coordinates
 ORIGIN = (0, 0)
 # You may adjust these values as you'd like, depending on your screen resolution
+# These are the starting size of the window; the user may then resize it.
 WIDTH = 800  # 1024
 HEIGHT = 600  # 768
 FONT_HEIGHT = 30                       # The height of the text display.
@@ -34,41 +41,56 @@ TREEMAP_HEIGHT = HEIGHT - FONT_HEIGHT  # The height of the treemap display.
 # Font to use for the treemap program.
 FONT_FAMILY = 'Consolas'
 
+# Where to save the profile when the user asks for it.
+PROFILE_FILE = 'treemap_profile.json'
 
-def run_visualisation(tree: TMTree) -> None:
+
+def run_visualisation(tree: TMTree,
+                      refiner: Optional[ApproxRefiner] = None) -> None:
     """Display an interactive graphical display of the given tree's treemap.
+
+    If <refiner> is not None, the estimates in the tree are replaced as it
+    finishes scanning them.
     """
 
     # Setup pygame
     pygame.init()
-    screen = pygame.display.set_mode((WIDTH, HEIGHT))
+    screen = pygame.display.set_mode((WIDTH, HEIGHT), pygame.RESIZABLE)
 
     # Render the initial display of the static treemap.
+    view = ZoomView(tree, (0, 0, WIDTH, TREEMAP_HEIGHT))
+    view.layout()
     render_display(screen, tree, None, None)
-    tree.update_rectangles((0, 0, WIDTH, HEIGHT - FONT_HEIGHT))
 
     # Start an event loop to respond to events.
-    event_loop(screen, tree)
+    event_loop(screen, view, refiner)
 
 
+@PROFILER.phase('render_display')
 def render_display(screen: pygame.Surface, tree: Optional[TMTree],
                    selected_node: Optional[TMTree],
-                   hover_node: Optional[TMTree]) -> None:
+                   hover_node: Optional[TMTree], caption: str = '') -> None:
     """Render a treemap and text display to the given screen.
 
-    Use the constants TREEMAP_HEIGHT and FONT_HEIGHT to divide the
-    screen vertically into the treemap and text comments.
+    Use the constant FONT_HEIGHT to divide the screen vertically into the
+    treemap and text comments. If no node is selected, display <caption> as
+    the text instead.
     """
+    width, height = screen.get_size()
+
     # First, clear the screen
     pygame.draw.rect(screen, pygame.color.THECOLORS['black'],
-                     (0, 0, WIDTH, HEIGHT))
+                     (0, 0, width, height))
 
-    subscreen = screen.subsurface((0, 0, WIDTH, TREEMAP_HEIGHT))
+    subscreen = screen.subsurface((0, 0, width,
+                                   max(height - FONT_HEIGHT, 0)))
 
     # TODO: Uncomment this afer you have completed Task 2
-    for rect, colour in tree.get_rectangles():
+    rectangles = tree.get_rectangles()
+    for rect, colour in rectangles:
         # Note that the arguments are in the opposite order
         pygame.draw.rect(subscreen, colour, rect)
+    PROFILER.count('rectangles drawn', len(rectangles))
 
     # add the hover rectangle
     if selected_node is not None:
@@ -77,12 +99,16 @@ def render_display(screen: pygame.Surface, tree: Optional[TMTree],
         pygame.draw.rect(subscreen, (255, 255, 255), hover_node.rect, 2)
 
     # TODO: Uncomment this after you have completed Task 2
-    _render_text(screen, _get_display_text(selected_node))
+    _render_text(screen, _get_display_text(selected_node) or caption)
+
+    if PROFILER.enabled:
+        _render_profile(screen)
 
     # This must be called *after* all other pygame functions have run.
-    pygame.display.flip()
+    PROFILER.call('display.flip', pygame.display.flip)
 
 
+@PROFILER.phase('_render_text')
 def _render_text(screen: pygame.Surface, text: str) -> None:
     """Render text at the bottom of the display.
     """
@@ -91,26 +117,67 @@ def _render_text(screen: pygame.Surface, text: str) -> None:
     text_surface = font.render(text, 1, pygame.color.THECOLORS['white'])
 
     # Where to render the text_surface
-    text_pos = (0, HEIGHT - FONT_HEIGHT + 4)
+    text_pos = (0, screen.get_height() - FONT_HEIGHT + 4)
     screen.blit(text_surface, text_pos)
 
 
-def event_loop(screen: pygame.Surface, tree: TMTree) -> None:
+def _render_profile(screen: pygame.Surface) -> None:
+    """Render the profile of the last frame over the top left corner of the
+    treemap.
+    """
+    font = pygame.font.SysFont(FONT_FAMILY, 14)
+    for i, line in enumerate(PROFILER.summary_lines()):
+        text_surface = font.render(line, 1, pygame.color.THECOLORS['white'],
+                                   pygame.color.THECOLORS['black'])
+        screen.blit(text_surface, (4, 4 + 16 * i))
+
+
+def event_loop(screen: pygame.Surface, view: ZoomView,
+               refiner: Optional[ApproxRefiner] = None) -> None:
     """Respond to events (mouse clicks, key presses) and update the display.
 
     Note that the event loop is an *infinite loop*: it continually waits for
     the next event, determines the event's type, and then updates the state
     of the visualisation or the tree itself, updating the display if necessary.
     This loop ends only when the user closes the window.
+
+    Pressing Z zooms into the selected node, so that it fills the window, and
+    pressing B zooms back out one level. Resizing the window rescales the
+    current layout rather than computing it again.
+
+    Changes of size and moves can be undone by pressing U, and redone by
+    pressing R.
+
+    Pressing N sizes the tree by its next metric, if it has more than one,
+    which only lays it out again.
+
+    Pressing P turns profiling, and its display over the treemap, on or off.
+    Pressing O saves the profile recorded so far to PROFILE_FILE.
+
+    If <refiner> is not None, estimated folders that it has finished
+    scanning are put into the tree, and the tree laid out again, between
+    events.
     """
     selected_node = None
+    journal = EditJournal(view.root)
 
     while True:
+        PROFILER.next_frame()
+        tree = view.focus()
+
         # Wait for an event
         event = pygame.event.poll()
         if event.type == pygame.QUIT:
+            if refiner is not None:
+                refiner.stop()
             return
 
+        if refiner is not None and refiner.apply() > 0:
+            if selected_node is not None and selected_node is not \
+                    view.root and selected_node._parent_tree is None:
+                selected_node = None
+            view.layout()
+
         # get the hover position and the corresponding node
         hover_node = tree.get_tree_at_position(pygame.mouse.get_pos())
 
@@ -118,43 +185,98 @@ def event_loop(screen: pygame.Surface, tree: TMTree) -> None:
             selected_node = \
                 _handle_click(event.button, event.pos, tree, selected_node)
 
+        elif event.type == pygame.KEYUP and event.key == pygame.K_p:
+            if PROFILER.enabled:
+                PROFILER.disable()
+            else:
+                PROFILER.clear()
+                PROFILER.enable()
+
+        elif event.type == pygame.KEYUP and event.key == pygame.K_o:
+            PROFILER.dump_json(PROFILE_FILE)
+
+        elif event.type == pygame.VIDEORESIZE:
+            width, height = max(event.w, 1), max(event.h, FONT_HEIGHT + 1)
+            if pygame.version.vernum < (2, 0, 0):
+                screen = pygame.display.set_mode((width, height),
+                                                 pygame.RESIZABLE)
+            view.resize((0, 0, width, height - FONT_HEIGHT))
+
+        elif event.type == pygame.KEYUP and event.key == pygame.K_u:
+            journal.undo(relayout=False)
+            view.layout()
+
+        elif event.type == pygame.KEYUP and event.key == pygame.K_r:
+            journal.redo(relayout=False)
+            view.layout()
+
+        elif event.type == pygame.KEYUP and event.key == pygame.K_n:
+            names = view.root.get_metric_names()
+            if len(names) > 1:
+                index = names.index(view.root.get_metric())
+                view.root.set_metric(names[(index + 1) % len(names)], False)
+                view.invalidate()
+                view.layout()
+
+        elif event.type == pygame.KEYUP and event.key == pygame.K_b:
+            view.zoom_out()
+            selected_node = None
+
+        elif event.type == pygame.KEYUP and event.key == pygame.K_z:
+            if selected_node is not None:
+                view.zoom_in(selected_node)
+                selected_node = None
+
         elif event.type == pygame.KEYUP and selected_node is not None:
             if event.key == pygame.K_UP:
                 # TODO: Uncomment once you have completed Task 4
-                selected_node.change_size(0.01)
-                tree.update_data_sizes()
-                tree.update_rectangles((0, 0, WIDTH, HEIGHT - FONT_HEIGHT))
+                with view.root.transaction(journal, False) as edits:
+                    edits.change_size(selected_node, 0.01)
+                view.layout()
 
             elif event.key == pygame.K_DOWN:
                 # TODO: Uncomment once you have completed Task 4
-                selected_node.change_size(-0.01)
-                tree.update_data_sizes()
-                tree.update_rectangles((0, 0, WIDTH, HEIGHT - FONT_HEIGHT))
+                with view.root.transaction(journal, False) as edits:
+                    edits.change_size(selected_node, -0.01)
+                view.layout()
 
             elif event.key == pygame.K_m:
                 # TODO: Uncomment once you have completed Task 4
-                selected_node.move(hover_node)
-                tree.update_data_sizes()
-                tree.update_rectangles((0, 0, WIDTH, HEIGHT - FONT_HEIGHT))
+                if hover_node is not None:
+                    with view.root.transaction(journal, False) as edits:
+                        edits.move(selected_node, hover_node)
+                    view.layout()
 
             elif event.key == pygame.K_e:
                 # TODO: Uncomment once you have completed Task 5
-                selected_node.expand()
+                selected_node.expand(False)
+                view.invalidate()
+                view.layout()
 
             elif event.key == pygame.K_a:
                 # TODO: Uncomment once you have completed Task 5
-                selected_node.expand_all()
+                selected_node.expand_all(False)
+                view.invalidate()
+                view.layout()
 
             elif event.key == pygame.K_c:
                 # TODO: Uncomment once you have completed Task 5
                 selected_node.collapse()
+                view.invalidate()
+                view.layout()
 
             elif event.key == pygame.K_x:
                 # TODO: Uncomment once you have completed Task 5
                 selected_node.collapse_all()
+                view.invalidate()
+                view.layout()
 
         # Update display
-        render_display(screen, tree, selected_node, hover_node)
+        caption = ''
+        if view.focus() is not view.root:
+            caption = 'Zoomed into ' + view.get_breadcrumbs()
+        render_display(screen, view.focus(), selected_node, hover_node,
+                       caption)
 
 
 def _handle_click(button: int, pos: Tuple[int, int], tree: TMTree,
@@ -184,16 +306,22 @@ def _get_display_text(leaf: Optional[TMTree]) -> str:
     """
     if leaf is None:
         return ''
-    else:
+    elif leaf.get_metric() is None:
         return leaf.get_path_string() + '  ({})'.format(leaf.data_size)
+    else:
+        return leaf.get_path_string() + '  ({} {})'.format(leaf.data_size,
+                                                           leaf.get_metric())
 
 
-def run_treemap_file_system(path: str) -> None:
+def run_treemap_file_system(path: str, metrics: bool = False) -> None:
     """Run a treemap visualisation for the given path's file structure.
+    If <metrics>, it can be sized by any of the metrics in FILE_METRICS,
+    which are recorded by a scan that does not follow symbolic links and
+    counts each hard linked file once.
 
     Precondition: <path> is a valid path to a file or folder.
     """
-    file_tree = FileSystemTree(path)
+    file_tree = FileSystemTree(path, metrics=metrics)
     run_visualisation(file_tree)
 
 
@@ -207,11 +335,59 @@ def run_treemap_papers() -> None:
     run_visualisation(paper_tree)
 
 
+def run_treemap_diff(old_path: str, new_path: str) -> None:
+    """Run a treemap visualisation of the changes between two file
+    structures, coloured by growth.
+
+    Precondition: <old_path> and <new_path> are valid paths to files or
+    folders.
+    """
+    diff_tree = build_diff_tree(FileSystemTree(old_path),
+                                FileSystemTree(new_path))
+    run_visualisation(diff_tree)
+
+
+def run_treemap_approx(path: str) -> None:
+    """Run a treemap visualisation of the disk usage of the given path's
+    file structure that starts from estimates of the sizes of its folders,
+    shown in grey, and refines them as they are scanned.
+
+    Precondition: <path> is a valid path to a file or folder.
+    """
+    approx_tree = ApproxTree(path, disk_usage=True)
+    refiner = ApproxRefiner(approx_tree, disk_usage=True)
+    refiner.start()
+    run_visualisation(approx_tree, refiner)
+
+
+def run_treemap_store(path: str) -> None:
+    """Run a treemap visualisation of the tree saved in the store at <path>
+    by tm_store, loading only the parts of it that are on the screen.
+
+    Precondition: <path> is a valid path to a store.
+    """
+    run_visualisation(open_store(path))
+
+
+def run_treemap_rollup(path: str, by: Tuple[str, ...] = (OWNER, EXTENSION)
+                       ) -> None:
+    """Run a treemap visualisation of the files in the given path's file
+    structure, grouped by each of the attributes in <by> in turn: any of
+    EXTENSION, OWNER and AGE from tm_rollup.
+
+    Precondition: <path> is a valid path to a file or folder.
+    """
+    file_tree = FileSystemTree(path, disk_usage=True, rollup=True)
+    run_visualisation(build_rollup_tree(file_tree.columns, by,
+                                        name=file_tree._name))
+
+
 if __name__ == '__main__':
     import python_ta
     python_ta.check_all(config={
         'allowed-import-modules': [
-            'python_ta', 'typing', 'pygame', 'tm_trees', 'papers'
+            'python_ta', 'typing', 'pygame', 'tm_trees', 'papers', 'tm_diff',
+            'tm_profile', 'tm_zoom', 'tm_rollup', 'tm_approx', 'tm_store'
         ],
         'generated-members': 'pygame.*'
     })